@@ -0,0 +1,139 @@
+"""
+Alert Dispatcher
+-------------------------------------------
+
+Turns the alarm bits polled from the PLC into a small number of emails.
+Every alarm is tracked on its own, so a new alarm is reported even while
+another one is still active, and an alarm that stays active is only
+repeated after its re-notify interval (0 never repeats it).  A cleared
+alarm is forgotten, so raising it again is reported right away.
+
+Alerts raised within ``window`` seconds of each other are sent as one
+message, and messages queued while a mail session is open are delivered
+on that session (see emailclient.Mailer)::
+
+    alerts = AlertDispatcher(MAILER, 'RPi@plant.com', 'you@plant.com',
+                             window=5, renotify=3600, intervals={8: 600})
+    alerts.update({1: 'Temperature has reached a critical point'}, [1, 2, 4, 8])
+"""
+
+from twisted.internet import reactor
+
+#---------------------------------------------------------------------------#
+# Logging
+#---------------------------------------------------------------------------#
+import logging
+_logger = logging.getLogger(__name__)
+
+
+class AlertDispatcher(object):
+    ''' Deduplicates, batches and sends alarm notifications
+    '''
+
+    def __init__(self, mailer, mailFrom, mailTo, subject="Alert: Alarm",
+                 window=5, renotify=3600, intervals=None, clock=reactor):
+        ''' Initializes the dispatcher
+
+        :param mailer: The emailclient.Mailer to send with
+        :param mailFrom: The sender address
+        :param mailTo: The recipient address
+        :param subject: The subject of every alert
+        :param window: The seconds alerts are collected before sending
+        :param renotify: The seconds before an active alarm is repeated
+        :param intervals: Re-notify intervals of single alarms by key
+        :param clock: The time source and scheduler, the reactor
+        '''
+        self.mailer = mailer
+        self.mailFrom = mailFrom
+        self.mailTo = mailTo
+        self.subject = subject
+        self.window = window
+        self.renotify = renotify
+        self.intervals = intervals or {}
+        self.clock = clock
+        self.active = {}
+        self.pending = []
+        self.timer = None
+        self.stats = {'raised': 0, 'suppressed': 0, 'messages': 0, 'failed': 0}
+
+    #-----------------------------------------------------------------------#
+    # Alarms
+    #-----------------------------------------------------------------------#
+    def raiseAlert(self, key, message):
+        ''' Queues an alarm unless it was reported within its interval
+
+        :param key: The alarm's identity, e.g. its bit mask
+        :param message: The text reported for it
+        '''
+        now = self.clock.seconds()
+        last = self.active.get(key)
+        interval = self.intervals.get(key, self.renotify)
+        if last is not None and (not interval or now - last < interval):
+            self.stats['suppressed'] += 1
+            return
+        self.active[key] = now
+        self.stats['raised'] += 1
+        self.pending.append((key, message))
+        if self.timer is None:
+            self.timer = self.clock.callLater(self.window, self.flush)
+
+    def clearAlert(self, key):
+        ''' Forgets an alarm so raising it again is reported '''
+        self.active.pop(key, None)
+
+    def update(self, raised, keys):
+        ''' Raises the given alarms and clears the other known ones
+
+        :param raised: The active alarms as a {key: message} dict
+        :param keys: Every alarm key being evaluated
+        '''
+        for key in keys:
+            if key in raised:
+                self.raiseAlert(key, raised[key])
+            else:
+                self.clearAlert(key)
+
+    #-----------------------------------------------------------------------#
+    # Delivery
+    #-----------------------------------------------------------------------#
+    def flush(self):
+        ''' Sends every queued alert as one message '''
+        if self.timer is not None and self.timer.active():
+            self.timer.cancel()
+        self.timer = None
+        if not self.pending:
+            return
+        messages, self.pending = self.pending, []
+        self.stats['messages'] += 1
+        _logger.debug("Sending email notice of %d alarms" % len(messages))
+        d = self.mailer.send(self.mailFrom, self.mailTo,
+                             '\n'.join(m for k, m in messages) + '\n', self.subject)
+        d.addErrback(self.ebSend, messages)
+        return d
+
+    def ebSend(self, failure, messages):
+        self.stats['failed'] += 1
+        _logger.error("Unable to send alarm notice: %s" % failure.value)
+        # Still active alarms are reported again on the next poll
+        for key, message in messages:
+            self.active.pop(key, None)
+
+    def getStats(self):
+        ''' Returns the alert counters '''
+        stats = dict(self.stats)
+        stats.update({'active': len(self.active), 'pending': len(self.pending)})
+        return stats
+
+    def close(self):
+        ''' Cancels the batching timer, queued alerts are dropped '''
+        if self.timer is not None and self.timer.active():
+            self.timer.cancel()
+        self.timer = None
+
+
+#---------------------------------------------------------------------------#
+# Exported symbols
+#---------------------------------------------------------------------------#
+__all__ = [
+    "AlertDispatcher",
+]
@@ -101,6 +101,37 @@ class SerialClientProtocol(protocol.Protocol, TimeoutMixin):
         self.deferred.addErrback(self.errorHandler, 'sendRequest failed')
         return self.deferred
 
+    def sendCommand(self, request):
+        ''' Sends a request like sendRequest, but fires with the decoded
+        reply instead of what ackPacket makes of it and leaves failures to
+        the caller.  A write's reply carries no records, its callback is
+        the acknowledgement.
+
+        :param request: The request to send
+        :returns: A deferred fired with the reply PDU
+        '''
+        d = self.lock.run(self.execute, request)
+        d.addCallback(self.ackReply)
+        return d
+
+    def sendReply(self, reply):
+        ''' Sends the reply to a command initiated by the remote device.
+        The reply waits behind the request in flight, and any queued
+        before it, so it never goes out while a request still waits for
+        its own reply.
+
+        :param reply: The encodable reply PDU
+        :returns: A deferred fired once the reply was written
+        '''
+        return self.lock.run(self.writeReply, reply)
+
+    def writeReply(self, reply):
+        self.transport.write(reply.encode())
+
+    def ackReply(self, reply):
+        self.ackPacket(reply)
+        return reply
+
     def ackPacket(self, packet):
         '''ACK Message, reset counters/timers and release lock to prepare for next message
            Overide if you need additional code such as sending an ACK message
@@ -140,16 +171,26 @@ class SerialClientProtocol(protocol.Protocol, TimeoutMixin):
         :param reply: The reply to process
         '''
         if (reply != None):        
+            if getattr(reply, 'unsolicited', False):
+                # PLC initiated command, do not match it to our requests
+                self.handleUnsolicited(reply)
+                return
             tid = reply.transaction_id
             handler = self.transaction.getTransaction(tid)
             if handler:
                 handler.callback(reply)
-            elif isinstance(reply, protectedWriteRequest):
-                print 'Sending Data to MTrim', repr(reply.encode())
             else:
                 print "Unrequested message: " + repr(reply)
                 _logger.debug("Unrequested message: " + str(reply))
 
+    def handleUnsolicited(self, request):
+        ''' Called with a command initiated by the remote device.
+        Overide to acknowledge, reply and route the command.
+
+        :param request: The decoded command
+        '''
+        _logger.debug("Unsolicited command: " + str(request.function))
+
     def _buildResponse(self, tid):
         ''' Helper method to return a deferred response
         for the current request.
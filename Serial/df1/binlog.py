@@ -0,0 +1,311 @@
+"""
+Binary Columnar Log
+-------------------------------------------
+
+A fixed width binary sink that runs next to the daily CSV log.  Every
+record is a float64 unix timestamp followed by one float32 per tag, so a
+day can be mapped into memory and read as NumPy columns without parsing
+any text.  String tags (the recipe name) are interned into a sidecar
+string table and the column holds the table index.
+
+File layout (little endian)::
+
+    [ Header ][ Columns ][ Records ]
+
+    Header   magic '4s', version H, column count H, record size I,
+             header size I
+    Columns  one 32 byte name and one type byte per tag
+    Records  timestamp d, one f per tag
+
+Example::
+
+    reader = BinaryLogReader('./logs/16010100.bin')
+    speed = reader.column('Line Speed')
+    exportCSV('./logs/16010100.bin', '/tmp/16010100.csv')
+
+The exporter reproduces the daily CSV layout for the FTP consumers::
+
+    python binlog.py 16010100.bin 16010100.csv
+"""
+
+import mmap
+import os
+import struct
+import sys
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from serialexceptions import ParameterException
+
+#---------------------------------------------------------------------------#
+# Logging
+#---------------------------------------------------------------------------#
+import logging
+_logger = logging.getLogger(__name__)
+
+
+#---------------------------------------------------------------------------#
+# Constants
+#---------------------------------------------------------------------------#
+MAGIC = 'SFBL'
+VERSION = 1
+HEADER = struct.Struct('<4sHHII')
+COLUMN = struct.Struct('<32sB')
+
+TYPE_FLOAT = 0
+TYPE_INTEGER = 1
+TYPE_STRING = 2
+
+COLUMN_TYPES = {
+                'float32': TYPE_FLOAT,
+                'string' : TYPE_STRING}
+
+# A float32 column holds 7 significant digits, more only print the noise
+# of the conversion ('12.3000001907')
+COLUMN_FORMATS = {
+                TYPE_FLOAT  : '%.7g',
+                TYPE_INTEGER: '%d',
+                TYPE_STRING : '%s'}
+
+
+def binaryName(csvName):
+    ''' Returns the binary log name that sits next to a CSV log '''
+    return os.path.splitext(csvName)[0] + '.bin'
+
+
+def stringsName(binName):
+    ''' Returns the string table name of a binary log '''
+    return os.path.splitext(binName)[0] + '.str'
+
+
+#---------------------------------------------------------------------------#
+# Writer
+#---------------------------------------------------------------------------#
+class BinaryLogger(object):
+    ''' A daily rotated binary log of the OEE tags
+    '''
+
+    def __init__(self, directory, tags, handles):
+        ''' Initializes the sink, the file is opened on the first write
+
+        :param directory: The directory holding the daily logs
+        :param tags: The compiled TagDictionary
+        :param handles: The tag handles logged, in column order
+        '''
+        self.directory = directory
+        self.names = [tags[h].name for h in handles]
+        # Scaled tags are logged as floats, as the CSV log writes them
+        self.types = [TYPE_FLOAT if tags[h].scaled else
+                      COLUMN_TYPES.get(tags[h].dataType, TYPE_INTEGER) for h in handles]
+        self.record = struct.Struct('<d' + 'f' * len(handles))
+        self.path = None
+        self._file = None
+        self._strings = None
+        self.strings = {}
+        self.records = 0
+
+    def dateFile(self, t):
+        ''' Return the file name given a (year, month, day) tuple '''
+        return '%02d%02d%02d00.bin' % (t[0]-100*(int(t[0]/100)), t[1], t[2])
+
+    def _openFile(self, name):
+        ''' Opens (or creates) the binary log and string table for a day '''
+        self.close()
+        self.path = os.path.join(self.directory, name)
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            columns = ''.join(COLUMN.pack(n[:32], t) for n, t in zip(self.names, self.types))
+            size = HEADER.size + len(columns)
+            fObj = open(self.path, 'wb')
+            fObj.write(HEADER.pack(MAGIC, VERSION, len(self.names), self.record.size, size))
+            fObj.write(columns)
+            fObj.close()
+        self._file = open(self.path, 'ab')
+
+        # Reload the interned strings of a day that is being resumed
+        self.strings = {}
+        stringPath = stringsName(self.path)
+        if os.path.exists(stringPath):
+            for line in open(stringPath, 'r'):
+                self.strings[line.rstrip('\n')] = len(self.strings)
+        self._strings = open(stringPath, 'a')
+
+    def intern(self, value):
+        ''' Returns the string table index of a string value '''
+        value = str(value).replace('\n', ' ')
+        index = self.strings.get(value)
+        if index is None:
+            index = len(self.strings)
+            self.strings[value] = index
+            self._strings.write(value + '\n')
+            self._strings.flush()
+        return index
+
+    def write(self, response, timestamp=None):
+        ''' Appends one record
+
+        :param response: The list of records for each logged tag
+        :param timestamp: The unix time of the record (defaults to now)
+        '''
+        if timestamp is None:
+            timestamp = time.time()
+        name = self.dateFile(time.localtime(timestamp)[:3])
+        if self.path is None or os.path.basename(self.path) != name:
+            self._openFile(name)
+
+        values = []
+        for i in range(len(self.types)):
+            value = response[i]
+            if hasattr(value, '__iter__'):
+                value = value[0] if value else None
+            if self.types[i] == TYPE_STRING:
+                values.append(self.intern(value))
+            else:
+                try:
+                    values.append(float(value))
+                except (TypeError, ValueError):
+                    values.append(float('nan'))
+        self._file.write(self.record.pack(timestamp, *values))
+        self.records += 1
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._strings.close()
+            self._file = self._strings = None
+
+
+#---------------------------------------------------------------------------#
+# Reader
+#---------------------------------------------------------------------------#
+class BinaryLogReader(object):
+    ''' Maps a binary log read only and exposes NumPy column views
+    '''
+
+    def __init__(self, path):
+        ''' Maps the file and parses its schema
+
+        :param path: The binary log to read
+        '''
+        if numpy is None:
+            raise ParameterException("BinaryLogReader requires numpy")
+        self.path = path
+        self.fObj = open(path, 'rb')
+        self.image = mmap.mmap(self.fObj.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count, recordSize, headerSize = HEADER.unpack_from(self.image, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ParameterException("%s is not a version %d binary log" % (path, VERSION))
+
+        self.names, self.types = [], []
+        for i in range(count):
+            name, kind = COLUMN.unpack_from(self.image, HEADER.size + COLUMN.size*i)
+            self.names.append(name.rstrip('\x00'))
+            self.types.append(kind)
+
+        dtype = numpy.dtype([('time', '<f8')] +
+                            [('c%d' % i, '<f4') for i in range(count)])
+        if dtype.itemsize != recordSize:
+            raise ParameterException("%s has an unexpected record size" % path)
+        # A record that is still being written is ignored
+        records = (len(self.image) - headerSize) // recordSize
+        self.data = numpy.frombuffer(self.image, dtype=dtype, count=records,
+                                     offset=headerSize)
+
+        self.strings = []
+        stringPath = stringsName(path)
+        if os.path.exists(stringPath):
+            self.strings = [line.rstrip('\n') for line in open(stringPath, 'r')]
+
+    def __len__(self):
+        return len(self.data)
+
+    def times(self):
+        ''' Returns a view of the record timestamps '''
+        return self.data['time']
+
+    def column(self, name):
+        ''' Returns a view of one tag column
+
+        :param name: The tag name
+        '''
+        return self.data['c%d' % self.names.index(name)]
+
+    def rows(self, start=0, end=None):
+        ''' Yields decoded rows of (timestamp, [values])
+
+        :param start: The first record index
+        :param end: One past the last record index
+        '''
+        strings, types = self.strings, self.types
+        for record in self.data[start:end]:
+            values = []
+            for i in range(len(types)):
+                value = float(record[i+1])
+                if types[i] == TYPE_STRING:
+                    index = int(value)
+                    values.append(strings[index] if 0 <= index < len(strings) else '')
+                elif types[i] == TYPE_INTEGER and value == value:
+                    values.append(int(value))
+                else:
+                    values.append(value)
+            yield (float(record[0]), values)
+
+    def close(self):
+        self.data = None
+        self.image.close()
+        self.fObj.close()
+
+
+#---------------------------------------------------------------------------#
+# CSV Exporter
+#---------------------------------------------------------------------------#
+def exportCSV(binPath, csvFile, header=('Date', 'Time')):
+    ''' Writes a binary log in the daily CSV layout
+
+    :param binPath: The binary log to export
+    :param csvFile: A file name or an open file to write to
+    :param header: The timestamp column names
+    :returns: The number of rows exported
+    '''
+    reader = BinaryLogReader(binPath)
+    rowFormat = ','.join(COLUMN_FORMATS.get(t, '%s') for t in reader.types) + '\n'
+    fObj = open(csvFile, 'w') if isinstance(csvFile, str) else csvFile
+    try:
+        fObj.write(','.join(list(header) + reader.names) + '\n')
+        count = 0
+        for stamp, values in reader.rows():
+            currentTime = time.localtime(stamp)
+            try:
+                row = rowFormat % tuple(values)
+            except (TypeError, ValueError):
+                # An integer column that was not read (NaN)
+                row = ','.join(COLUMN_FORMATS[TYPE_FLOAT] % v if isinstance(v, float)
+                               else str(v) for v in values) + '\n'
+            fObj.write(time.strftime('%m/%d/%Y,%H:%M:%S,', currentTime) + row)
+            count += 1
+    finally:
+        if fObj is not csvFile:
+            fObj.close()
+        reader.close()
+    return count
+
+
+#---------------------------------------------------------------------------#
+# Exported symbols
+#---------------------------------------------------------------------------#
+__all__ = [
+    "BinaryLogger", "BinaryLogReader", "exportCSV", "binaryName",
+]
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        sys.exit("usage: binlog.py <binary log> <csv file>")
+    exportCSV(sys.argv[1], sys.argv[2])
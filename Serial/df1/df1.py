@@ -9,7 +9,7 @@ free to use it as a skeleton guide in implementing your own.
 #---------------------------------------------------------------------------# 
 # import the neccessary modules
 #---------------------------------------------------------------------------# 
-from twisted.internet import serialport, reactor
+from twisted.internet import serialport, reactor, threads
 from twisted.internet.protocol import ClientFactory
 from factory import ClientDecoder
 from mtrimfactory import MTrimClientDecoder
@@ -24,13 +24,31 @@ from twisted.python import usage, logfile
 from ConfigParser import SafeConfigParser
 import utilities
 from async import SerialClientProtocol
-from emailclient import sendEmail
+from emailclient import Mailer, MXCache
+from alerts import AlertDispatcher
 from ftpclient import *
 from df1commands import *
 from MTrimCommands import *
 from loggerfile import *
 from serialexceptions import ConnectionException
 from mtrim import SerialMTrimClient, MTrimFactory
+from tags import TagDictionary, TagCache, RowFormatter, DEFAULT_POLL_CLASS, ALARM_POLL_CLASS
+from tags import PREFETCH_POLL_CLASS
+from unsolicited import UnsolicitedServer
+import history
+from tagimage import TagImageWriter
+from binlog import BinaryLogger
+from sqlsink import SQLiteLogger
+from logwriter import LogWriterThread
+from ftppool import FTPSessionPool
+from recipesync import RecipeSync
+from recipestore import RecipeStore
+from recipeplan import PlanCompiler
+from recipeload import RecipeLoad, RecipeLoadError
+from prefetch import RecipePrefetcher
+from outbox import UploadOutbox
+from oeesummary import summarizeDirectory
+from throttle import TokenBucket
 
 import string
 import sys
@@ -68,6 +86,15 @@ serialLog.setLevel(logging.DEBUG)
 TIMEOUT = 1
 MAXENQ = 3
 
+# The alarm word's bits and the notice sent for each
+ALARM_MESSAGES = (
+    (1, "Temperature has reached a critical point"),                     # Temperature Too High
+    (2, "TU Motor Current has exceeded baseline threshold"),             # Motor Amps exceeded threshold
+    (4, "Vibration sensor readings outside of acceptable tolerance"),    # Vibration exceeds threshold
+    (8, "TU speed is varying more than specified tolerance"),            # Speed variance outside of tolerance
+)
+ALARM_BITS = [mask for mask, message in ALARM_MESSAGES]
+
 
 
 #---------------------------------------------------------------------------# 
@@ -78,15 +105,34 @@ MAXENQ = 3
 #---------------------------------------------------------------------------# 
 class DF1ClientProtocol(SerialClientProtocol):
 
-    def __init__(self, logger, ftpEndpoint, mtrimSerial):
+    def __init__(self, logger, ftpEndpoint, mtrimSerial, tags=None, ftpPool=None):
         ''' Initializes our custom protocol
 
         :param logger: The local file to store results
         :param ftpEndpoint: The endpoint to send results to and read recipes from
+        :param tags: The compiled TagDictionary (compiled from config if None)
+        :param ftpPool: The FTPSessionPool transfers run on (one session
+                        without keepalive if None)
         '''
         SerialClientProtocol.__init__(self)
+        # Everything below is configured from it
+        self.config = utilities.optionReader()
         self.logger = logger
         self.ftpEndpoint = ftpEndpoint
+        self.ftp = ftpPool or FTPSessionPool(ftpEndpoint, keepalive=0)
+        localLogDir, remoteLogDir = self.config.getFTPDirectories()
+        self.outbox = UploadOutbox(self.ftp, localLogDir, remoteLogDir,
+                                   markUploaded=logger.markUploaded,
+                                   bucket=TokenBucket(**self.config.getUploadShaping()),
+                                   catalog=logger.getCatalog(),
+                                   **self.config.getOutboxOptions())
+        reactor.addSystemEventTrigger('before', 'shutdown', self.outbox.close)
+        self.summaryOptions = self.config.getSummaryOptions()
+        self.recipes = RecipeSync(self.ftp, self.config.getRecipeDirectories()[0],
+                                  self.config.getRecipeConcurrency(),
+                                  self.config.getRecipeBundle())
+        self.recipeStore = RecipeStore(self.config.getRecipeDirectories()[0],
+                                       self.getPlanCompiler())
         self.mtrimSerial = mtrimSerial
         self.logFile = logger.getFileName()
         self.ENQCount = 0
@@ -94,26 +140,62 @@ class DF1ClientProtocol(SerialClientProtocol):
         self.lcAlarms = LoopingCall(self.startAlarmsData)
         self.lcFTP = LoopingCall(self.startFTPTransfer)
         self._reconnecting = False
-        self.config = utilities.optionReader()
+        self.tags = tags or TagDictionary.fromConfig(self.config)
+        self.oeeHandles = self.tags.pollClass(DEFAULT_POLL_CLASS)
+        self.alarmHandles = self.tags.pollClass(ALARM_POLL_CLASS)
+        self.prefetchHandles = self.tags.pollClass(PREFETCH_POLL_CLASS)
+        self.cache = TagCache(self.tags)
+        self.prefetch = None
+        if self.prefetchHandles:
+            # The recipe name is read with the alarm bits, a name read
+            # more than two cycles ago is not trusted for a load
+            self.prefetch = RecipePrefetcher(self.recipeStore, self.prefetchHandles)
+            self.prefetchAge = 2 * self.config.getAlarmTime()
+            self.cache.subscribe(self.prefetch.update)
+        sender, recepient = self.config.getEmail()
+        self.alerts = AlertDispatcher(Mailer(MXCache(self.config.getMXCacheTTL())),
+                                      sender, recepient, **self.config.getAlertOptions())
+        self.server = UnsolicitedServer(self.tags, self.cache)
+        self.history = None
+        if history.numpy is not None:
+            self.history = history.TagHistory.fromConfig(self.config, self.tags, self.oeeHandles)
+            self.cache.subscribe(self.history.record)
+        self.image = None
+        if self.config.getTagImagePath():
+            self.image = TagImageWriter(self.config.getTagImagePath(), self.tags)
+            self.cache.subscribe(self.image.publish)
         fLogFile = logfile.LogFile('df1comms.log', '/home/pi/projects/newSLC/logs', maxRotatedFiles=2)
         fLogObserver = log.FileLogObserver(fLogFile)
         log.startLogging(logfile.LogFile('df1comms.log', '/home/pi/projects/newSLC/logs', maxRotatedFiles=2))
         #log.startLogging(sys.stdout)
-        self.notified = False
         self.transferred = False
         self.loaded = False
+        self.lastRecipeLoad = None
 
 
+    def getPlanCompiler(self):
+        ''' Returns the PlanCompiler of the [SLC] Recipe layout, or None
+        when there is none and recipe loads are refused
+        '''
+        try:
+            return PlanCompiler(self.config.getPLCRecipe())
+        except ValueError, ex:
+            serialLog.error("Recipe loads are disabled: %s" % ex)
+            return None
+
     def connectionMade(self):
         ''' Called upon a successful client connection.
         '''
         self._connected = True
         serialLog.debug("Client connected to DF1 server")
-        self.VARIABLES = self.config.getPLCVariables()
-        self.ALARMS = self.config.getPLCAlarms()
         self.localLogDir, self.remoteLogDir = self.config.getFTPDirectories()
 
-        self.lcOEE.start(self.config.getOEETime())
+        # An OEEtime of 0 turns polling off, the PLC pushes OEE data
+        # with MSG writes and every push is logged
+        if self.config.getOEETime() > 0:
+            self.lcOEE.start(self.config.getOEETime())
+        elif self.logPushedData not in self.cache.subscribers:
+            self.cache.subscribe(self.logPushedData)
         self.lcAlarms.start(self.config.getAlarmTime())
         self.lcFTP.start(self.config.getFTPTime())
 
@@ -123,7 +205,8 @@ class DF1ClientProtocol(SerialClientProtocol):
         :param reason: The reason for the disconnect
         '''
         serialLog.debug("Client disconnected from DF1 server: %s" % reason)
-        self.lcOEE.stop()
+        if self.lcOEE.running:
+            self.lcOEE.stop()
         self.lcAlarms.stop()
         self.lcFTP.stop()
         self._connected = False
@@ -143,36 +226,104 @@ class DF1ClientProtocol(SerialClientProtocol):
             self.retry = reactor.callLater(5.31, self.reconnect)
 
     def startFTPTransfer(self):
-        d = self.ftpEndpoint.connect(FTPClientAFactory())
-        d.addCallback(sendOEEData,os.path.join(self.localLogDir, self.logFile), os.path.join(self.remoteLogDir, self.logFile))
+        # The session counters show whether the pool is reusing its
+        # sessions or reconnecting for every transfer
+        serialLog.debug("FTP sessions: %s" % ', '.join(
+            '%s %d' % item for item in sorted(self.ftp.getStats().items())))
+        # Buffered rows must be in the file before it is sent
+        d = self.logger.flush()
+        d.addCallback(self.uploadLogs)
         d.addErrback(self.FTPfail, 'startFTPTransfer')
+
+    def uploadLogs(self, _=None):
+        # Every day with rows the server doesn't have yet is queued in the
+        # persistent outbox, so days missed while the network was down are
+        # caught up in order once it is back
+        for entry in self.logger.pendingUploads():
+            self.outbox.add(entry.name, entry.uploaded, entry.size)
+        self.outbox.kick()
         if (self.logger.getFileName() != self.logFile):
             self.logFile = self.logger.getFileName()
+            self.summarizeDays()
             #self.startFTPTransfer()
 
+    def summarizeDays(self):
+        # Once a day has ended its OEE summary is written in a thread and
+        # queued for upload, with the day before whose night shift only
+        # ended this morning and the new day's first rows
+        if self.summaryOptions is None:
+            return
+        d = threads.deferToThread(summarizeDirectory, self.config.getFTPDirectories()[0],
+                                  days=3, **self.summaryOptions)
+        d.addCallback(self.uploadSummaries)
+        d.addErrback(self.FTPfail, 'summarizeDays')
+
+    def uploadSummaries(self, summaries):
+        for summary in summaries:
+            self.outbox.addFile(os.path.basename(summary))
+        self.outbox.kick()
+
     def startAlarmsData(self):
         var = []
 
-        for address in self.ALARMS:
-            request = protectedReadRequest(1, address)
+        # The prefetch tags are read after the bits, so a load bit is never
+        # newer than the recipe name read with it
+        handles = self.alarmHandles + self.prefetchHandles
+        for handle in handles:
+            request = self.tags.readRequest(handle)
             result = self.sendRequest(request)
             var.append(result)
 
         d = defer.gatherResults(var)
+        d.addCallback(self.cache.update, handles)
+        d.addCallback(lambda results: results[:len(self.alarmHandles)])
         d.addCallback(self.evaluateBits)
         d.addErrback(self.errorHandler, 'gather results in startAlarmsData')
        
     def startOEEData(self):
         var = []
 
-        for address in self.VARIABLES:
-            request = protectedReadRequest(1, address)
+        for handle in self.oeeHandles:
+            request = self.tags.readRequest(handle)
             result = self.sendRequest(request)
             var.append(result)
         d = defer.gatherResults(var)
+        d.addCallback(self.convertOEEData)
+        d.addCallback(self.cache.update, self.oeeHandles)
         d.addCallback(self.logger.write)
         d.addErrback(self.errorHandler, 'saving data in StartOEEData failed')
 
+    def convertOEEData(self, values):
+        ''' Applies the configured tag scaling to a poll result
+
+        :param values: The raw records in oeeHandles order
+        '''
+        return self.tags.convert(self.oeeHandles, values)
+
+    def handleUnsolicited(self, request):
+        ''' Acknowledges a PLC initiated command, applies it to the tag
+        cache and queues the DF1 reply behind our own requests
+
+        :param request: The decoded command
+        '''
+        self.transport.write('\x10\x06')
+        d = self.sendReply(self.server.handle(request))
+        # The lock is already released, errorHandler would release it again
+        d.addErrback(lambda failure: serialLog.error("Unable to reply to the PLC: %s"
+                                                     % failure.value))
+
+    def logPushedData(self, results, handles, timestamp):
+        ''' Logs the OEE tags whenever the PLC pushes any of them
+
+        :param results: The values that were pushed
+        :param handles: The tag handles that were pushed
+        :param timestamp: The time of the push
+        '''
+        for handle in handles:
+            if self.tags[handle].pollClass == DEFAULT_POLL_CLASS:
+                self.logger.write(self.cache.snapshot(self.oeeHandles))
+                return
+
     def ackPacket(self, packet):
         #ACK Message, reset counters/timers and release lock to prepare for next message
         self.transport.write('\x10\x06')
@@ -186,32 +337,11 @@ class DF1ClientProtocol(SerialClientProtocol):
 
     def evaluateBits(self, alarmBits):
         bits = utilities.flatten(alarmBits)
-        if (bits[0]):
-            # self.notified added so multiple emails won't be sent
-            if (not self.notified):
-                serialLog.debug("Sending Email notice of Error")
-                strMsg = ''
-                if (bits[0] & 1):
-                    """ Temperature Too High Alarm """
-                    strMsg += "Temperature has reached a critical point\n"
-
-                if (bits[0] & 2):
-                    """ Motor Amps exceeded threshold """
-                    strMsg += "TU Motor Current has exceeded baseline threshold\n"
-
-                if (bits[0] & 4):
-                    """ Vibration exceeds threshold """
-                    strMsg += "Vibration sensor readings outside of acceptable tolerance\n"
-
-                if (bits[0] & 8):
-                    """ Speed variance outside of tolerance """
-                    strMsg += "TU speed is varying more than specified tolerance\n"
-
-                sender, recepient = self.config.getEmail()
-                sendEmail(sender, recepient, strMsg, "Alert: Alarm")
-                self.notified = True
-        else:
-            self.notified = False
+        # Each alarm bit is deduplicated on its own, alarms raised close
+        # together go out as one email
+        raised = dict((mask, message) for mask, message in ALARM_MESSAGES
+                      if bits[0] & mask)
+        self.alerts.update(raised, ALARM_BITS)
 
         if (bits[1]):
             # self.loaded added so multiple uploads won't be initiated
@@ -221,50 +351,42 @@ class DF1ClientProtocol(SerialClientProtocol):
                 self.loaded = True
 
                 def clearRecipeBit(response):
-                    request = protectedBitWriteRequest(1, self.ALARMS[1], [0])
+                    request = self.tags.bitWriteRequest(self.alarmHandles[1], [0])
                     d = self.sendRequest(request)
                     d.addErrback(self.errorHandler, 'clearRecipeBit')
 
 
-                def sendRecipe(recipe):
-                    PLCRecipe = self.config.getPLCRecipe()
-
-                    result = self.mtrimSerial.writeParameter(1, 1, float(recipe[-3]))
-                    result.addErrback(self.errorHandler, "sendRecipe")
-
-                    result = self.mtrimSerial.writeParameter(1, 20, float(recipe[-2]))
-                    result.addErrback(self.errorHandler, "sendRecipe")
-
-                    result = self.mtrimSerial.writeParameter(1, 21, float(recipe[-1]))
-                    result.addErrback(self.errorHandler, "sendRecipe")
-
-                    index = 1                               # Index 0 is recipe name
-                    var = []
-                    for address in PLCRecipe:
-                        request = protectedWriteRequest(1, address, [float(recipe[index])])
-                        result = self.sendRequest(request)
-                        result.addErrback(self.errorHandler, "sendRecipe")
-                        var.append(result)
-                    d = defer.gatherResults(var)
+                def sendRecipe(plan):
+                    # Both devices are written in parallel, the bit is only
+                    # cleared once every write of both was acknowledged
+                    load = self.lastRecipeLoad = RecipeLoad(plan, self.sendCommand,
+                                                            self.mtrimSerial.sendCommand,
+                                                            **self.config.getRecipeLoadOptions())
+                    d = load.start()
+                    d.addCallback(lambda load: serialLog.info(load.summary()))
                     d.addCallback(clearRecipeBit)
-                    d.addErrback(self.errorHandler, 'saving data in StartOEEData failed')
+                    d.addErrback(self.recipeLoadFailed)
                          
                 def getRecipeValues(recipeName):
-                    localDir, remoteDir = self.config.getRecipeDirectories()
-                    filename = localDir + '/' + 'families.csv'
-                    fObj = open(filename, 'r')
-                    for recipe in fObj:
-                        if recipe.strip() in recipeName[0]:
-                            recipeFile = localDir + '/' + recipe.strip() + '.csv'
-                            fRecipe = open(recipeFile, 'r')
-                            for line in fRecipe:
-                                if recipeName[0] in line.strip():
-                                    sendRecipe(line.strip().split(','))
+                    recipe = self.recipeStore.get(recipeName[0])
+                    if recipe is None:
+                        serialLog.debug("Recipe %s is not in the recipe store" % recipeName[0])
+                        return
+                    if recipe.plan is None:
+                        serialLog.error("Recipe %s has no write plan, not loaded" % recipeName[0])
+                        return
+                    sendRecipe(recipe.plan)
                                 
-                request = protectedReadRequest(1, 'ST15:20')
-                d = self.sendRequest(request)
-                d.addCallback(getRecipeValues)
-                d.addErrback(self.errorHandler, 'saving recipe data')
+                recipe = None
+                if self.prefetch is not None:
+                    recipe = self.prefetch.current(self.prefetchAge)
+                if recipe is not None:
+                    sendRecipe(recipe.plan)
+                else:
+                    request = protectedReadRequest(1, 'ST15:20')
+                    d = self.sendRequest(request)
+                    d.addCallback(getRecipeValues)
+                    d.addErrback(self.errorHandler, 'saving recipe data')
                 
         else:
             self.loaded = False
@@ -273,28 +395,35 @@ class DF1ClientProtocol(SerialClientProtocol):
         if (bits[2]):
             # self.transferred added so multiple downloads won't be initiated
             def clearDownloadBit(response):
-                request = protectedBitWriteRequest(1, self.ALARMS[2], [0])
+                request = self.tags.bitWriteRequest(self.alarmHandles[2], [0])
                 d = self.sendRequest(request)
                 d.addErrback(self.errorHandler, 'clearDownloadBit')
                
             if (not self.transferred):
-                #Download Recipes from Server
-                localDir, remoteDir = self.config.getRecipeDirectories()
+                #Download the changed recipes from the server
                 serialLog.debug("Downloading Recipes")
-                d = self.ftpEndpoint.connect(FTPClientAFactory())
-                d.addErrback(self.FTPfail, 'startRecipeTransfer')
-                d.addCallback(getRecipeFiles, localDir)
+                d = self.recipes.sync()
+                d.addCallback(lambda _: self.recipeStore.load())
+                if self.prefetch is not None:
+                    d.addCallback(lambda _: self.prefetch.refresh())
                 d.addCallback(clearDownloadBit)
+                d.addErrback(self.FTPfail, 'startRecipeTransfer')
                 self.transferred = True
         else:
             self.transferred = False
             
+    def recipeLoadFailed(self, failure):
+        ''' Logs a recipe load that left writes unacknowledged, the recipe
+        bit stays set for the PLC to see
+        '''
+        if failure.check(RecipeLoadError):
+            serialLog.error(failure.value.load.summary())
+        serialLog.error("Recipe load failed: %s" % failure.value)
+
     def FTPfail(self, error, msg):
         stringMsg = msg + ': Failed.  Error was: %s %s' % (error.type, error.value)
         serialLog.debug(stringMsg)
-        #Network Down, Try again periodically.
-        #TODO: Check if the logFile name has changed while network down
-        #      to make sure we get all files that have been missed
+        #Network Down, log uploads are retried by the outbox with backoff
         #reactor.callLater(17.23, self.startFTPTransfer)
 
        
@@ -314,15 +443,18 @@ class DF1Factory(ClientFactory):
 
     protocol = DF1ClientProtocol
 
-    def __init__(self, logger, endpoint, mtrimSerial):
+    def __init__(self, logger, endpoint, mtrimSerial, tags=None, ftpPool=None):
         ''' Remember things necessary for building a protocols '''
         self.logger = logger
         self.endpoint = endpoint
         self.mtrim = mtrimSerial
+        self.tags = tags
+        self.ftpPool = ftpPool
 
     def buildProtocol(self):
         ''' Create a protocol and start the reading cycle '''
-        proto = self.protocol(self.logger, self.endpoint, self.mtrim)
+        proto = self.protocol(self.logger, self.endpoint, self.mtrim, self.tags,
+                              self.ftpPool)
         proto.factory = self
         return proto
 
@@ -354,11 +486,84 @@ class SerialDF1Client(serialport.SerialPort):
 #---------------------------------------------------------------------------# 
 #---------------------------------------------------------------------------# 
 class LoggingLineWriter(object):
-    def __init__(self, logDir):
+    def __init__(self, logDir, header=None, formatter=None, writer=None, **kwargs):
+        ''' Opens today's log
+
+        :param logDir: The directory holding the daily logs
+        :param header: The column names written to new files
+        :param formatter: A RowFormatter compiled for the logged tags
+        :param writer: A LogWriterThread that runs the sink I/O, or None
+                       to write on the calling thread
+        :param kwargs: Writer options (buffering, compression) passed to DailyLogger
+        '''
         self.logPath = logDir
         t = time.localtime()[:3]
         self.fileName = '%02d%02d%02d00.csv' % (t[0]-100*(int(t[0]/100)), t[1], t[2])      
-        self.logFile = DailyLogger(self.fileName, self.logPath)
+        self.logFile = DailyLogger(self.fileName, self.logPath, header=header, **kwargs)
+        self.sinks = []
+        self.formatter = formatter
+        self.writer = writer
+        # Flush buffered rows even when no further rows arrive
+        self.lcFlush = None
+        if self.logFile.flushInterval:
+            self.lcFlush = LoopingCall(self.flush)
+            self.lcFlush.start(self.logFile.flushInterval, now=False)
+
+    def addSink(self, sink):
+        ''' Adds another log sink that receives every row
+
+        :param sink: An object with write(response, timestamp), flush()
+                     and close() methods
+        '''
+        self.sinks.append(sink)
+
+    def flush(self):
+        ''' Writes any buffered rows to the file
+
+        :returns: A Deferred fired once the rows are in the file
+        '''
+        if self.writer is None:
+            self.flushSinks()
+            return defer.succeed(None)
+        self.writer.postControl(self.flushSinks)
+        return self.writer.sync()
+
+    def flushSinks(self):
+        self.logFile.flush()
+        for sink in self.sinks:
+            sink.flush()
+
+    def close(self):
+        ''' Flushes any buffered rows to disk and closes the log, after
+        the writer thread has drained its queue
+        '''
+        if self.lcFlush is not None and self.lcFlush.running:
+            self.lcFlush.stop()
+        if self.writer is None:
+            self.closeSinks()
+        else:
+            self.writer.postControl(self.closeSinks)
+            self.writer.stop()
+
+    def closeSinks(self):
+        self.logFile.close()
+        for sink in self.sinks:
+            sink.close()
+
+    def getStats(self):
+        stats = self.logFile.getStats()
+        if self.writer is not None:
+            stats['writer'] = self.writer.getStats()
+        return stats
+
+    def pendingUploads(self):
+        return self.logFile.pendingUploads()
+
+    def markUploaded(self, name, offset):
+        self.logFile.markUploaded(name, offset)
+
+    def getCatalog(self):
+        return self.logFile.catalog
 
     def getFileName(self):
         return self.fileName
@@ -368,16 +573,30 @@ class LoggingLineWriter(object):
 
         :param response: The response to process
         '''
-        data = []
-        for item in response:
-            data.append(item)
-        response = utilities.flatten(data)
-        currentTime = time.localtime()
-        stringData = time.strftime('%m/%d/%Y,', currentTime)
-        stringData += time.strftime('%T,', currentTime)
-        stringData += ','.join(map(str, response))
-        stringData += '\n'
-        logName = self.logFile.write(stringData)
+        timestamp = time.time()
+        if self.writer is None:
+            self.writeRow(response, timestamp)
+        else:
+            self.writer.post(self.writeRow, response, timestamp)
+
+    def writeRow(self, response, timestamp):
+        ''' Formats a row and writes it to every sink
+
+        :param response: The response to process
+        :param timestamp: The unix time of the row
+        '''
+        for sink in self.sinks:
+            sink.write(response, timestamp)
+        if self.formatter is not None:
+            stringData = self.formatter.format(response, timestamp)
+        else:
+            response = utilities.flatten(list(response))
+            currentTime = time.localtime(timestamp)
+            stringData = time.strftime('%m/%d/%Y,', currentTime)
+            stringData += time.strftime('%T,', currentTime)
+            stringData += ','.join(map(str, response))
+            stringData += '\n'
+        logName = self.logFile.write(stringData, timestamp)
         if (self.fileName != logName):
             self.fileName = logName
 
@@ -393,12 +612,27 @@ def main():
 
     config = utilities.optionReader()
 
+    # Compile the tag dictionary once for the pollers, logger and alarms
+    tags = TagDictionary.fromConfig(config)
+
     localDir, remoteDir = config.getFTPDirectories()
-    oeeLog = LoggingLineWriter(localDir)
+    oeeHandles = tags.pollClass(DEFAULT_POLL_CLASS)
+    writerOptions = config.getWriterOptions()
+    writer = LogWriterThread(**writerOptions) if writerOptions is not None else None
+    oeeLog = LoggingLineWriter(localDir, tags.getHeader(), RowFormatter(tags, oeeHandles),
+                               writer, **config.getLoggingOptions())
+    if config.getBinaryLogging():
+        oeeLog.addSink(BinaryLogger(localDir, tags, oeeHandles))
+    sqlOptions = config.getSQLiteOptions()
+    if sqlOptions is not None:
+        oeeLog.addSink(SQLiteLogger(tags=tags, handles=oeeHandles, **sqlOptions))
+    reactor.addSystemEventTrigger('before', 'shutdown', oeeLog.close)
     
     # Create the FTP client
     FTPhost, FTPport = config.getFTPparms()
     ftpEndpoint = TCP4ClientEndpoint(reactor, FTPhost, FTPport)
+    ftpPool = FTPSessionPool(ftpEndpoint, **config.getFTPPoolOptions())
+    reactor.addSystemEventTrigger('before', 'shutdown', ftpPool.close)
 
     #Create MTrim serial connection
     framer = AsciiFramer(MTrimClientDecoder())
@@ -406,7 +640,7 @@ def main():
     RS422port, RS422baud = config.getRS422parms()    
     mtrim = SerialMTrimClient(mtrimfactory, RS422port, reactor, baudrate = RS422baud)
     
-    factory = DF1Factory(oeeLog, ftpEndpoint, mtrim.protocol)
+    factory = DF1Factory(oeeLog, ftpEndpoint, mtrim.protocol, tags, ftpPool)
     RS232port, RS232baud = config.getRS232parms()    
     SerialDF1Client(factory, RS232port, reactor, baudrate = RS232baud)
 
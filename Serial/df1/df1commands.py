@@ -78,6 +78,81 @@ SUBELEMENT_STRUCT = {
                 0x94: 'h'}         #Programmable Limit Switch
 
 
+#---------------------------------------------------------------------------#
+# Helper Functions
+#---------------------------------------------------------------------------#
+def unpackAddress(data):
+    ''' Decodes the file number, file type, element and sub-element
+    fields of a protected typed logical address.  Fields above 254 are
+    sent as 0xFF followed by a little endian word.
+
+    :param data: The unescaped data starting at the file number
+    :returns: A tuple of (AddressObject, remaining data)
+    '''
+    Address = utilities.AddressObject()
+    fields = []
+    for i in range(4):
+        value = ord(data[0])
+        data = data[1:]
+        if (value == 0xFF and i != 1):
+            value, = struct.unpack('<H', data[0:2])
+            data = data[2:]
+        fields.append(value)
+    Address.fileNumber, Address.fileType, Address.eleNumber, Address.subElement = fields
+    return (Address, data)
+
+
+def unpackString(record):
+    ''' Converts a raw ST element (length word plus byte swapped
+    characters) into a python string
+
+    :param record: The raw 84 byte element
+    :returns: The decoded string
+    '''
+    size, = struct.unpack('<h', record[0:2])
+    newRecord = ""
+    for i in range(2, len(record)-1, 2):
+        newRecord += record[i+1] + record[i]
+    return newRecord[0:size]
+
+
+def unpackValues(Address, data):
+    ''' Decodes the little endian data values of a typed write
+
+    :param Address: The AddressObject the values were written to
+    :param data: The raw value bytes
+    :returns: A tuple of decoded values
+    '''
+    if (Address.subElement > 0):
+        elementSize = SUBELEMENT_SIZE[Address.fileType]
+        formatStr = '<' + SUBELEMENT_STRUCT[Address.fileType]
+    else:
+        elementSize = ELEMENT_SIZE[Address.fileType]
+        formatStr = '<' + ELEMENT_STRUCT[Address.fileType]
+
+    values = ()
+    for i in range(0, len(data) - elementSize + 1, elementSize):
+        if (Address.fileType == 0x8D):
+            values += (unpackString(data[i:i+elementSize]),)
+        else:
+            values += struct.unpack(formatStr, data[i:i+elementSize])
+    return values
+
+
+def checkPacket(packet):
+    ''' Strips the framing from a received command packet and checks
+    its CRC.  The framer has already removed any DLE stuffing.
+
+    :param packet: DLE STX data DLE ETX CRC
+    :returns: The unframed data
+    '''
+    data = packet[2:-4]
+    crc, = struct.unpack('>H', packet[-2:])
+    if (utilities.checkCRC(data, crc) != True):
+        raise CRCException("Error in CRC : %d" % crc)
+    return data
+
+
 class PDU(object):
     '''
     Base class for all DF1 mesages
@@ -159,6 +234,7 @@ class protectedReadRequest(PDU):
         :param parameter: The PLC address to read
         :param size: The number of elements to read
         :param packet: Used when we already have an encoded packet
+        :param address: Optional precompiled AddressObject (see tags.py)
         '''
         PDU.__init__(self, **kwargs)
         self.src = src
@@ -166,7 +242,9 @@ class protectedReadRequest(PDU):
         self.parameter = parameter
         self.sts = 0x00
         self.size = size
-        self.Address = utilities.calcAddress(parameter)
+        self.Address = kwargs.get('address') or utilities.AddressObject()
+        if (parameter is not None and not kwargs.get('address')):
+            self.Address = utilities.calcAddress(parameter)
         self.packet = packet
         
     def encode(self):
@@ -252,46 +330,20 @@ class protectedReadRequest(PDU):
 
         :param packet: The packet to decode
         '''
+        data = checkPacket(packet)
 
-        #############################################
-        # Calculate CRC after removing stx/etx words
-        #############################################
-        data = packet[2:-3]
-        packetCRC = packet[-2:]
-        if (utilities.checkCRC(data, packetCRC) != True):
-            raise CRCException
-
-        
         ############################
         # Packet Header Information
         ############################
         self.dest, self.src, self.cmd, self.sts, self.transaction_id = struct.unpack('>BBBBH', data[0:6])
-        self.function,self.size = struct.unpack('>BB', packet[6:8])
-        data = data[8:]
+        self.function, self.size = struct.unpack('>BB', data[6:8])
 
         ###################################################
         # Packet Address Information
         # Note: Use Little Endian format if using 2 bytes
         ###################################################
-        self.Address.fileNumber = struct.unpack('>B', data[0])
-        data = data[1:]
-        if (self.Address.fileNumber == '\xFF'):
-            self.Address.fileNumber = struct.unpack('<H', data[0:2])
-            data = data[2:]
-
-        self.Address.fileType = struct.unpack('>B', data[0])
-        data = data[1:]
-
-        self.Address.eleNumber = struct.unpack('>B', data[0])
-        data = data[1:]
-        if (self.Address.eleNumber == '\xFF'):
-            self.Address.eleNumber = struct.unpack('<H', packet[0:2])
-            data = data[2:]
-
-        self.Address.subElement = struct.unpack('>B', data[0])
-        data = data[1:]
-        if (self.Address.subElement == '\xFF'):
-            self.Address.subElement = struct.unpack('<H', packet[0:2])
+        self.Address, data = unpackAddress(data[8:])
+        return self
            
     def __str__(self):
         ''' Returns a string representation of the instance
@@ -315,6 +367,7 @@ class protectedWriteRequest(PDU):
         :parameter: The parameter address to begin writing to
         :values: a list of values to write
         :size: The number of bytes to write
+        :address: Optional precompiled AddressObject (see tags.py)
         '''
         PDU.__init__(self, **kwargs)
         self.src = 0
@@ -323,7 +376,9 @@ class protectedWriteRequest(PDU):
         self.values = values
         self.sts = 0x00
         self.size = size
-        self.Address = utilities.calcAddress(parameter)
+        self.Address = kwargs.get('address') or utilities.AddressObject()
+        if (parameter is not None and not kwargs.get('address')):
+            self.Address = utilities.calcAddress(parameter)
         self.packet = ''
 
     def encode(self):
@@ -421,72 +476,25 @@ class protectedWriteRequest(PDU):
 
         :param data: The request to decode
         '''
-        ########################################################
-        # Unescape any DLE's ('\x10') in data
-        # Do not include DLE STX and DLE ETX CRC in calcualtion
-        ########################################################
-        print repr(packet)
-        data = packet[2:-3]
-        while (data.find('\x10') != -1):
-            i = data.find('\x10')
-            data = data[:i] + data[i+1:]
-        
-        #############################################
-        # Calculate CRC after removing escaped DLE's
-        #############################################
-        #crc = utilities.computeCRC(data)
-        #if (utilities.computeCRC(data, packet[-2:]) != True):
-        #    print "CRC's: ", repr(crc), "  ", repr(packet[-2:])
-        #    raise CRCException
+        data = checkPacket(packet)
 
-        
         ############################
         # Packet Header Information
         ############################
         self.dest,  self.src, self.cmd, self.sts, self.transaction_id = struct.unpack('>BBBBH', data[0:6])
-        self.function,self.size = struct.unpack('>BB', packet[6:8])
-        data = data[8:]
+        self.function, self.size = struct.unpack('>BB', data[6:8])
 
         ###################################################
         # Packet Address Information
         # Note: Use Little Endian format if using 2 bytes
         ###################################################
-        self.Address.fileNumber = struct.unpack('>B', data[0])
-        data = data[1:]
-        if (self.Address.fileNumber == '\xFF'):
-            self.Address.fileNumber = struct.unpack('<H', data[0:2])
-            data = data[2:]
-
-        self.Address.fileType = struct.unpack('>B', data[0])
-        data = data[1:]
-
-        self.Address.eleNumber = struct.unpack('>B', data[0])
-        data = data[1:]
-        if (self.Address.eleNumber == '\xFF'):
-            self.Address.eleNumber = struct.unpack('<H', packet[0:2])
-            data = data[2:]
-
-        self.Address.subElement = struct.unpack('>B', data[0])
-        data = data[1:]
-        if (self.Address.subElement == '\xFF'):
-            self.Address.subElement = struct.unpack('<H', packet[0:2])
-            data = data[2:]
+        self.Address, data = unpackAddress(data[8:])
 
         ######################################################
         # Packet Data Information using Little Endian format
         ######################################################
-        if (self.Address.subElement > 0):
-            elementSize = SUBELEMENT_SIZE[self.Address.fileType]
-            formatStr = '<' + SUBELEMENT_STRUCT[self.Address.fileType]
-        else:
-            elementSize = ELEMENT_SIZE[self.Address.fileType]
-            formatStr = '<' + ELEMENT_STRUCT[self.Address.fileType]
-
-        self.values = ()
-        item = 0            
-        for i in range(0, len(data), elementSize):
-            self.values += struct.unpack(formatStr, data[i:i+elementSize])
-            item += 1
+        self.values = unpackValues(self.Address, data[:self.size])
+        return self
         
     def __str__(self):
         ''' Returns a string representation of the instance
@@ -510,6 +518,7 @@ class protectedBitWriteRequest(PDU):
         :parameter: The parameter address to begin writing to
         :values: a list of values to write
         :size: The number of bytes to write
+        :address: Optional precompiled AddressObject (see tags.py)
         '''
         PDU.__init__(self, **kwargs)
         self.src = 0
@@ -518,7 +527,9 @@ class protectedBitWriteRequest(PDU):
         self.values = values
         self.sts = 0x00
         self.size = size
-        self.Address = utilities.calcAddress(parameter)
+        self.Address = kwargs.get('address') or utilities.AddressObject()
+        if (parameter is not None and not kwargs.get('address')):
+            self.Address = utilities.calcAddress(parameter)
         self.packet = ''
         self.mask = 0
 
@@ -620,75 +631,26 @@ class protectedBitWriteRequest(PDU):
 
         :param data: The request to decode
         '''
-        ########################################################
-        # Unescape any DLE's ('\x10') in data
-        # Do not include DLE STX and DLE ETX CRC in calcualtion
-        ########################################################
-        print repr(packet)
-        data = packet[2:-3]
-        while (data.find('\x10') != -1):
-            i = data.find('\x10')
-            data = data[:i] + data[i+1:]
-        
-        #############################################
-        # Calculate CRC after removing escaped DLE's
-        #############################################
-        #crc = utilities.computeCRC(data)
-        #if (utilities.computeCRC(data, packet[-2:]) != True):
-        #    print "CRC's: ", repr(crc), "  ", repr(packet[-2:])
-        #    raise CRCException
+        data = checkPacket(packet)
 
-        
         ############################
         # Packet Header Information
         ############################
         self.dest,  self.src, self.cmd, self.sts, self.transaction_id = struct.unpack('>BBBBH', data[0:6])
-        self.function,self.size = struct.unpack('>BB', packet[6:8])
-        data = data[8:]
+        self.function, self.size = struct.unpack('>BB', data[6:8])
 
         ###################################################
         # Packet Address Information
         # Note: Use Little Endian format if using 2 bytes
         ###################################################
-        self.Address.fileNumber = struct.unpack('>B', data[0])
-        data = data[1:]
-        if (self.Address.fileNumber == '\xFF'):
-            self.Address.fileNumber = struct.unpack('<H', data[0:2])
-            data = data[2:]
-
-        self.Address.fileType = struct.unpack('>B', data[0])
-        data = data[1:]
-
-        self.Address.eleNumber = struct.unpack('>B', data[0])
-        data = data[1:]
-        if (self.Address.eleNumber == '\xFF'):
-            self.Address.eleNumber = struct.unpack('<H', packet[0:2])
-            data = data[2:]
-
-        self.Address.subElement = struct.unpack('>B', data[0])
-        data = data[1:]
-        if (self.Address.subElement == '\xFF'):
-            self.Address.subElement = struct.unpack('<H', packet[0:2])
-            data = data[2:]
+        self.Address, data = unpackAddress(data[8:])
 
-        self.mask = struct.unpack('<H', data[0:2])
-        data = data[2:]
-        
         ######################################################
-        # Packet Data Information using Little Endian format
+        # Packet Mask and Data using Little Endian format
         ######################################################
-        if (self.Address.subElement > 0):
-            elementSize = SUBELEMENT_SIZE[self.Address.fileType]
-            formatStr = '<' + SUBELEMENT_STRUCT[self.Address.fileType]
-        else:
-            elementSize = ELEMENT_SIZE[self.Address.fileType]
-            formatStr = '<' + ELEMENT_STRUCT[self.Address.fileType]
-                
-        self.values = ()
-        item = 0            
-        for i in range(0, len(data), elementSize):
-            self.values += struct.unpack(formatStr, data[i:i+elementSize])
-            item += 1
+        self.mask, = struct.unpack('<H', data[0:2])
+        self.values = unpackValues(self.Address, data[2:2+self.size])
+        return self
         
     def __str__(self):
         ''' Returns a string representation of the instance
@@ -737,7 +699,7 @@ class Command_0F_Response(PDU):
         ############################
         # Packet Header Information
         ############################
-        data = struct.pack('>BBBBHB', self.dest,  self.src, self.cmd, self.sts, self.transaction_id)
+        data = struct.pack('>BBBBH', self.dest,  self.src, self.cmd, self.sts, self.transaction_id)
 
         if (self.Address.subElement > 0):
             elementSize = SUBELEMENT_SIZE[self.Address.fileType]
@@ -823,11 +785,7 @@ class Command_0F_Response(PDU):
                 else:
                     if (self.Address.fileType == 0x8D):
                         record, = struct.unpack(formatStr, data[i:i+elementSize])
-                        size, = struct.unpack('<h',record[0:2])
-                        newRecord = ""
-                        for i in range(2, elementSize, 2):
-                            newRecord += record[i+1] + record[i]
-                        self.records += (newRecord[0:size],)
+                        self.records += (unpackString(record),)
                     else:
                         self.records += struct.unpack(formatStr, data[i:i+elementSize])
   
@@ -1,26 +1,208 @@
 from __future__ import absolute_import
+import time
 from twisted.internet import defer
+from twisted.internet.protocol import ClientFactory
 from twisted.mail import smtp, relaymanager
 from twisted.internet import reactor
 from cStringIO import StringIO
 
-MXCALCULATOR = relaymanager.MXCalculator()
+#---------------------------------------------------------------------------#
+# Logging
+#---------------------------------------------------------------------------#
+import logging
+_logger = logging.getLogger(__name__)
+
+
+class MXCache(object):
+    ''' Caches mail exchange lookups for a fixed time, concurrent lookups
+    of one domain share a single query
+    '''
+
+    def __init__(self, ttl=3600, calculator=None):
+        ''' :param ttl: The seconds a lookup is reused
+        :param calculator: The MXCalculator doing the lookups, created on
+                           the first lookup so importing starts no resolver
+        '''
+        self.ttl = ttl
+        self.calculator = calculator
+        self.hosts = {}
+        self.pending = {}
+        self.stats = {'hits': 0, 'lookups': 0}
+
+    def getMX(self, domain):
+        ''' Returns a Deferred fired with the mail exchange of a domain '''
+        host, expires = self.hosts.get(domain, (None, 0))
+        if host is not None and time.time() < expires:
+            self.stats['hits'] += 1
+            return defer.succeed(host)
+        d = defer.Deferred()
+        if domain in self.pending:
+            self.pending[domain].append(d)
+            return d
+        self.pending[domain] = [d]
+        self.stats['lookups'] += 1
+
+        def cbMX(mxRecord):
+            host = str(mxRecord.name)
+            self.hosts[domain] = (host, time.time() + self.ttl)
+            return host
+
+        def cbFire(host):
+            for waiter in self.pending.pop(domain):
+                waiter.callback(host)
+
+        def ebFire(failure):
+            for waiter in self.pending.pop(domain):
+                waiter.errback(failure)
+        if self.calculator is None:
+            self.calculator = relaymanager.MXCalculator()
+        lookup = self.calculator.getMX(domain)
+        lookup.addCallback(cbMX)
+        lookup.addCallbacks(cbFire, ebFire)
+        return d
+
+MXCALCULATOR = MXCache()
 def getMailExchange(host):
-    def cbMX(mxRecord):
-        return str(mxRecord.name)
-    return MXCALCULATOR.getMX(host).addCallback(cbMX)
+    return MXCALCULATOR.getMX(host)
 
-def sendEmail(mailFrom, mailTo, msg, subject=""):
-    def dosend(host):
-        print "emailing %s (using host %s) from %s" % (mailTo, host, mailFrom)
-        mstring = "From: %s\nTo: %s\nSubject: %s\n\n%s\n"
-        msgfile = StringIO(mstring % (mailFrom, mailTo, subject, msg))
+
+def formatMessage(mailFrom, mailTo, msg, subject=""):
+    mstring = "From: %s\nTo: %s\nSubject: %s\n\n%s\n"
+    return mstring % (mailFrom, mailTo, subject, msg)
+
+
+#---------------------------------------------------------------------------#
+# Session reuse
+#---------------------------------------------------------------------------#
+class QueueSender(smtp.ESMTPClient):
+    ''' Sends every message queued on its factory over one session and
+    quits once the queue is empty
+    '''
+    requireAuthentication = False
+    requireTransportSecurity = False
+    current = None
+
+    def getMailFrom(self):
+        if not self.factory.queue:
+            # Later messages need a new session
+            self.factory.mailer.sessionDone(self.factory)
+            return None
+        self.current = self.factory.queue.pop(0)
+        return self.current[0]
+
+    def getMailTo(self):
+        return [self.current[1]]
+
+    def getMailData(self):
+        return StringIO(self.current[2])
+
+    def sentMail(self, code, resp, numOk, addresses, log):
+        current, self.current = self.current, None
+        self.factory.mailer.stats['sent'] += 1
+        if code in smtp.SUCCESS:
+            current[3].callback((numOk, addresses))
+        else:
+            current[3].errback(smtp.SMTPDeliveryError(code, resp, log.str(), addresses))
+
+    def sendError(self, exc):
+        smtp.SMTPClient.sendError(self, exc)
+        current, self.current = self.current, None
+        self.factory.fail(exc, current)
+
+    def timeoutConnection(self):
+        # A stalled server would not answer QUIT either
+        smtp.ESMTPClient.timeoutConnection(self)
+        self.transport.loseConnection()
+
+    def connectionLost(self, reason):
+        smtp.ESMTPClient.connectionLost(self, reason)
+        if self.current is not None or self.factory.queue:
+            current, self.current = self.current, None
+            self.factory.fail(reason, current)
+        else:
+            self.factory.mailer.sessionDone(self.factory)
+
+
+class QueueSenderFactory(ClientFactory):
+    ''' Holds the messages of one ESMTP session '''
+    protocol = QueueSender
+
+    def __init__(self, mailer, domain, timeout=30):
+        ''' :param mailer: The Mailer the session belongs to
+        :param domain: The recipient domain
+        :param timeout: The seconds to wait for each server response
+        '''
+        self.mailer = mailer
+        self.domain = domain
+        self.timeout = timeout
+        self.queue = []
+
+    def buildProtocol(self, addr):
+        p = self.protocol(None, None, self.mailer.identity)
+        p.factory = self
+        # Without one a server that stalls keeps the domain's queue forever
+        p.timeout = self.timeout
+        return p
+
+    def fail(self, exc, current=None):
+        ''' Fails the message being sent and every one still queued '''
+        self.mailer.sessionDone(self)
+        queued, self.queue = self.queue, []
+        if current is not None:
+            queued.insert(0, current)
+        for message in queued:
+            message[3].errback(exc)
+
+    def clientConnectionFailed(self, connector, reason):
+        self.fail(reason)
+
+
+class Mailer(object):
+    ''' Sends mail through the recipient domain's mail exchange, messages
+    queued while a session to that domain is open are sent on it
+    '''
+
+    def __init__(self, mxCache=None, port=25, identity='localhost', timeout=30):
+        ''' :param mxCache: The MXCache to resolve domains with
+        :param port: The SMTP port of the mail exchanges
+        :param identity: The name given in EHLO
+        :param timeout: The seconds to wait for each server response, a
+                        session that times out fails its queued messages
+        '''
+        self.mxCache = mxCache or MXCALCULATOR
+        self.port = port
+        self.identity = identity
+        self.timeout = timeout
+        self.sessions = {}
+        self.stats = {'sessions': 0, 'sent': 0}
+
+    def send(self, mailFrom, mailTo, msg, subject=""):
+        ''' Queues a message
+
+        :returns: A Deferred fired once the server accepted it
+        '''
         d = defer.Deferred()
-        factory = smtp.ESMTPSenderFactory(None, None, mailFrom, mailTo, msgfile, d,
-                                          requireAuthentication=False,
-                                          requireTransportSecurity=False)
-        reactor.connectTCP(host, 25, factory)
+        domain = mailTo.split("@")[1]
+        data = formatMessage(mailFrom, mailTo, msg, subject)
+        session = self.sessions.get(domain)
+        if session is None:
+            session = self.sessions[domain] = QueueSenderFactory(self, domain, self.timeout)
+            session.queue.append((mailFrom, mailTo, data, d))
+            self.stats['sessions'] += 1
+
+            def connect(host):
+                _logger.debug("emailing %s (using host %s) from %s" % (mailTo, host, mailFrom))
+                reactor.connectTCP(host, self.port, session)
+            lookup = self.mxCache.getMX(domain)
+            lookup.addCallbacks(connect, session.fail)
+        else:
+            session.queue.append((mailFrom, mailTo, data, d))
         return d
-    return getMailExchange(mailTo.split("@")[1]).addCallback(dosend)
 
+    def sessionDone(self, session):
+        if self.sessions.get(session.domain) is session:
+            del self.sessions[session.domain]
 
+MAILER = Mailer()
+def sendEmail(mailFrom, mailTo, msg, subject=""):
+    return MAILER.send(mailFrom, mailTo, msg, subject)
@@ -36,6 +36,7 @@ class ClientDecoder(object):
     __function_table = [
                         protectedReadRequest,
                         protectedWriteRequest,
+                        protectedBitWriteRequest,
                         Command_0F_Response
                         ]
     def __init__(self):
@@ -103,10 +104,14 @@ class ClientDecoder(object):
             ''' If bit 6 of the command byte is 0 then this is a command
                 sent from the PLC. We need to decode and respond.
             '''
-            function = ord(data[6])     # The function byte
-            print "cmd: ", command, "fnc: ", function
-            response = self.__sub_lookup[command][function]()
+            function = ord(data[8])     # The function byte
+            _logger.debug("PLC Command[%d] Function[%d]" % (command, function))
+            pdu = self.__sub_lookup.get(command, {}).get(function)
+            if pdu is None:
+                raise SerialException("Unsupported command %d function %d" % (command, function))
+            response = pdu(0, None)
             response.decode(data)
+            response.unsolicited = True
             
         if not response:
             raise SerialException("Unknown response %d" % function_code)
@@ -5,15 +5,17 @@ Adapted from: An example of using the FTP client
 ****************************************************** """
 
 # Twisted imports
-from twisted.protocols.ftp import FTPClient, FTPFileListProtocol
+from twisted.protocols.ftp import FTPClient, FTPClientBasic, FTPFileListProtocol
 from twisted.internet.protocol import Protocol, ClientCreator, ReconnectingClientFactory
-from twisted.python import usage, logfile
+from twisted.python import usage, logfile, failure
 from twisted.internet import reactor, defer, interfaces
 from twisted.internet.task import LoopingCall
 from twisted.protocols.basic import FileSender
 from zope.interface import implements
 
 import os
+from loggerfile import LogSlice
+from throttle import ThrottledFileSender
 
 # Standard library imports
 import string
@@ -23,6 +25,12 @@ try:
 except ImportError:
     from StringIO import StringIO
 
+#---------------------------------------------------------------------------#
+# Logging
+#---------------------------------------------------------------------------#
+import logging
+_logger = logging.getLogger(__name__)
+
     
 
 class FTPClientA(FTPClient):
@@ -32,10 +40,55 @@ class FTPClientA(FTPClient):
 
     ************************************************************** """
     def __init__(self, factory, username = 'anonymous', password = 'anonymous@', passive = 0):
+        # None until the server answered the TYPE I sent after login
+        self.binary = None
+        self.binaryWaiters = []
         FTPClient.__init__(self, username, password, passive)
         self.factory = factory
         self.debug = True
 
+    def queueLogin(self, username, password):
+        """ ******************************************************************
+        Login like FTPClient, but remember whether the server accepted
+        binary mode instead of swallowing a refusal
+        ****************************************************************** """
+        FTPClientBasic.queueLogin(self, username, password)
+        d = self.queueStringCommand('TYPE I')
+        d.addBoth(self._cbLoginBinary)
+
+    def _cbLoginBinary(self, result):
+        self.binary = not isinstance(result, failure.Failure)
+        if not self.binary:
+            print 'Server refused binary mode:', result.value
+        waiters, self.binaryWaiters = self.binaryWaiters, []
+        for d in waiters:
+            if self.binary:
+                d.callback(None)
+            else:
+                d.errback(result)
+
+    def binaryMode(self):
+        """ ******************************************************************
+        Make sure the session transfers bytes untranslated, servers in
+        ASCII mode rewrite CRLF pairs of an upload and refuse SIZE
+
+        @return: A L{Deferred} fired once the session is in binary mode,
+                 TYPE I is only sent again when the login's was refused
+        ****************************************************************** """
+        if self.binary:
+            return defer.succeed(None)
+        if self.binary is None:
+            d = defer.Deferred()
+            self.binaryWaiters.append(d)
+            return d
+        d = self.queueStringCommand('TYPE I')
+        d.addCallback(self._cbBinary)
+        return d
+
+    def _cbBinary(self, result):
+        self.binary = True
+        return result
+
     def appendFile(self, path, offset=0):
         """ ******************************************************************
         Append to a file at the given path
@@ -53,6 +106,11 @@ class FTPClientA(FTPClient):
 
     appe = appendFile
 
+    def connectionLost(self, reason):
+        # Lets a session pool see that this session is gone
+        self.connected = 0
+        FTPClient.connectionLost(self, reason)
+
 
 
 class FTPClientAFactory(ReconnectingClientFactory):
@@ -127,6 +185,80 @@ def sendOEEData(ftpProtocol, localFile, remoteFile):
     d1.addErrback(fail, "SendOEEData")
     return d2
 
+def sendLogData(ftpProtocol, localFile, remoteFile, offset=0, length=None, bucket=None):
+    """ ******************************************************************
+    Upload only the part of a log the server doesn't have
+
+    When the remote file is exactly offset bytes long the bytes after it
+    are sent with APPE.  A first upload, a failed SIZE or a size mismatch
+    (the server file was replaced, or our checkpoint is stale) sends the
+    whole file with STOR instead, and the reason is logged.
+
+    @param offset: the bytes the server is believed to have
+    @param length: the local size to send up to, None for all of it
+    @param bucket: a TokenBucket shaping the data channel, None sends
+                   as fast as the connection drains
+    @return: A L{Deferred} fired with the (start, bytes sent) of the upload
+    ****************************************************************** """
+    def cbSize(result):
+        # '213 <size>'
+        return int(result[-1].split()[-1])
+
+    def ebSize(failure):
+        _logger.warning("SIZE %s failed, sending it whole: %s" % (remoteFile, failure.value))
+        return None
+
+    def cbTransfer(remoteSize):
+        start = offset if (offset and remoteSize == offset) else 0
+        if offset and remoteSize is not None and not start:
+            _logger.warning("%s is %d bytes on the server, not %d, sending it whole"
+                            % (remoteFile, remoteSize, offset))
+        if start:
+            d1, d2 = ftpProtocol.appendFile(remoteFile)
+        else:
+            d1, d2 = ftpProtocol.storeFile(remoteFile)
+        source = LogSlice(localFile, start,
+                          length - start if length is not None else None)
+        d1.addCallback(cbStoreSource, source, bucket)
+        d1.addErrback(fail, "sendLogData")
+        d2.addBoth(lambda result: (source.close(), result)[1])
+        d2.addCallback(lambda _: (start, source.sent))
+        return d2
+
+    if offset:
+        # Servers refuse SIZE in ASCII mode
+        d = ftpProtocol.binaryMode()
+        d.addCallback(lambda _: ftpProtocol.queueStringCommand(
+            'SIZE ' + ftpProtocol.escapePath(remoteFile)))
+        d.addCallbacks(cbSize, ebSize)
+    else:
+        d = defer.succeed(None)
+    d.addCallback(cbTransfer)
+    return d
+
+def sendArchive(ftpProtocol, localFile, remoteFile, bucket=None):
+    """ ******************************************************************
+    Upload a compressed day as it is stored, with STOR
+
+    @param remoteFile: the remote name, keeping the .gz/.zst suffix
+    @param bucket: a TokenBucket shaping the data channel, None sends
+                   as fast as the connection drains
+    @return: A L{Deferred} fired with the bytes sent
+    ****************************************************************** """
+    source = LogSlice(localFile, raw=True)
+
+    def cbBinary(_):
+        d1, d2 = ftpProtocol.storeFile(remoteFile)
+        d1.addCallback(cbStoreSource, source, bucket)
+        d1.addErrback(fail, "sendArchive")
+        return d2
+
+    d = ftpProtocol.binaryMode()
+    d.addCallback(cbBinary)
+    d.addBoth(lambda result: (source.close(), result)[1])
+    d.addCallback(lambda _: source.sent)
+    return d
+
 def getRecipeFiles(ftpProtocol, localDir):
     def downloadRecipes(cmdDn):
         filename = localDir + '/' + 'families.csv'
@@ -146,13 +278,21 @@ def getRecipeFiles(ftpProtocol, localDir):
     d = ftpProtocol.retrieveFile('families.csv', recipeFile)
     d.addCallback(downloadRecipes)
     d.addErrback(fail, "getRecipeFiles")
+    return d
 
 def cbStore(consumer, filename):
     fs = FileSender()
-    d = fs.beginFileTransfer(open(filename, 'r'), consumer)
+    # Compressed days are sent as stored
+    d = fs.beginFileTransfer(open(filename, 'rb'), consumer)
     d.addCallback(lambda _: consumer.finish()).addErrback(fail, "cbStore")
     return d
 
+def cbStoreSource(consumer, source, bucket=None):
+    fs = ThrottledFileSender(bucket) if bucket is not None else FileSender()
+    d = fs.beginFileTransfer(source, consumer)
+    d.addCallback(lambda _: consumer.finish()).addErrback(fail, "cbStoreSource")
+    return d
+
 def fail(error, msg=''):
     stringMsg = msg + ': Failed.  Error was: ', error, error.value
     print stringMsg
@@ -0,0 +1,191 @@
+"""
+FTP Session Pool
+-------------------------------------------
+
+Keeps a small number of logged in FTP control connections open so log
+uploads and recipe downloads no longer pay for TCP setup and login on
+every transfer.  Idle sessions are kept alive with NOOP, sessions that
+drop are replaced on the next transfer, and a transfer that fails because
+its session died is retried once on a fresh one.
+
+Transfers are functions called with the session's FTPClientA as their
+first argument (the existing ftpclient helpers)::
+
+    pool = FTPSessionPool(endpoint, size=1, keepalive=30)
+    d = pool.run(sendLogData, localFile, remoteFile, offset, length)
+"""
+
+from twisted.internet import defer, error
+from twisted.internet.task import LoopingCall
+from twisted.protocols.ftp import ConnectionLost
+
+from ftpclient import FTPClientAFactory
+
+#---------------------------------------------------------------------------#
+# Logging
+#---------------------------------------------------------------------------#
+import logging
+_logger = logging.getLogger(__name__)
+
+
+#---------------------------------------------------------------------------#
+# Constants
+#---------------------------------------------------------------------------#
+# Failures that mean the session is gone, not that the transfer is bad
+SESSION_ERRORS = (ConnectionLost, error.ConnectionLost, error.ConnectionDone)
+
+
+class FTPSessionPool(object):
+    ''' A bounded pool of reusable FTP sessions
+    '''
+
+    def __init__(self, endpoint, size=1, keepalive=30):
+        ''' Initializes the pool, sessions are opened on demand
+
+        :param endpoint: The endpoint of the FTP server
+        :param size: The most sessions kept open at once
+        :param keepalive: The seconds between NOOPs on idle sessions,
+                          0 disables the keepalive
+        '''
+        self.endpoint = endpoint
+        self.size = size
+        self.idle = []
+        self.busy = 0
+        self.waiting = []
+        self.stats = {'connects': 0, 'reuses': 0, 'transfers': 0,
+                      'failures': 0, 'retries': 0, 'noops': 0, 'dropped': 0}
+        self.lcKeepAlive = None
+        if keepalive:
+            self.lcKeepAlive = LoopingCall(self.keepAlive)
+            self.lcKeepAlive.start(keepalive, now=False)
+
+    #-----------------------------------------------------------------------#
+    # Sessions
+    #-----------------------------------------------------------------------#
+    def isAlive(self, session):
+        return bool(session.connected)
+
+    def acquire(self):
+        ''' Returns a Deferred fired with a session, reusing an idle one '''
+        while self.idle:
+            session = self.idle.pop()
+            if self.isAlive(session):
+                self.busy += 1
+                self.stats['reuses'] += 1
+                return defer.succeed(session)
+            self.stats['dropped'] += 1
+        if self.busy < self.size:
+            return self.connect()
+        d = defer.Deferred()
+        self.waiting.append(d)
+        return d
+
+    def connect(self):
+        ''' Opens a new session, counted as busy '''
+        self.busy += 1
+        self.stats['connects'] += 1
+        d = self.endpoint.connect(FTPClientAFactory())
+
+        def ebConnect(failure):
+            self.busy -= 1
+            self.wakeWaiter()
+            return failure
+        d.addErrback(ebConnect)
+        return d
+
+    def release(self, session):
+        ''' Returns a session to the pool or hands it to a waiting transfer '''
+        if not self.isAlive(session):
+            self.busy -= 1
+            self.stats['dropped'] += 1
+            self.wakeWaiter()
+            return
+        if self.waiting:
+            self.stats['reuses'] += 1
+            self.waiting.pop(0).callback(session)
+            return
+        self.busy -= 1
+        self.idle.append(session)
+
+    def wakeWaiter(self):
+        ''' Opens a session for the next waiting transfer, if any '''
+        if self.waiting and self.busy < self.size:
+            self.connect().chainDeferred(self.waiting.pop(0))
+
+    #-----------------------------------------------------------------------#
+    # Transfers
+    #-----------------------------------------------------------------------#
+    def run(self, function, *args, **kwargs):
+        ''' Runs a transfer on a pooled session
+
+        :param function: Called as function(session, *args, **kwargs),
+                         may return a Deferred
+        :returns: A Deferred fired with the transfer's result
+        '''
+        return self._run(True, function, args, kwargs)
+
+    def _run(self, retry, function, args, kwargs):
+        d = self.acquire()
+
+        def cbSession(session):
+            result = defer.maybeDeferred(function, session, *args, **kwargs)
+            result.addBoth(cbDone, session)
+            return result
+
+        def cbDone(result, session):
+            self.stats['transfers'] += 1
+            self.release(session)
+            return result
+
+        def ebTransfer(failure):
+            if retry and failure.check(*SESSION_ERRORS):
+                self.stats['retries'] += 1
+                return self._run(False, function, args, kwargs)
+            self.stats['failures'] += 1
+            return failure
+
+        d.addCallback(cbSession)
+        d.addErrback(ebTransfer)
+        return d
+
+    def keepAlive(self):
+        ''' Sends NOOP on every idle session and drops the dead ones '''
+        for session in list(self.idle):
+            if not self.isAlive(session):
+                self.idle.remove(session)
+                self.stats['dropped'] += 1
+                continue
+            self.stats['noops'] += 1
+            d = session.queueStringCommand('NOOP')
+            d.addErrback(self.ebKeepAlive, session)
+
+    def ebKeepAlive(self, failure, session):
+        _logger.debug("FTP keepalive failed: %s" % failure.value)
+        if session in self.idle:
+            self.idle.remove(session)
+            self.stats['dropped'] += 1
+        session.transport.loseConnection()
+
+    def close(self):
+        ''' Stops the keepalive and logs out the idle sessions '''
+        if self.lcKeepAlive is not None and self.lcKeepAlive.running:
+            self.lcKeepAlive.stop()
+        for session in self.idle:
+            if self.isAlive(session):
+                session.quit().addErrback(lambda _: None)
+        self.idle = []
+
+    def getStats(self):
+        ''' Returns the session counters '''
+        stats = dict(self.stats)
+        stats.update({'idle': len(self.idle), 'busy': self.busy,
+                      'waiting': len(self.waiting)})
+        return stats
+
+
+#---------------------------------------------------------------------------#
+# Exported symbols
+#---------------------------------------------------------------------------#
+__all__ = [
+    "FTPSessionPool",
+]
@@ -0,0 +1,286 @@
+"""
+In-Memory Tag History
+-------------------------------------------
+
+Keeps a bounded, in-memory history of every numeric tag so trends can be
+served without re-parsing the daily CSV files.  Each tag owns a fixed
+size ring buffer of raw samples taken at the poll rate plus min/max/mean
+rollups at 1 second, 1 minute and 1 hour.  All buffers are preallocated
+NumPy arrays so memory never grows after startup.
+
+Example::
+
+    history = TagHistory(tags, tags.pollClass('oee'))
+    history.record(results, handles)
+    times, values = history.query(handle, minutes=15)
+    times, mins, maxs, means = history.query(handle, minutes=120, period=60)
+
+The buffer sizes are read from the optional [History] section::
+
+    [History]
+    RawSamples = 3600
+    Seconds    = 3600
+    Minutes    = 1440
+    Hours      = 168
+"""
+
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from serialexceptions import ParameterException
+
+#---------------------------------------------------------------------------#
+# Logging
+#---------------------------------------------------------------------------#
+import logging
+_logger = logging.getLogger(__name__)
+
+
+#---------------------------------------------------------------------------#
+# Constants
+#---------------------------------------------------------------------------#
+ROLLUP_PERIODS = (1, 60, 3600)
+NUMERIC_TYPES = ('int16', 'float32', 'bit', 'timer', 'counter')
+
+
+#---------------------------------------------------------------------------#
+# Ring Buffers
+#---------------------------------------------------------------------------#
+class RingBuffer(object):
+    ''' A fixed size ring of timestamped columns
+
+    Samples must be appended in time order, which makes the populated part
+    of the ring two sorted runs.  A window query is a binary search on the
+    timestamps followed by a copy of only the matching rows.
+    '''
+
+    def __init__(self, size, columns=1):
+        ''' Preallocates the ring
+
+        :param size: The number of rows kept
+        :param columns: The number of value columns per row
+        '''
+        self.size = size
+        self.times = numpy.zeros(size, dtype=numpy.float64)
+        self.values = numpy.zeros((size, columns), dtype=numpy.float64)
+        self.head = 0
+        self.count = 0
+
+    def append(self, timestamp, *values):
+        ''' Adds a row, overwriting the oldest row when full
+
+        :param timestamp: The unix time of the row
+        :param values: One value per column
+        '''
+        self.times[self.head] = timestamp
+        self.values[self.head] = values
+        self.head = (self.head + 1) % self.size
+        if self.count < self.size:
+            self.count += 1
+
+    def window(self, since):
+        ''' Returns copies of every row at or after a time
+
+        :param since: The unix time the window starts at
+        :returns: A tuple of (times, values) arrays in time order
+        '''
+        if self.count < self.size:
+            runs = [(0, self.count)]
+        else:
+            runs = [(self.head, self.size), (0, self.head)]
+
+        times, values = [], []
+        for start, end in runs:
+            first = start + numpy.searchsorted(self.times[start:end], since)
+            if first < end:
+                times.append(self.times[first:end])
+                values.append(self.values[first:end])
+
+        if not times:
+            return (numpy.zeros(0), numpy.zeros((0, self.values.shape[1])))
+        return (numpy.concatenate(times), numpy.concatenate(values))
+
+    def nbytes(self):
+        ''' Returns the memory held by the ring '''
+        return self.times.nbytes + self.values.nbytes
+
+
+class Rollup(object):
+    ''' Accumulates raw samples into fixed period min/max/mean rows
+    '''
+
+    def __init__(self, period, size):
+        ''' Initializes the rollup
+
+        :param period: The bucket length in seconds
+        :param size: The number of finished buckets kept
+        '''
+        self.period = period
+        self.ring = RingBuffer(size, 3)
+        self.bucket = None
+        self.low = self.high = self.total = 0.0
+        self.samples = 0
+
+    def add(self, timestamp, value):
+        ''' Adds a raw sample, closing the current bucket when the
+        sample falls into a later one
+
+        :param timestamp: The unix time of the sample
+        :param value: The sample value
+        '''
+        bucket = int(timestamp // self.period)
+        if bucket != self.bucket:
+            self.flush()
+            self.bucket = bucket
+            self.low = self.high = self.total = value
+            self.samples = 1
+            return
+        if value < self.low: self.low = value
+        if value > self.high: self.high = value
+        self.total += value
+        self.samples += 1
+
+    def flush(self):
+        ''' Writes the open bucket to the ring '''
+        if self.samples:
+            self.ring.append(self.bucket * self.period, self.low, self.high,
+                             self.total / self.samples)
+            self.samples = 0
+
+    def window(self, since):
+        ''' Returns the finished rows at or after a time and the open
+        bucket if it reaches into the window
+
+        :param since: The unix time the window starts at
+        :returns: A tuple of (times, values) arrays in time order
+        '''
+        times, values = self.ring.window(since)
+        if self.samples and (self.bucket + 1) * self.period > since:
+            times = numpy.append(times, self.bucket * self.period)
+            values = numpy.vstack((values, (self.low, self.high,
+                                            self.total / self.samples)))
+        return (times, values)
+
+
+class SeriesHistory(object):
+    ''' The raw ring and rollups for a single tag
+    '''
+
+    def __init__(self, rawSize, rollupSizes):
+        ''' Initializes the tag buffers
+
+        :param rawSize: The number of raw samples kept
+        :param rollupSizes: A list of (period, size) for each rollup
+        '''
+        self.raw = RingBuffer(rawSize)
+        self.rollups = dict((period, Rollup(period, size))
+                            for period, size in rollupSizes)
+
+    def add(self, timestamp, value):
+        self.raw.append(timestamp, value)
+        for rollup in self.rollups.itervalues():
+            rollup.add(timestamp, value)
+
+    def nbytes(self):
+        return self.raw.nbytes() + sum(r.ring.nbytes() for r in self.rollups.itervalues())
+
+
+#---------------------------------------------------------------------------#
+# Tag History
+#---------------------------------------------------------------------------#
+class TagHistory(object):
+    ''' Bounded in-memory history for a set of tags
+    '''
+
+    def __init__(self, tags, handles, rawSize=3600, seconds=3600, minutes=1440, hours=168):
+        ''' Preallocates the buffers for every numeric tag
+
+        :param tags: The compiled TagDictionary
+        :param handles: The tag handles to keep history for
+        :param rawSize: The number of raw samples kept per tag
+        :param seconds: The number of 1 second rollups kept per tag
+        :param minutes: The number of 1 minute rollups kept per tag
+        :param hours: The number of 1 hour rollups kept per tag
+        '''
+        if numpy is None:
+            raise ParameterException("TagHistory requires numpy")
+        rollups = zip(ROLLUP_PERIODS, (seconds, minutes, hours))
+        self.tags = tags
+        self.series = {}
+        for handle in handles:
+            if tags[handle].dataType in NUMERIC_TYPES:
+                self.series[handle] = SeriesHistory(rawSize, rollups)
+
+    @classmethod
+    def fromConfig(cls, config, tags, handles):
+        ''' Builds the history using the [History] buffer sizes
+
+        :param config: The utilities.optionReader to read sizes from
+        :param tags: The compiled TagDictionary
+        :param handles: The tag handles to keep history for
+        '''
+        return cls(tags, handles, **config.getHistorySizes())
+
+    def record(self, results, handles, timestamp=None):
+        ''' Records one poll worth of values
+
+        :param results: The list of records returned for each handle
+        :param handles: The tag handles that were read
+        :param timestamp: The unix time of the poll (defaults to now)
+        :returns: The results, so this can be used as a callback
+        '''
+        if timestamp is None:
+            timestamp = time.time()
+        series = self.series
+        for i in range(len(handles)):
+            history = series.get(handles[i])
+            if history is None:
+                continue
+            value = results[i]
+            if hasattr(value, '__iter__'):
+                if not value: continue
+                value = value[0]
+            try:
+                history.add(timestamp, float(value))
+            except (TypeError, ValueError):
+                _logger.debug("Skipping history value %r" % (value,))
+        return results
+
+    def query(self, handle, minutes, period=None, now=None):
+        ''' Returns the history of a tag over the last N minutes
+
+        :param handle: The tag handle
+        :param minutes: The length of the window in minutes
+        :param period: None for raw samples or one of 1, 60 or 3600
+        :param now: The end of the window (defaults to now)
+        :returns: (times, values) for raw samples or
+                  (times, mins, maxs, means) for rollups, the last row
+                  of which may be the bucket still open
+        '''
+        history = self.series.get(handle)
+        if history is None:
+            raise ParameterException("No history kept for tag %s" % handle)
+        since = (now if now is not None else time.time()) - minutes*60.0
+        if period is None:
+            times, values = history.raw.window(since)
+            return (times, values[:, 0])
+        if period not in history.rollups:
+            raise ParameterException("Unknown rollup period %s" % period)
+        times, values = history.rollups[period].window(since)
+        return (times, values[:, 0], values[:, 1], values[:, 2])
+
+    def nbytes(self):
+        ''' Returns the total memory preallocated for history '''
+        return sum(s.nbytes() for s in self.series.itervalues())
+
+
+#---------------------------------------------------------------------------#
+# Exported symbols
+#---------------------------------------------------------------------------#
+__all__ = [
+    "RingBuffer", "Rollup", "TagHistory", "ROLLUP_PERIODS",
+]
@@ -1,24 +1,358 @@
 """
 A rotating, browsable log file.
+
+Finished days can be compressed with gzip (or zstd when the zstandard
+module is installed) by a background thread, so rotation never stalls
+the reactor.  Compressed days are recorded in a small rolling index and
+are read back transparently by getLog.
+
+Every IndexEvery records the (unix time, byte offset) of a row is appended
+to a YYMMDD00.idx sidecar, so a time window can be read by seeking close
+to its start instead of scanning the whole day::
+
+    for row in logger.getRange(start, end):
+        ...
 """
 
 # System Imports
-import os, glob, time, stat
+import os, glob, time, stat, re, gzip, shutil, threading, io, struct, bisect
 import utilities
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+#---------------------------------------------------------------------------#
+# Logging
+#---------------------------------------------------------------------------#
+import logging
+_logger = logging.getLogger(__name__)
+
+# Daily logs are named YYMMDD00.csv, optionally compressed
+LOG_NAME = re.compile(r'^(\d{8})\.csv(\.gz|\.zst)?$')
+COMPRESSED_SUFFIX = {'gzip': '.gz', 'zstd': '.zst'}
+INDEX_NAME = 'compressed.idx'
+UPLOADED_NAME = 'uploaded.idx'
+# Sparse time index entries: unix time, byte offset of the row
+OFFSET_ENTRY = struct.Struct('<dQ')
+
+
+def indexName(logName):
+    """Return the time index that sits next to a (compressed) log"""
+    return os.path.join(os.path.dirname(logName),
+                        os.path.basename(logName)[:8] + '.idx')
+
+
+def readIndex(logName):
+    """Return the (times, offsets) of a log's time index"""
+    times, offsets = [], []
+    filename = indexName(logName)
+    if os.path.exists(filename):
+        data = open(filename, 'rb').read()
+        for i in range(len(data) // OFFSET_ENTRY.size):
+            stamp, offset = OFFSET_ENTRY.unpack_from(data, OFFSET_ENTRY.size*i)
+            times.append(stamp)
+            offsets.append(offset)
+    return times, offsets
+
+
+def openLog(filename):
+    """Open a plain or compressed log for reading lines"""
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'rb')
+    if filename.endswith('.zst'):
+        if zstandard is None:
+            raise ValueError, "zstandard is required to read %s" % filename
+        raw = zstandard.ZstdDecompressor().stream_reader(open(filename, 'rb'))
+        return io.BufferedReader(raw)
+    return open(filename, 'r')
+
+
+def seekLog(fObj, offset):
+    """Move an opened log to a byte offset of the uncompressed data"""
+    try:
+        fObj.seek(offset)
+    except (IOError, OSError, ValueError):
+        # Streams that can't seek are read forward instead
+        fObj.seek(0)
+        while offset > 0:
+            chunk = fObj.read(min(offset, 64*1024))
+            if not chunk:
+                break
+            offset -= len(chunk)
+
+
+class LogSlice(object):
+    """A read only file like view of part of a (compressed) log.
+    Used as the producer of incremental uploads, it counts what was read
+    so the caller knows exactly how many bytes were sent.  With raw a
+    compressed log is read as stored instead of decompressed.
+    """
+
+    def __init__(self, filename, offset=0, length=None, raw=False):
+        self._file = open(filename, 'rb') if raw else openLog(filename)
+        if offset:
+            seekLog(self._file, offset)
+        self.offset = offset
+        self.remaining = length
+        self.sent = 0
+
+    def read(self, size=-1):
+        if self.remaining is not None:
+            if size < 0 or size > self.remaining:
+                size = self.remaining
+            if size == 0:
+                return ''
+        data = self._file.read(size)
+        self.sent += len(data)
+        if self.remaining is not None:
+            self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self._file.close()
+
+
+def compressLog(path, codec):
+    """Stream a finished log through gzip or zstd.
+    The archive is written to a temporary name and renamed into place
+    before the original is removed, so a crash never loses a day.
+    @return: the archive path
+    """
+    archive = path + COMPRESSED_SUFFIX[codec]
+    temp = archive + '.tmp'
+    source = open(path, 'rb')
+    try:
+        if codec == 'zstd':
+            target = open(temp, 'wb')
+            try:
+                zstandard.ZstdCompressor().copy_stream(source, target)
+            finally:
+                target.close()
+        else:
+            target = gzip.open(temp, 'wb')
+            try:
+                shutil.copyfileobj(source, target, 64*1024)
+            finally:
+                target.close()
+    finally:
+        source.close()
+    os.rename(temp, archive)
+    os.remove(path)
+    return archive
+
+
+class LogEntry(object):
+    """A day in the log catalog"""
+    __slots__ = ('name', 'size', 'uploaded')
+
+    def __init__(self, name, size=0, uploaded=0):
+        self.name = name
+        self.size = size
+        self.uploaded = uploaded
+
+    def __repr__(self):
+        return 'LogEntry(%r, %d, %d)' % (self.name, self.size, self.uploaded)
+
+
+class LogCatalog(object):
+    """The daily logs of a directory, keyed by their YYMMDD00 stem.
+
+    The catalog is built once from the file names and then kept up to date
+    by the logger, so listing, retention and upload catch-up never have to
+    scan or stat the directory again.  Sizes are of the uncompressed log.
+    Uploaded offsets are persisted to uploaded.idx so incremental uploads
+    resume after a restart.
+    """
+
+    def __init__(self, directory, archives=None):
+        """
+        @param directory: directory holding the logs
+        @param archives: the compressed day index, used for raw sizes
+        """
+        self.directory = directory
+        self.entries = {}
+        self._lock = threading.Lock()
+        archives = archives or {}
+        uploaded = self._readUploaded()
+        for name in os.listdir(directory):
+            match = LOG_NAME.match(name)
+            if not match:
+                continue
+            if match.group(2) and name[:-len(match.group(2))] in archives:
+                size = archives[name[:-len(match.group(2))]][2]
+            else:
+                size = os.path.getsize(os.path.join(directory, name))
+            # Days without a checkpoint are taken as already uploaded
+            self.entries[match.group(1)] = LogEntry(name, size,
+                                                    uploaded.get(match.group(1), size))
+
+    def names(self):
+        """Return the log names, oldest first"""
+        with self._lock:
+            return [self.entries[stem].name for stem in sorted(self.entries)]
+
+    def get(self, name):
+        return self.entries.get(name[:8])
+
+    def add(self, name, size=0):
+        """Add (or resume) a day"""
+        with self._lock:
+            entry = self.entries.get(name[:8])
+            if entry is None:
+                entry = self.entries[name[:8]] = LogEntry(name)
+            entry.size = size
+            return entry
+
+    def rename(self, name, newName):
+        """Record that a day is now stored under another name"""
+        with self._lock:
+            entry = self.entries.get(name[:8])
+            if entry is not None:
+                entry.name = newName
+
+    def remove(self, name):
+        with self._lock:
+            self.entries.pop(name[:8], None)
+
+    def setSize(self, name, size):
+        self.entries[name[:8]].size = size
+
+    def markUploaded(self, name, offset):
+        """Record how much of a day the server has and checkpoint it"""
+        entry = self.entries.get(name[:8])
+        if entry is not None:
+            entry.uploaded = offset
+            self._writeUploaded()
+
+    def _readUploaded(self):
+        """Load the uploaded offset checkpoints"""
+        uploaded = {}
+        path = os.path.join(self.directory, UPLOADED_NAME)
+        if os.path.exists(path):
+            for line in open(path, 'r'):
+                fields = line.strip().split(',')
+                if len(fields) == 2:
+                    uploaded[fields[0]] = int(fields[1])
+        return uploaded
+
+    def _writeUploaded(self):
+        """Rewrite the uploaded offset checkpoints"""
+        with self._lock:
+            lines = ['%s,%d\n' % (stem, self.entries[stem].uploaded)
+                     for stem in sorted(self.entries)]
+        path = os.path.join(self.directory, UPLOADED_NAME)
+        fObj = open(path + '.tmp', 'w')
+        fObj.write(''.join(lines))
+        fObj.close()
+        os.rename(path + '.tmp', path)
+
+    def pending(self):
+        """Return the days with rows the server doesn't have, oldest first"""
+        with self._lock:
+            return [self.entries[stem] for stem in sorted(self.entries)
+                    if self.entries[stem].uploaded < self.entries[stem].size]
+
+
+class LogReader(object):
+    """Read lines from a plain or compressed daily log"""
+
+    def __init__(self, name):
+        self.name = name
+        self._file = openLog(name)
+
+    def readLines(self, lines=10):
+        """Read a list of lines from the log file.
+        This doesn't return all of the file's lines - call it multiple times.
+        """
+        result = []
+        for i in range(lines):
+            line = self._file.readline()
+            if not line:
+                break
+            result.append(line)
+        return result
+
+    def __iter__(self):
+        return iter(self._file.readline, '')
+
+    def seek(self, offset):
+        """Move to a byte offset of the uncompressed log"""
+        seekLog(self._file, offset)
+
+    def range(self, start, end):
+        """Yield the rows logged between two unix times (inclusive).
+        The time index is used to seek to the last indexed row at or
+        before start, then rows are streamed until one is past end.
+        """
+        times, offsets = readIndex(self.name)
+        position = bisect.bisect_right(times, start) - 1
+        self.seek(offsets[position] if position >= 0 else 0)
+        # 'YYYYmmddHH:MM:SS' compares as text, across midnight too
+        first = time.strftime('%Y%m%d%H:%M:%S', time.localtime(start))
+        last = time.strftime('%Y%m%d%H:%M:%S', time.localtime(end))
+        for line in self:
+            fields = line.split(',', 2)
+            if len(fields) < 2 or not fields[0][:1].isdigit():
+                continue
+            date = fields[0]
+            stamp = date[6:10] + date[0:2] + date[3:5] + fields[1]
+            if stamp < first:
+                continue
+            if stamp > last:
+                break
+            yield line
+
+    def close(self):
+        self._file.close()
+
+
 
 class DailyLogger(object):
     """A log file that is rotated daily (at or after midnight localtime)
     """
-    def __init__(self, name, directory, defaultMode=None, maxRotatedFiles=7):
+    def __init__(self, name, directory, defaultMode=None, maxRotatedFiles=7, header=None,
+                 flushBytes=0, flushInterval=0, fsyncOnRotate=False, compress=None,
+                 indexEvery=60):
         """
         Create a log file.
         @param name: name of the file
         @param directory: directory holding the file
         @param defaultMode: permissions used to create the file. Default to
         current permissions of the file if the file exists.
+        @param header: list of column names written to new files. Defaults
+        to the [SLC] Header of the configuration.
+        @param flushBytes: buffer writes until this many bytes are pending.
+        @param flushInterval: buffer writes for at most this many seconds.
+        If both are 0 every write goes straight to the line buffered file.
+        @param fsyncOnRotate: fsync a day's file before it is closed.
+        @param compress: 'gzip' or 'zstd' to compress each finished day in
+        a background thread. zstd falls back to gzip when the zstandard
+        module is not installed.
+        @param indexEvery: add a time index entry every this many records,
+        0 disables the index.
         """
         self.directory = directory
+        self.flushBytes = flushBytes
+        self.flushInterval = flushInterval
+        self.fsyncOnRotate = fsyncOnRotate
+        self.buffered = (flushBytes > 0 or flushInterval > 0)
+        self._pending = []
+        self.pendingBytes = 0
+        self.bytesWritten = 0
+        self.flushes = 0
+        self.indexEvery = indexEvery
+        self.lastFlush = time.time()
+        if compress == 'zstd' and zstandard is None:
+            compress = 'gzip'
+        self.compress = compress if compress in COMPRESSED_SUFFIX else None
+        self._indexLock = threading.Lock()
+        self.archives = self._readIndex()
+        self.catalog = LogCatalog(directory, self.archives)
+        if header is None:
+            header = utilities.optionReader().getLoggerHeader()
+        self.header = ','.join(map(str, header))
         self.name = name
         self.maxRotatedFiles = maxRotatedFiles
         self.path = os.path.join(directory, name)
@@ -27,29 +361,43 @@ class DailyLogger(object):
         else:
             self.defaultMode = defaultMode
         self._openFile()
+        if self.compress:
+            # Days left uncompressed by an earlier run
+            backlog = [os.path.join(directory, n) for n in self.listLogs()
+                       if n.endswith('.csv') and n != self.name]
+            self._startCompression(backlog)
 
     
     def _openFile(self):
         self.closed = False
+        # Buffered mode joins the pending rows itself, so each flush is
+        # a single write to an unbuffered file
+        buffering = 0 if self.buffered else 1
 
         if os.path.exists(self.path):
-            self._file = file(self.path, "r+", 1)
+            self._file = file(self.path, "r+", buffering)
             self._file.seek(0, 2)
         else:
-            config = utilities.optionReader()
             if self.defaultMode is not None:
                 # Set the lowest permissions
                 oldUmask = os.umask(0o777)
                 try:
-                    self._file = file(self.path, "w+", 1)
+                    self._file = file(self.path, "w+", buffering)
                     #write header information
-                    self._file.write(','.join(map(str,config.getLoggerHeader())))
+                    self._file.write(self.header + '\n')
                 finally:
                     os.umask(oldUmask)
             else:
-                self._file = file(self.path, "w+", 1)
+                self._file = file(self.path, "w+", buffering)
                 #write header information
-                self._file.write(','.join(map(str,config.getLoggerHeader())))
+                self._file.write(self.header + '\n')
+
+        # The logical size includes rows that are still pending
+        self.size = self._file.tell()
+        self.records = 0
+        self._index = None
+        if self.indexEvery:
+            self._index = open(indexName(self.path), 'ab')
 
         if self.defaultMode is not None:
             try:
@@ -59,6 +407,7 @@ class DailyLogger(object):
                 pass
 
         self.lastDate = self.toDate(os.stat(self.path)[8])
+        self.catalog.add(os.path.basename(self.path), self.size)
 
     def shouldRotate(self):
         """Rotate when the date has changed since last write"""
@@ -75,29 +424,70 @@ class DailyLogger(object):
 
     def dateFile(self, t):
         """Return the file name given a (year, month, day) tuple or unixtime"""
-        try:
-            return '%02d%02d%02d00.csv' % (t[0]-100*(int(t[0]/100)), t[1], t[2])
-        except:
+        if not isinstance(t, (tuple, list)):
             # try taking a float unixtime
-            return '_'.join(map(str, self.toDate(tupledate)))
+            t = self.toDate(t)
+        return '%02d%02d%02d00.csv' % (t[0]-100*(int(t[0]/100)), t[1], t[2])
+
+    def getCurrentLog(self):
+        """Return a LogReader for the current log file."""
+        self.flush()
+        return LogReader(self.path)
 
     def getLog(self, identifier):
-        """Given a unix time, return a LogReader for an old log file."""
+        """Given a unix time, return a LogReader for an old log file.
+        Compressed days are read transparently.
+        """
         if self.toDate(identifier) == self.lastDate:
             return self.getCurrentLog()
         filename = "%s" % (os.path.join(self.directory, self.dateFile(identifier)))
-        if not os.path.exists(filename):
-            raise ValueError, "no such logfile exists"
-        return LogReader(filename)
+        for suffix in ('', '.gz', '.zst'):
+            if os.path.exists(filename + suffix):
+                return LogReader(filename + suffix)
+        raise ValueError, "no such logfile exists"
+
+    def getRange(self, start, end):
+        """Yield the rows logged between two unix times, across days"""
+        day = start
+        while self.toDate(day) <= self.toDate(end):
+            try:
+                reader = self.getLog(day)
+            except ValueError:
+                reader = None
+            if reader is not None:
+                try:
+                    for row in reader.range(max(start, day), end):
+                        yield row
+                finally:
+                    reader.close()
+            # Step to the next local midnight
+            date = self.toDate(day)
+            day = time.mktime((date[0], date[1], date[2] + 1, 0, 0, 0, 0, 0, -1))
 
-    def write(self, data):
+    def write(self, data, timestamp=None):
         """
         Write some data to the file.
+        @param timestamp: the unix time of the row, used for the time index.
         """
         if self.shouldRotate():
             self.flush()
             self.rotate()
-        self._file.write(data)
+        if self._index is not None and self.records % self.indexEvery == 0:
+            if timestamp is None:
+                timestamp = time.time()
+            self._index.write(OFFSET_ENTRY.pack(timestamp, self.size))
+        self.records += 1
+        self.size += len(data)
+        self.catalog.setSize(self.name, self.size)
+        if self.buffered:
+            self._pending.append(data)
+            self.pendingBytes += len(data)
+            if ((self.flushBytes and self.pendingBytes >= self.flushBytes) or
+                    (self.flushInterval and time.time() - self.lastFlush >= self.flushInterval)):
+                self.flush()
+        else:
+            self._file.write(data)
+            self.bytesWritten += len(data)
         # Guard against a corner case where time.time()
         # could potentially run backwards to yesterday.
         # Primarily due to network time.
@@ -106,10 +496,46 @@ class DailyLogger(object):
 
     def flush(self):
         """
-        Flush the file
+        Write any buffered rows and flush the file
         """
-
+        if self._pending:
+            data = ''.join(self._pending)
+            self._pending = []
+            self.pendingBytes = 0
+            self._file.write(data)
+            self.bytesWritten += len(data)
         self._file.flush()
+        if self._index is not None:
+            self._index.flush()
+        self.flushes += 1
+        self.lastFlush = time.time()
+
+    def sync(self):
+        """
+        Flush the file and force it to disk
+        """
+        self.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        """
+        Flush, sync and close the file. Used on shutdown so buffered
+        rows are never lost.
+        """
+        if self.closed:
+            return
+        self.sync()
+        self._file.close()
+        if self._index is not None:
+            self._index.close()
+        self.closed = True
+
+    def getStats(self):
+        """
+        Return the writer counters
+        """
+        return {'bytesWritten': self.bytesWritten, 'flushes': self.flushes,
+                'pendingBytes': self.pendingBytes}
 
     def rotate(self):
         """Rotate the file and create a new one.
@@ -122,27 +548,93 @@ class DailyLogger(object):
         logs = self.listLogs()
         if (self.maxRotatedFiles is not None) and (len(logs)>=self.maxRotatedFiles):
             for i in range(len(logs)-self.maxRotatedFiles):
-                os.remove("%s" % (os.path.join(self.directory, logs[i])))
+                self.removeDay(logs[i])
 
         self.name = self.dateFile(self.toDate())
         newpath = "%s" % (os.path.join(self.directory, self.name))
+        if self.fsyncOnRotate:
+            self.sync()
         self._file.close()
+        if self._index is not None:
+            self._index.close()
+        oldpath = self.path
         self.path = newpath
         self._openFile()
+        if self.compress:
+            self._startCompression([oldpath])
+
+    def removeDay(self, name):
+        """Remove a day's log together with its sidecar files"""
+        self.catalog.remove(name)
+        for filename in glob.glob(os.path.join(self.directory, name[:8] + '.*')):
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+
+    def _startCompression(self, paths):
+        """Compress finished logs in a daemon thread"""
+        if not paths:
+            return
+        thread = threading.Thread(target=self._compress, args=(paths,))
+        thread.daemon = True
+        thread.start()
+
+    def _compress(self, paths):
+        """Compress finished logs and record them in the index.
+        Runs in a background thread.
+        """
+        for path in paths:
+            try:
+                rawSize = os.path.getsize(path)
+                archive = compressLog(path, self.compress)
+            except (IOError, OSError), ex:
+                _logger.error("Unable to compress %s: %s" % (path, ex))
+                continue
+            with self._indexLock:
+                self.archives[os.path.basename(path)] = (os.path.basename(archive),
+                    self.compress, rawSize, os.path.getsize(archive))
+                self._writeIndex()
+            self.catalog.rename(os.path.basename(path), os.path.basename(archive))
+
+    def _readIndex(self):
+        """Load the index of compressed days"""
+        archives = {}
+        indexPath = os.path.join(self.directory, INDEX_NAME)
+        if os.path.exists(indexPath):
+            for line in open(indexPath, 'r'):
+                fields = line.strip().split(',')
+                if len(fields) == 5:
+                    archives[fields[0]] = (fields[1], fields[2], int(fields[3]), int(fields[4]))
+        return archives
+
+    def _writeIndex(self):
+        """Rewrite the index, dropping days that have since been removed"""
+        lines = []
+        for name in sorted(self.archives):
+            archive, codec, rawSize, size = self.archives[name]
+            if os.path.exists(os.path.join(self.directory, archive)):
+                lines.append('%s,%s,%s,%d,%d\n' % (name, archive, codec, rawSize, size))
+            else:
+                del self.archives[name]
+        indexPath = os.path.join(self.directory, INDEX_NAME)
+        fObj = open(indexPath + '.tmp', 'w')
+        fObj.write(''.join(lines))
+        fObj.close()
+        os.rename(indexPath + '.tmp', indexPath)
 
     def listLogs(self):
         """
-        Return sorted list of integers - the old logs' identifiers.
+        Return the logs' names, oldest first, from the catalog.
         """
-        result = []
-        files = filter(os.path.isfile, glob.glob(self.directory + "*"))
-        files.sort(key=lambda x: os.path.getmtime(x))
-        for name in files:
-            try:
-                result.append(name.split('/')[-1])
-            except ValueError:
-                pass
-        return result
+        return self.catalog.names()
+
+    def pendingUploads(self):
+        """Return the catalog entries with rows that were not uploaded"""
+        return self.catalog.pending()
+
+    def markUploaded(self, name, offset):
+        self.catalog.markUploaded(name, offset)
 
 
     def __getstate__(self):
@@ -0,0 +1,150 @@
+"""
+Log Writer Thread
+-------------------------------------------
+
+Moves the blocking file I/O of the log sinks (CSV rows, rotation,
+retention, the binary log) off the reactor thread, so an SD card stall
+can no longer delay the serial ACK timing.  The reactor posts work to a
+bounded queue that a single writer thread runs in order.
+
+When the queue is full one of two policies applies:
+
+    block        the reactor waits for room (backpressure, nothing lost)
+    drop-oldest  the oldest queued row is discarded to make room
+
+Flushes and closes are never dropped.  ``sync`` returns a Deferred that
+fires on the reactor once everything queued before it has run, which is
+how the FTP upload waits for buffered rows to reach the file::
+
+    writer = LogWriterThread(1024, 'drop-oldest')
+    writer.post(logFile.write, row)
+    d = writer.sync()
+"""
+
+import collections
+import threading
+
+from twisted.internet import defer, reactor
+
+from serialexceptions import ParameterException
+
+#---------------------------------------------------------------------------#
+# Logging
+#---------------------------------------------------------------------------#
+import logging
+_logger = logging.getLogger(__name__)
+
+
+#---------------------------------------------------------------------------#
+# Constants
+#---------------------------------------------------------------------------#
+POLICY_BLOCK = 'block'
+POLICY_DROP_OLDEST = 'drop-oldest'
+POLICIES = (POLICY_BLOCK, POLICY_DROP_OLDEST)
+
+
+class LogWriterThread(object):
+    ''' Runs queued sink calls on a dedicated thread
+    '''
+
+    def __init__(self, maxsize=1024, policy=POLICY_BLOCK):
+        ''' Starts the writer thread
+
+        :param maxsize: The number of calls that may be queued
+        :param policy: 'block' or 'drop-oldest' when the queue is full
+        '''
+        if policy not in POLICIES:
+            raise ParameterException("Unknown queue policy %s" % policy)
+        self.maxsize = maxsize
+        self.policy = policy
+        self.queue = collections.deque()
+        self.condition = threading.Condition()
+        self.running = True
+        self.posted = 0
+        self.completed = 0
+        self.dropped = 0
+        self.blocked = 0
+        self.errors = 0
+        self.maxDepth = 0
+        self._thread = threading.Thread(target=self.run, name='log-writer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def post(self, function, *args, **kwargs):
+        ''' Queues a call of a row write, which may be dropped '''
+        self._put((function, args, kwargs, True))
+
+    def postControl(self, function, *args, **kwargs):
+        ''' Queues a call that must not be dropped (flush, close) '''
+        self._put((function, args, kwargs, False))
+
+    def _put(self, item):
+        ''' Adds an item, applying the full queue policy '''
+        with self.condition:
+            if not self.running:
+                raise ParameterException("The log writer has been stopped")
+            while len(self.queue) >= self.maxsize:
+                if self.policy == POLICY_DROP_OLDEST and self._dropOldest():
+                    continue
+                self.blocked += 1
+                self.condition.wait()
+            self.queue.append(item)
+            self.posted += 1
+            self.maxDepth = max(self.maxDepth, len(self.queue))
+            self.condition.notify_all()
+
+    def _dropOldest(self):
+        ''' Removes the oldest droppable item, the lock must be held '''
+        for item in self.queue:
+            if item[3]:
+                self.queue.remove(item)
+                self.dropped += 1
+                return True
+        return False
+
+    def sync(self):
+        ''' Returns a Deferred fired on the reactor thread once every call
+        queued before it has run
+        '''
+        d = defer.Deferred()
+        self.postControl(reactor.callFromThread, d.callback, None)
+        return d
+
+    def run(self):
+        ''' Runs queued calls until stopped and the queue is empty '''
+        while True:
+            with self.condition:
+                while not self.queue and self.running:
+                    self.condition.wait()
+                if not self.queue:
+                    return
+                function, args, kwargs, droppable = self.queue.popleft()
+                self.condition.notify_all()
+            try:
+                function(*args, **kwargs)
+            except Exception, ex:
+                self.errors += 1
+                _logger.error("Log writer call failed: %s" % ex)
+            self.completed += 1
+
+    def stop(self):
+        ''' Drains the queue and joins the thread '''
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        self._thread.join()
+
+    def getStats(self):
+        ''' Returns the queue metrics '''
+        return {'depth': len(self.queue), 'maxDepth': self.maxDepth,
+                'posted': self.posted, 'completed': self.completed,
+                'dropped': self.dropped, 'blocked': self.blocked,
+                'errors': self.errors}
+
+
+#---------------------------------------------------------------------------#
+# Exported symbols
+#---------------------------------------------------------------------------#
+__all__ = [
+    "LogWriterThread", "POLICY_BLOCK", "POLICY_DROP_OLDEST",
+]
@@ -16,6 +16,7 @@ from twisted.internet.task import LoopingCall
 from async import SerialClientProtocol
 from factory import ClientDecoder
 from MTrimCommands import *
+from mtrimcodec import encodeParameterSend, encodeDataInquiry
 from ConfigParser import SafeConfigParser
 from twisted.python import usage, logfile
 
@@ -90,7 +91,9 @@ class MTrimProtocol(SerialClientProtocol):
         :param parameter: The parameter number to write to
         :returns: A deferred response handle
         '''
+        kwargs['skip_encode'] = True
         request = DataInquiryRequest(address, parameter, **kwargs)
+        request.packet = encodeDataInquiry(address, parameter)
         return self.sendRequest(request)
 
     def writeParameter(self, address, parameter, value, **kwargs):
@@ -101,7 +104,9 @@ class MTrimProtocol(SerialClientProtocol):
         :param value: The value to write to the parameter
         :returns: A deferred response handle
         '''
+        kwargs['skip_encode'] = True
         request = ParameterSendRequest(address, parameter, value, **kwargs)
+        request.packet = encodeParameterSend(address, parameter, value)
         return self.sendRequest(request)
 
     def controlCommand(self, address, value, **kwargs):
@@ -0,0 +1,182 @@
+"""
+MTrim ASCII Codec
+-------------------------------------------
+
+Encodes and decodes the 12 byte MTrim frames without building them a
+character at a time::
+
+    [ STX ][ Address ][ Type ][ Parameter ][ Data ][ Format ][ ETX ]
+       1        2        1         2          4        1        1
+
+The STX, address, type and parameter prefix of each (address, type,
+parameter) is formatted once and kept, the data and format fields are
+produced with one string operation each and the frame is joined with a
+single format.  Responses are parsed with int() over whole fields and one
+division instead of per digit arithmetic.
+
+The frames are byte for byte those of MTrimCommands.ParameterSendRequest
+and DataInquiryRequest, which stay the reference implementation; running
+this module checks that over a range of values and times both.  The
+timings depend on the machine and the Python build, measure on the Pi
+before quoting a speedup::
+
+    python mtrimcodec.py
+"""
+
+from MTrimCommands import MTrimResponse
+
+#---------------------------------------------------------------------------#
+# Logging
+#---------------------------------------------------------------------------#
+import logging
+_logger = logging.getLogger(__name__)
+
+
+#---------------------------------------------------------------------------#
+# Constants
+#---------------------------------------------------------------------------#
+DATA_INQUIRY = '2'
+PARAMETER_SEND = '3'
+# Parameters that carry a decimal/sign format, everything else is sent as '0'
+FORMATTED_PARAMETERS = frozenset([20, 21, 22, 23])
+FORMATS = [str(i) for i in range(32)]
+SCALES = (1, 10.0, 100.0, 1000.0)
+
+_prefixes = {}
+
+
+def framePrefix(address, msgType, parameter):
+    ''' Returns the STX, address, type and parameter of a frame '''
+    key = (address, msgType, parameter)
+    prefix = _prefixes.get(key)
+    if prefix is None:
+        prefix = _prefixes[key] = '\x02%02d%s%02d' % key
+    return prefix
+
+
+#---------------------------------------------------------------------------#
+# Encoding
+#---------------------------------------------------------------------------#
+def encodeParameterSend(address, parameter, value):
+    ''' Returns the frame writing a value to a MTrim parameter
+
+    :param address: The device address
+    :param parameter: The parameter number
+    :param value: The value, its decimals are taken from str(value)
+    '''
+    text = str(value)
+    dot = text.find('.')
+    if dot < 0:
+        data = text.rjust(4, '0')
+        decimals = 0
+    else:
+        data = (text[:dot] + text[dot + 1:]).rjust(4, '0')
+        decimals = len(text) - 1 - dot
+    if parameter in FORMATTED_PARAMETERS:
+        dataFormat = FORMATS[decimals + 4 if value < 0 else decimals]
+    else:
+        dataFormat = '0'
+    return '%s%s%s\x03' % (framePrefix(address, PARAMETER_SEND, parameter), data, dataFormat)
+
+
+def encodeDataInquiry(address, parameter):
+    ''' Returns the frame reading a MTrim parameter '''
+    return framePrefix(address, DATA_INQUIRY, parameter) + '00000\x03'
+
+
+#---------------------------------------------------------------------------#
+# Decoding
+#---------------------------------------------------------------------------#
+def decodeResponse(data, response=None):
+    ''' Parses a response frame
+
+    :param data: The 12 byte frame
+    :param response: The MTrimResponse to fill, a new one if None
+    :returns: The response, or None for a frame of the wrong size
+    '''
+    if len(data) != 12:
+        return None
+    if response is None:
+        response = MTrimResponse()
+    response.address = int(data[1:3])
+    response.errorCode = data[3]
+    response.parameter = int(data[4:6])
+    dataFormat = response.dataFormat = int(data[10])
+    digits = int(data[6:10])
+    if dataFormat == 0:
+        response.Data = digits
+    elif dataFormat <= 3:
+        response.Data = digits / SCALES[dataFormat]
+    elif dataFormat == 4:
+        response.Data = -digits
+    elif dataFormat <= 7:
+        response.Data = -digits / SCALES[dataFormat - 4]
+    return response
+
+
+#---------------------------------------------------------------------------#
+# Exported symbols
+#---------------------------------------------------------------------------#
+__all__ = [
+    "encodeParameterSend", "encodeDataInquiry", "decodeResponse",
+]
+
+
+if __name__ == "__main__":
+    import sys
+    import timeit
+    from MTrimCommands import ParameterSendRequest, DataInquiryRequest
+
+    values = range(0, 10000, 7) + [-v for v in range(1, 1000, 3)]
+    values += [v / 10.0 for v in range(0, 10000, 13)] + [v / 100.0 for v in range(0, 10000, 11)]
+    values += [v / 1000.0 for v in range(0, 10000, 17)] + [-v / 10.0 for v in range(1, 1000, 7)]
+    values += [-v / 100.0 for v in range(1, 1000, 9)] + [-v / 1000.0 for v in range(1, 1000, 9)]
+    cases = [(address, parameter, value) for address in (1, 12)
+             for parameter in (1, 5, 20, 21, 22, 23, 40) for value in values]
+
+    mismatches = 0
+    for address, parameter, value in cases:
+        if encodeParameterSend(address, parameter, value) != \
+                ParameterSendRequest(address, parameter, value).encode():
+            mismatches += 1
+    for address in range(0, 100, 3):
+        for parameter in range(0, 100, 7):
+            if encodeDataInquiry(address, parameter) != \
+                    DataInquiryRequest(address, parameter).encode():
+                mismatches += 1
+    print "encode: %d cases, %d frames differ" % (len(cases), mismatches)
+
+    frames = ['\x02%02d@%02d%04d%d\x03' % (1, 20, digits, fmt)
+              for fmt in range(8) for digits in range(0, 10000, 3)]
+    exact, worst = 0, 0.0
+    for frame in frames:
+        reference = MTrimResponse()
+        reference.decode(frame)
+        fast = decodeResponse(frame)
+        if (fast.address, fast.errorCode, fast.parameter, fast.dataFormat) != \
+                (reference.address, reference.errorCode, reference.parameter,
+                 reference.dataFormat):
+            mismatches += 1
+        if fast.Data == reference.Data:
+            exact += 1
+        worst = max(worst, abs(fast.Data - reference.Data))
+    print "decode: %d frames, %d bit identical, largest difference %g" % (
+        len(frames), exact, worst)
+
+    def timed(function, items):
+        best = min(timeit.repeat(lambda: [function(*item) for item in items],
+                                 number=3, repeat=5))
+        return best / (3 * len(items)) * 1e6
+
+    print "timings are machine dependent:"
+    sample = cases[::10]
+    old = timed(lambda a, p, v: ParameterSendRequest(a, p, v).encode(), sample)
+    new = timed(encodeParameterSend, sample)
+    print "encode: %.2f us -> %.2f us per frame (%.1fx)" % (old, new, old / new)
+    # Both fill one response, the PDU construction would dominate otherwise
+    sample = [(frame,) for frame in frames[::5]]
+    reference = MTrimResponse()
+    old = timed(reference.decode, sample)
+    new = timed(lambda f: decodeResponse(f, reference), sample)
+    print "decode: %.2f us -> %.2f us per frame (%.1fx)" % (old, new, old / new)
+    sys.exit(1 if mismatches else 0)
@@ -13,6 +13,7 @@ kept as a result of a pre-computed lookup dictionary.
 
 from serialexceptions import SerialException
 from MTrimCommands import MTrimResponse
+from mtrimcodec import decodeResponse
 
 #---------------------------------------------------------------------------#
 # Logging
@@ -63,7 +64,7 @@ class MTrimClientDecoder(object):
             return None
         else:
             response = MTrimResponse()
-            response.decode(data)
+            decodeResponse(data, response)
             
         return response
 
@@ -0,0 +1,354 @@
+"""
+Streaming OEE Aggregation
+-------------------------------------------
+
+Computes OEE aggregates from the daily logs in a single streaming pass,
+so shift and recipe reports no longer need the raw files off-box.  Rows
+are read lazily from the CSV logs (plain or compressed) or the binary
+logs and fed through one aggregator that keeps three sets of buckets:
+
+    shift   the configured shifts, keyed by the date the shift started
+    recipe  the recipe name logged with each row
+    hour    the local clock hour
+
+Every bucket tracks the logged time, the running time (from the PLC's
+``Up Minutes`` counter), the footage produced (from the ``Footage``
+counter) and derives availability and throughput from them.  Counter
+resets are treated as a restart from zero, and gaps longer than
+``maxGap`` (the logger was not running) are left out.
+
+Each day is written to a compact ``YYMMDD00.oee.csv`` summary next to the
+log, which retention removes together with the day.  A shift is reported
+with the day it started: the rows of a night shift logged after midnight
+are moved back into the previous day's summary, so that summary is only
+complete once the next day has been summarized as well::
+
+    python oeesummary.py ./logs/
+    python oeesummary.py --binary --shifts 06:00,14:00,22:00 ./logs/
+
+or from code::
+
+    aggregator = OEEAggregator()
+    aggregator.consume(csvRows('./logs/16010100.csv', aggregator.columns))
+    writeSummary(aggregator, './logs/16010100.oee.csv')
+"""
+
+import os
+import re
+import sys
+import time
+
+from loggerfile import openLog, LOG_NAME
+from binlog import BinaryLogReader
+
+#---------------------------------------------------------------------------#
+# Logging
+#---------------------------------------------------------------------------#
+import logging
+_logger = logging.getLogger(__name__)
+
+
+#---------------------------------------------------------------------------#
+# Constants
+#---------------------------------------------------------------------------#
+DEFAULT_SHIFTS = ('06:00', '14:00', '22:00')
+SUMMARY_SUFFIX = '.oee.csv'
+SUMMARY_HEADER = ('Kind', 'Key', 'Start', 'End', 'Samples', 'Logged Minutes',
+                  'Up Minutes', 'Availability', 'Footage', 'Footage/Hour')
+BINARY_NAME = re.compile(r'^(\d{8})\.bin$')
+NUMBERS = (int, long, float)
+
+
+#---------------------------------------------------------------------------#
+# Row Sources
+#---------------------------------------------------------------------------#
+def csvRows(path, columns):
+    ''' Yields (timestamp, values) for selected columns of a CSV log
+
+    :param path: The plain or compressed daily log
+    :param columns: The column names wanted, missing columns yield None
+    '''
+    fObj = openLog(path)
+    try:
+        header = [c.strip() for c in fObj.readline().rstrip('\r\n').split(',')]
+        indexes = [header.index(c) if c in header else None for c in columns]
+        midnight = {}
+        for line in fObj:
+            fields = line.rstrip('\r\n').split(',')
+            if len(fields) < len(header) or not fields[0][:1].isdigit():
+                continue
+            # One mktime per date, the clock is added as seconds
+            day = midnight.get(fields[0])
+            if day is None:
+                month, mday, year = map(int, fields[0].split('/'))
+                day = midnight[fields[0]] = time.mktime((year, month, mday, 0, 0, 0, 0, 0, -1))
+            hour, minute, second = fields[1].split(':')
+            stamp = day + int(hour)*3600 + int(minute)*60 + int(second)
+            values = []
+            for index in indexes:
+                value = fields[index] if index is not None else None
+                try:
+                    value = float(value)
+                except (TypeError, ValueError):
+                    pass
+                values.append(value)
+            yield (stamp, values)
+    finally:
+        fObj.close()
+
+
+def binaryRows(path, columns):
+    ''' Yields (timestamp, values) for selected columns of a binary log
+
+    :param path: The binary daily log
+    :param columns: The column names wanted, missing columns yield None
+    '''
+    reader = BinaryLogReader(path)
+    try:
+        indexes = [reader.names.index(c) if c in reader.names else None for c in columns]
+        for stamp, row in reader.rows():
+            yield (stamp, [row[i] if i is not None else None for i in indexes])
+    finally:
+        reader.close()
+
+
+def dayLogs(directory, binary=False):
+    ''' Yields (stem, path) of every daily log in a directory, oldest first
+
+    :param directory: The log directory
+    :param binary: Read the binary logs instead of the CSV logs
+    '''
+    pattern = BINARY_NAME if binary else LOG_NAME
+    days = {}
+    for name in os.listdir(directory):
+        match = pattern.match(name)
+        if match:
+            days[match.group(1)] = os.path.join(directory, name)
+    for stem in sorted(days):
+        yield (stem, days[stem])
+
+
+#---------------------------------------------------------------------------#
+# Aggregation
+#---------------------------------------------------------------------------#
+class Bucket(object):
+    ''' The running totals of one aggregate '''
+    __slots__ = ('start', 'end', 'samples', 'logged', 'up', 'footage')
+
+    def __init__(self, start):
+        self.start = self.end = start
+        self.samples = 0
+        self.logged = self.up = self.footage = 0.0
+
+    def availability(self):
+        ''' Returns the running share of the logged time in percent '''
+        return 100.0 * min(self.up, self.logged) / self.logged if self.logged else 0.0
+
+    def throughput(self):
+        ''' Returns the footage per logged hour '''
+        return self.footage * 3600.0 / self.logged if self.logged else 0.0
+
+    def merge(self, other):
+        ''' Adds the totals of another bucket of the same aggregate '''
+        self.start = min(self.start, other.start)
+        self.end = max(self.end, other.end)
+        self.samples += other.samples
+        self.logged += other.logged
+        self.up += other.up
+        self.footage += other.footage
+
+
+class OEEAggregator(object):
+    ''' Accumulates per shift, per recipe and per hour aggregates
+    '''
+
+    def __init__(self, shifts=DEFAULT_SHIFTS, recipe='RecipeName', footage='Footage',
+                 upMinutes='Up Minutes', maxGap=300):
+        ''' Initializes the aggregator
+
+        :param shifts: The shift start times as 'HH:MM' strings
+        :param recipe: The recipe name column
+        :param footage: The footage counter column
+        :param upMinutes: The running minutes counter column
+        :param maxGap: Longer intervals between rows are not counted
+        '''
+        self.shifts = sorted(self.toMinutes(s) for s in shifts)
+        self.columns = (recipe, footage, upMinutes)
+        self.maxGap = maxGap
+        self.kinds = {'shift': {}, 'recipe': {}, 'hour': {}}
+        self.last = None
+
+    @staticmethod
+    def toMinutes(clock):
+        hour, minute = clock.strip().split(':')
+        return int(hour)*60 + int(minute)
+
+    def shiftKey(self, stamp, current=None):
+        ''' Returns 'YYYY-MM-DD Sn' of the shift a time falls in '''
+        if current is None:
+            current = time.localtime(stamp)
+        minutes = current[3]*60 + current[4]
+        index = len(self.shifts) - 1
+        for i in range(len(self.shifts)):
+            if minutes >= self.shifts[i]:
+                index = i
+        if minutes < self.shifts[0]:
+            # The last shift of the previous day
+            current = time.localtime(stamp - 86400)
+        return '%04d-%02d-%02d S%d' % (current[0], current[1], current[2], index + 1)
+
+    @staticmethod
+    def delta(previous, current):
+        ''' Returns the increase of a counter, a drop is a reset to 0 '''
+        if not isinstance(current, NUMBERS) or not isinstance(previous, NUMBERS):
+            return 0.0
+        if current != current or previous != previous:
+            return 0.0
+        return float(current - previous if current >= previous else current)
+
+    def add(self, stamp, values):
+        ''' Adds one row, attributing the interval since the previous row
+        to the buckets of this row
+
+        :param stamp: The unix time of the row
+        :param values: The recipe, footage and up minutes of the row
+        '''
+        recipe, footage, upMinutes = values
+        last, self.last = self.last, (stamp, footage, upMinutes)
+        current = time.localtime(stamp)
+        keys = (('shift', self.shiftKey(stamp, current)),
+                ('recipe', str(recipe).strip() if recipe is not None else ''),
+                ('hour', '%04d-%02d-%02d %02d:00' % current[:4]))
+        interval = stamp - last[0] if last is not None else 0
+        counted = last is not None and 0 < interval <= self.maxGap
+        for kind, key in keys:
+            bucket = self.kinds[kind].get(key)
+            if bucket is None:
+                bucket = self.kinds[kind][key] = Bucket(stamp)
+            bucket.end = stamp
+            bucket.samples += 1
+            if counted:
+                bucket.logged += interval
+                bucket.up += 60.0 * self.delta(last[2], upMinutes)
+                bucket.footage += self.delta(last[1], footage)
+
+    def merge(self, kind, key, bucket):
+        ''' Adds a bucket accumulated by another aggregator '''
+        current = self.kinds[kind].get(key)
+        if current is None:
+            self.kinds[kind][key] = bucket
+        else:
+            current.merge(bucket)
+
+    def consume(self, rows):
+        ''' Adds every row of a (timestamp, values) iterable '''
+        add = self.add
+        for stamp, values in rows:
+            add(stamp, values)
+        return self
+
+    def summary(self):
+        ''' Yields one summary record per bucket, kinds in a fixed order '''
+        for kind in ('shift', 'recipe', 'hour'):
+            buckets = self.kinds[kind]
+            for key in sorted(buckets):
+                bucket = buckets[key]
+                yield (kind, key,
+                       time.strftime('%m/%d/%Y %H:%M:%S', time.localtime(bucket.start)),
+                       time.strftime('%m/%d/%Y %H:%M:%S', time.localtime(bucket.end)),
+                       bucket.samples, '%.1f' % (bucket.logged / 60.0),
+                       '%.1f' % (bucket.up / 60.0), '%.1f' % bucket.availability(),
+                       '%.1f' % bucket.footage, '%.1f' % bucket.throughput())
+
+
+def writeSummary(aggregator, path):
+    ''' Writes the aggregates as a small CSV file
+
+    :param aggregator: The OEEAggregator to write
+    :param path: The summary file
+    :returns: The number of records written
+    '''
+    temp = path + '.tmp'
+    fObj = open(temp, 'w')
+    count = 0
+    try:
+        fObj.write(','.join(SUMMARY_HEADER) + '\n')
+        for record in aggregator.summary():
+            fObj.write(','.join(map(str, record)) + '\n')
+            count += 1
+    finally:
+        fObj.close()
+    os.rename(temp, path)
+    return count
+
+
+def stemDate(stem):
+    ''' Returns the 'YYYY-MM-DD' of a YYMMDD00 log stem '''
+    return '20%s-%s-%s' % (stem[0:2], stem[2:4], stem[4:6])
+
+
+def summarizeDirectory(directory, binary=False, days=None, **kwargs):
+    ''' Writes a summary for every day of a log directory
+
+    :param directory: The log directory
+    :param binary: Read the binary logs instead of the CSV logs
+    :param days: Only write the most recent days, the day before them is
+                 read as well so their first shift is complete; None
+                 writes every day
+    :param kwargs: Options passed to OEEAggregator
+    :returns: The list of summary files written
+    '''
+    source = binaryRows if binary else csvRows
+    logs = list(dayLogs(directory, binary))
+    skip = max(len(logs) - days - 1, 0) if days is not None else 0
+    aggregators = []
+    last = None
+    for stem, path in logs[skip:]:
+        aggregator = OEEAggregator(**kwargs)
+        # The interval across midnight is counted
+        aggregator.last = last
+        aggregator.consume(source(path, aggregator.columns))
+        last = aggregator.last
+        aggregators.append((stem, aggregator))
+
+    # A shift belongs to the day it started
+    starts = dict((stemDate(stem), aggregator) for stem, aggregator in aggregators)
+    for stem, aggregator in aggregators:
+        shifts = aggregator.kinds['shift']
+        for key in list(shifts):
+            start = starts.get(key[:10])
+            if start is not None and start is not aggregator:
+                start.merge('shift', key, shifts.pop(key))
+
+    written = []
+    if days is not None:
+        aggregators = aggregators[-days:] if days else []
+    for stem, aggregator in aggregators:
+        summary = os.path.join(directory, stem + SUMMARY_SUFFIX)
+        writeSummary(aggregator, summary)
+        written.append(summary)
+    return written
+
+
+#---------------------------------------------------------------------------#
+# Exported symbols
+#---------------------------------------------------------------------------#
+__all__ = [
+    "OEEAggregator", "csvRows", "binaryRows", "dayLogs", "writeSummary",
+    "summarizeDirectory",
+]
+
+
+if __name__ == "__main__":
+    from optparse import OptionParser
+    parser = OptionParser(usage="oeesummary.py [options] <log directory>")
+    parser.add_option("--binary", action="store_true", default=False,
+                      help="read the binary logs instead of the CSV logs")
+    parser.add_option("--shifts", default=','.join(DEFAULT_SHIFTS),
+                      help="comma separated shift start times")
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error("a log directory is required")
+    for summary in summarizeDirectory(args[0], options.binary,
+                                      shifts=options.shifts.split(',')):
+        print summary
@@ -0,0 +1,298 @@
+"""
+Upload Outbox
+-------------------------------------------
+
+A persistent store-and-forward queue of log uploads.  Each job is a file
+and the byte range the server still needs; jobs are written to disk as
+they are queued so nothing is forgotten across a network outage or a
+restart, and they are drained strictly in order (oldest day first).
+
+A job names a day, the file it is read from is looked up in the log
+catalog when each chunk is sent, so a day compressed while it waits
+(YYMMDD00.csv becoming YYMMDD00.csv.gz) is still sent; only a day the
+catalog no longer holds (removed by retention) is dropped.
+
+A compressed day is uploaded as stored, under its compressed name, when
+the archive is smaller than the plain bytes the server still needs (a
+day caught up after an outage); the archive holds the whole day and
+completes it.  A day the server already has most of keeps getting its
+plain tail appended to YYMMDD00.csv.
+
+Any other file, such as a day's YYMMDD00.oee.csv summary, is queued whole
+with addFile() and stored under its own name; queueing it again after it
+was rewritten sends the new copy.
+
+Draining is paced so a catch-up of many days neither saturates the
+uplink nor keeps the reactor busy:
+
+    * a job is sent in chunks of at most ``maxChunk`` bytes
+    * every chunk is shaped by the shared TokenBucket (see throttle)
+    * a failed chunk is retried after an exponential backoff starting at
+      ``backoff`` seconds and capped at ``maxBackoff``
+
+Example::
+
+    outbox = UploadOutbox(pool, './logs/', './logs/', './logs/outbox.idx',
+                          logger.markUploaded, catalog=logger.getCatalog(),
+                          bucket=TokenBucket(rate=32768))
+    outbox.add('16010100.csv', 0, 81234)
+    outbox.addFile('16010100.oee.csv')
+    outbox.kick()
+    outbox.getStats()['backlogBytes']
+"""
+
+import os
+import time
+
+from twisted.internet import reactor
+
+from ftpclient import sendLogData, sendArchive
+from loggerfile import LOG_NAME
+
+#---------------------------------------------------------------------------#
+# Logging
+#---------------------------------------------------------------------------#
+import logging
+_logger = logging.getLogger(__name__)
+
+
+def jobKey(name):
+    ''' Returns what a queued file is known by, the day of a daily log
+    whatever it is compressed to, the name of any other file
+    '''
+    return name[:8] if LOG_NAME.match(name) else name
+
+
+class UploadJob(object):
+    ''' A file and the byte range still to upload '''
+    __slots__ = ('name', 'start', 'end', 'attempts')
+
+    def __init__(self, name, start, end, attempts=0):
+        self.name = name
+        self.start = start
+        self.end = end
+        self.attempts = attempts
+
+
+class UploadOutbox(object):
+    ''' An ordered, persistent, rate limited upload queue
+    '''
+
+    def __init__(self, pool, localDir, remoteDir, path, markUploaded=None,
+                 maxChunk=1024*1024, backoff=5, maxBackoff=900, bucket=None,
+                 catalog=None):
+        ''' Loads the queued jobs
+
+        :param pool: The FTPSessionPool to upload on
+        :param localDir: The local log directory
+        :param remoteDir: The remote log directory
+        :param path: The file the queue is persisted to
+        :param markUploaded: Called as markUploaded(name, offset) after
+                             every successful chunk
+        :param maxChunk: The most bytes sent by one transfer
+        :param backoff: The first retry delay in seconds
+        :param maxBackoff: The longest retry delay in seconds
+        :param bucket: The TokenBucket shaping each transfer, None is
+                       unlimited
+        :param catalog: The LogCatalog holding each day's current file,
+                        None uploads the queued names as they are
+        '''
+        self.pool = pool
+        self.localDir = localDir
+        self.remoteDir = remoteDir
+        self.path = path
+        self.markUploaded = markUploaded
+        self.maxChunk = maxChunk
+        self.backoff = backoff
+        self.maxBackoff = maxBackoff
+        self.bucket = bucket
+        self.catalog = catalog
+        self.jobs = self.load()
+        self.busy = False
+        self.timer = None
+        self.retries = 0
+        self.stats = {'sent': 0, 'chunks': 0, 'failures': 0, 'completed': 0,
+                      'archives': 0, 'restarts': 0}
+
+    #-----------------------------------------------------------------------#
+    # Persistence
+    #-----------------------------------------------------------------------#
+    def load(self):
+        ''' Reads the persisted jobs '''
+        jobs = []
+        if os.path.exists(self.path):
+            for line in open(self.path, 'r'):
+                fields = line.strip().split(',')
+                if len(fields) == 4:
+                    jobs.append(UploadJob(fields[0], *map(int, fields[1:])))
+        return jobs
+
+    def save(self):
+        ''' Rewrites the persisted jobs '''
+        fObj = open(self.path + '.tmp', 'w')
+        for job in self.jobs:
+            fObj.write('%s,%d,%d,%d\n' % (job.name, job.start, job.end, job.attempts))
+        fObj.close()
+        os.rename(self.path + '.tmp', self.path)
+
+    #-----------------------------------------------------------------------#
+    # Queue
+    #-----------------------------------------------------------------------#
+    def add(self, name, start, end):
+        ''' Queues a byte range of a file, merging with a queued job for
+        the same day
+
+        :param name: The local log name
+        :param start: The first byte the server doesn't have
+        :param end: The local size to upload up to
+        '''
+        for job in self.jobs:
+            if jobKey(job.name) == jobKey(name):
+                job.name = name
+                job.end = max(job.end, end)
+                break
+        else:
+            if end <= start:
+                return
+            self.jobs.append(UploadJob(name, start, end))
+            self.jobs.sort(key=lambda j: j.name[:8])
+        self.save()
+
+    def addFile(self, name):
+        ''' Queues the whole of a file that is not a daily log
+
+        :param name: The local file name, also used on the server
+        '''
+        self.add(name, 0, os.path.getsize(os.path.join(self.localDir, name)))
+
+    def kick(self):
+        ''' Starts draining unless a chunk or a retry is already pending '''
+        if not self.busy and self.timer is None and self.jobs:
+            self.sendNext()
+
+    def schedule(self, delay):
+        ''' Sends the next chunk after a delay '''
+        def fire():
+            self.timer = None
+            self.kick()
+        self.timer = reactor.callLater(delay, fire)
+
+    def locate(self, job):
+        ''' Returns the file a job's day is currently stored in, or None '''
+        if self.catalog is None or not LOG_NAME.match(job.name):
+            name = job.name
+        else:
+            entry = self.catalog.get(job.name)
+            if entry is None:
+                return None
+            name = job.name = entry.name
+        path = os.path.join(self.localDir, name)
+        return path if os.path.exists(path) else None
+
+    def sendNext(self):
+        ''' Uploads the next chunk of the oldest job '''
+        job = self.jobs[0]
+        path = self.locate(job)
+        if path is None:
+            # Removed by retention before it could be sent
+            _logger.warning("Dropping upload of missing log %s" % job.name)
+            self.jobs.remove(job)
+            self.save()
+            return self.kick()
+        self.busy = True
+        if self.sendWhole(job, path):
+            d = self.pool.run(sendArchive, path, os.path.join(self.remoteDir, job.name),
+                              self.bucket)
+            d.addCallbacks(self.cbArchiveSent, self.ebSent,
+                           callbackArgs=(job,), errbackArgs=(job,))
+            return
+        end = min(job.end, job.start + self.maxChunk) if self.maxChunk else job.end
+        d = self.pool.run(sendLogData, path,
+                          os.path.join(self.remoteDir, job.name[:12]), job.start, end,
+                          self.bucket)
+        d.addCallbacks(self.cbSent, self.ebSent, callbackArgs=(job,), errbackArgs=(job,))
+
+    def sendWhole(self, job, path):
+        ''' Returns True for a file that isn't a daily log, or a compressed
+        day that is cheaper to send whole
+        '''
+        if not LOG_NAME.match(job.name):
+            return True
+        return (job.name != job.name[:12] and
+                os.path.getsize(path) < job.end - job.start)
+
+    def cbSent(self, (start, sent), job):
+        if start < job.start:
+            # The server's copy didn't match, the day was sent from the start
+            self.stats['restarts'] += 1
+        self.advance(job, start + sent, sent)
+
+    def cbArchiveSent(self, sent, job):
+        if LOG_NAME.match(job.name):
+            # The archive holds the whole day, rows logged after the job
+            # was queued included
+            self.stats['archives'] += 1
+            entry = self.catalog.get(job.name) if self.catalog is not None else None
+            if entry is not None:
+                job.end = max(job.end, entry.size)
+        self.advance(job, job.end, sent)
+
+    def advance(self, job, offset, sent):
+        ''' Records a successful transfer up to a plain log offset '''
+        self.busy = False
+        self.retries = 0
+        self.stats['sent'] += sent
+        self.stats['chunks'] += 1
+        job.start = offset
+        if self.markUploaded is not None and LOG_NAME.match(job.name):
+            self.markUploaded(job.name, job.start)
+        if job.start >= job.end or sent == 0:
+            self.jobs.remove(job)
+            self.stats['completed'] += 1
+        self.save()
+        if self.jobs:
+            self.schedule(0)
+
+    def ebSent(self, failure, job):
+        self.busy = False
+        self.retries += 1
+        job.attempts += 1
+        self.stats['failures'] += 1
+        self.save()
+        delay = min(self.backoff * 2 ** (self.retries - 1), self.maxBackoff)
+        _logger.warning("Upload of %s failed (%s), retrying in %ds with %d bytes queued"
+                        % (job.name, failure.value, delay, self.backlogBytes()))
+        self.schedule(delay)
+
+    #-----------------------------------------------------------------------#
+    # Metrics
+    #-----------------------------------------------------------------------#
+    def backlogBytes(self):
+        return sum(job.end - job.start for job in self.jobs)
+
+    def getStats(self):
+        ''' Returns the backlog and transfer counters '''
+        stats = dict(self.stats)
+        stats.update({'jobs': len(self.jobs), 'backlogBytes': self.backlogBytes(),
+                      'oldest': self.jobs[0].name if self.jobs else None,
+                      'retries': self.retries,
+                      'retryIn': max(self.timer.getTime() - time.time(), 0)
+                                 if self.timer is not None and self.retries else 0})
+        return stats
+
+    def close(self):
+        ''' Cancels a pending retry and writes the queue to disk, called on
+        shutdown
+        '''
+        if self.timer is not None and self.timer.active():
+            self.timer.cancel()
+        self.timer = None
+        self.save()
+
+
+#---------------------------------------------------------------------------#
+# Exported symbols
+#---------------------------------------------------------------------------#
+__all__ = [
+    "UploadOutbox",
+]
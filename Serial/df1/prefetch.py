@@ -0,0 +1,112 @@
+"""
+Recipe Prefetch
+-------------------------------------------
+
+Watches the PLC's recipe name register and resolves the recipe as soon
+as the name changes, long before the operator sets the load bit.  The
+name tag is read in the same poll cycle as the alarm bits (its own
+``prefetch`` poll class) and reaches the prefetcher as a TagCache
+subscriber, so when the load bit is seen the recipe and its compiled
+write plan (see recipeplan) are already at hand: the load goes out
+without the extra ST read and without a store lookup::
+
+    prefetch = RecipePrefetcher(store, tags.pollClass(PREFETCH_POLL_CLASS))
+    cache.subscribe(prefetch.update)
+    ...
+    recipe = prefetch.current()
+
+A name the store doesn't know is remembered as a miss and resolved again
+whenever the store is reloaded after a recipe download.
+"""
+
+import time
+
+from recipestore import recipeKey
+
+#---------------------------------------------------------------------------#
+# Logging
+#---------------------------------------------------------------------------#
+import logging
+_logger = logging.getLogger(__name__)
+
+
+class RecipePrefetcher(object):
+    ''' Keeps the recipe named by the PLC resolved
+    '''
+
+    def __init__(self, store, handles):
+        ''' Initializes the prefetcher
+
+        :param store: The RecipeStore to resolve names in
+        :param handles: The tag handles holding the recipe name
+        '''
+        self.store = store
+        self.handles = frozenset(handles)
+        self.name = None
+        self.recipe = None
+        self.stamp = 0.0
+        self.stats = {'changes': 0, 'resolved': 0, 'misses': 0, 'used': 0}
+
+    def update(self, results, handles, timestamp):
+        ''' TagCache subscriber, watches the recipe name tags '''
+        for i in range(len(handles)):
+            if handles[i] in self.handles:
+                value = results[i]
+                if hasattr(value, '__iter__'):
+                    value = value[0] if len(value) == 1 else None
+                if isinstance(value, str):
+                    self.watch(value, timestamp)
+
+    def watch(self, name, timestamp=None):
+        ''' Resolves a newly read recipe name
+
+        :param name: The name as read from the PLC
+        :param timestamp: The time it was read
+        '''
+        self.stamp = timestamp or time.time()
+        name = recipeKey(name)
+        if name == self.name:
+            return
+        self.name = name
+        self.stats['changes'] += 1
+        self.resolve()
+
+    def resolve(self):
+        ''' Looks the current name up in the store '''
+        self.recipe = self.store.get(self.name) if self.name else None
+        if self.recipe is not None and self.recipe.plan is not None:
+            self.stats['resolved'] += 1
+            _logger.debug("Prefetched recipe %s" % self.name)
+        elif self.name:
+            self.stats['misses'] += 1
+            _logger.debug("Recipe %s is not in the recipe store" % self.name)
+
+    def refresh(self):
+        ''' Resolves the current name again after the store was reloaded '''
+        if self.name:
+            self.resolve()
+
+    def current(self, maxAge=None):
+        ''' Returns the prefetched Recipe with a compiled plan, or None
+
+        :param maxAge: The oldest name read accepted, in seconds
+        '''
+        if self.recipe is None or self.recipe.plan is None:
+            return None
+        if maxAge is not None and time.time() - self.stamp > maxAge:
+            return None
+        self.stats['used'] += 1
+        return self.recipe
+
+    def getStats(self):
+        stats = dict(self.stats)
+        stats['name'] = self.name
+        return stats
+
+
+#---------------------------------------------------------------------------#
+# Exported symbols
+#---------------------------------------------------------------------------#
+__all__ = [
+    "RecipePrefetcher",
+]
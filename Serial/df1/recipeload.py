@@ -0,0 +1,219 @@
+"""
+Recipe Load Transaction
+-------------------------------------------
+
+Loads a compiled recipe (see recipeplan) into the SLC over DF1 and into
+the MTrim over its ASCII link as one transaction.  Both links are driven
+in parallel, each sending its writes one after the other so every write
+is timed on its own, and the transaction has a single outcome: it
+succeeds once every write of both links was acknowledged and fails with
+a RecipeLoadError naming the writes that were not.
+
+A write that fails or isn't answered within ``timeout`` seconds is sent
+again (a new transaction id, the same frame) after the link's other
+writes, up to ``retries`` times.  Nothing is rolled back, a retry simply
+writes the value again.
+
+The timings show which device limits a changeover::
+
+    load = RecipeLoad(plan, df1.sendCommand, mtrim.sendCommand)
+    d = load.start()
+    d.addCallback(lambda load: log.info(load.summary()))
+"""
+
+from twisted.internet import defer, reactor
+from twisted.python.failure import Failure
+
+#---------------------------------------------------------------------------#
+# Logging
+#---------------------------------------------------------------------------#
+import logging
+_logger = logging.getLogger(__name__)
+
+
+#---------------------------------------------------------------------------#
+# Constants
+#---------------------------------------------------------------------------#
+DF1_LINK = 'DF1'
+MTRIM_LINK = 'MTrim'
+MTRIM_OK = '@'
+
+
+class RecipeLoadError(Exception):
+    ''' Some writes of a recipe load were not acknowledged '''
+
+    def __init__(self, load):
+        self.load = load
+        Exception.__init__(self, "Recipe %s: %s not written" % (load.name,
+                           ', '.join(item.name for item in load.failed())))
+
+
+def acknowledged(result):
+    ''' Checks whether a reply acknowledges its write
+
+    The reply itself is the acknowledgement, a DF1 write's has no records.
+    A DF1 reply with an error status or an MTrim reply with an error code
+    doesn't count.
+
+    :param result: The reply or a Failure
+    :returns: True if the write was acknowledged
+    '''
+    if isinstance(result, Failure):
+        return False
+    return not getattr(result, 'sts', 0) and \
+        getattr(result, 'errorCode', MTRIM_OK) == MTRIM_OK
+
+
+class LoadItem(object):
+    ''' One write of a load and its timing '''
+    __slots__ = ('link', 'name', 'frame', 'attempts', 'elapsed', 'ok')
+
+    def __init__(self, link, name, frame):
+        self.link = link
+        self.name = name
+        self.frame = frame
+        self.attempts = 0
+        self.elapsed = 0.0
+        self.ok = False
+
+
+class RecipeLoad(object):
+    ''' Writes one RecipePlan to both devices
+    '''
+
+    def __init__(self, plan, plcSend, mtrimSend, retries=1, timeout=10,
+                 clock=reactor):
+        ''' Initializes the transaction
+
+        :param plan: The RecipePlan to load
+        :param plcSend: Sends a request to the SLC, returns a Deferred fired
+                        with the reply or failed (a protocol's sendCommand)
+        :param mtrimSend: Sends a request to the MTrim, the same way
+        :param retries: The extra attempts of a failed write
+        :param timeout: The seconds a write may go unanswered
+        :param clock: The clock timing the writes (the reactor)
+        '''
+        self.name = plan.name
+        self.clock = clock
+        self.retries = retries
+        self.timeout = timeout
+        self.links = {
+            DF1_LINK: (plcSend, [LoadItem(DF1_LINK, frame.parameter, frame)
+                                 for frame in plan.plcWrites]),
+            MTRIM_LINK: (mtrimSend, [LoadItem(MTRIM_LINK, 'P%d' % frame.parameter, frame)
+                                     for frame in plan.mtrimWrites]),
+        }
+        self.linkTimes = {}
+        self.started = None
+        self.elapsed = None
+
+    def items(self):
+        return self.links[DF1_LINK][1] + self.links[MTRIM_LINK][1]
+
+    def failed(self):
+        return [item for item in self.items() if not item.ok]
+
+    #-----------------------------------------------------------------------#
+    # Transaction
+    #-----------------------------------------------------------------------#
+    def start(self):
+        ''' Starts both links
+
+        :returns: A Deferred fired with this load, or failed with a
+                  RecipeLoadError once both links are done
+        '''
+        self.started = self.clock.seconds()
+        links = [self.runLink(link, send, items)
+                 for link, (send, items) in self.links.items()]
+        d = defer.DeferredList(links)
+        d.addCallback(self.finish)
+        return d
+
+    def finish(self, _):
+        self.elapsed = self.clock.seconds() - self.started
+        if self.failed():
+            raise RecipeLoadError(self)
+        return self
+
+    def runLink(self, link, send, items):
+        ''' Sends a link's writes one at a time, failed ones again at the end '''
+        done = defer.Deferred()
+        queue = list(items)
+        started = self.clock.seconds()
+
+        def sendNext(_=None):
+            if not queue:
+                self.linkTimes[link] = self.clock.seconds() - started
+                done.callback(link)
+                return
+            item = queue.pop(0)
+            d = self.sendItem(send, item)
+            d.addCallback(cbItem, item)
+
+        def cbItem(ok, item):
+            if not ok and item.attempts <= self.retries:
+                queue.append(item)
+            sendNext()
+
+        sendNext()
+        return done
+
+    def sendItem(self, send, item):
+        ''' Sends one write
+
+        :returns: A Deferred fired with True when it was acknowledged
+        '''
+        d = defer.Deferred()
+        item.attempts += 1
+        started = self.clock.seconds()
+
+        def complete(ok):
+            if d.called:
+                # Answered after it timed out
+                return
+            if timer.active():
+                timer.cancel()
+            item.elapsed += self.clock.seconds() - started
+            item.ok = ok
+            d.callback(ok)
+
+        timer = self.clock.callLater(self.timeout, complete, False)
+        result = send(item.frame.request())
+        result.addBoth(lambda result: complete(acknowledged(result)))
+        return d
+
+    #-----------------------------------------------------------------------#
+    # Timings
+    #-----------------------------------------------------------------------#
+    def getTimings(self):
+        ''' Returns the total, per link and per write timings in seconds '''
+        return {
+            'total': self.elapsed,
+            'links': dict(self.linkTimes),
+            'items': [(item.link, item.name, item.elapsed, item.attempts, item.ok)
+                      for item in self.items()],
+        }
+
+    def summary(self):
+        ''' Returns a one line description of the load and its timings '''
+        items = self.items()
+        retries = sum(max(item.attempts - 1, 0) for item in items)
+        links = ', '.join('%s %.0f ms/%d writes' % (link, self.linkTimes.get(link, 0) * 1000,
+                                                   len(self.links[link][1]))
+                          for link in (DF1_LINK, MTRIM_LINK))
+        text = "Recipe %s %s in %.0f ms (%s, %d retries)" % (
+            self.name, 'failed' if self.failed() else 'loaded',
+            (self.elapsed or 0) * 1000, links, retries)
+        if items:
+            slowest = max(items, key=lambda item: item.elapsed)
+            text += ", slowest %s %s %.0f ms" % (slowest.link, slowest.name,
+                                                 slowest.elapsed * 1000)
+        return text
+
+
+#---------------------------------------------------------------------------#
+# Exported symbols
+#---------------------------------------------------------------------------#
+__all__ = [
+    "RecipeLoad", "RecipeLoadError",
+]
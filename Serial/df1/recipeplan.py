@@ -0,0 +1,213 @@
+"""
+Recipe Write Plans
+-------------------------------------------
+
+Compiles a recipe once, when the recipe store is loaded, into the exact
+frames a recipe load sends.  Loading a recipe then only streams bytes:
+there is no float conversion, address parsing or PDU encoding while the
+line waits for the machine to be ready.
+
+A DF1 write carries the transaction id inside the CRC'd data, so every
+PLC frame is kept as its encoded pieces around the id and only the id,
+its DLE escaping and the CRC (over roughly 20 bytes) are done at send
+time.  MTrim frames have no transaction id and are sent as compiled::
+
+    compiler = PlanCompiler(['N7:10', 'F8:2'])
+    plan = compiler(recipe)
+    for request in plan.plcRequests():
+        protocol.sendRequest(request)
+
+Every frame is produced by the existing DF1 request encoders or the MTrim
+codec, so a compiled frame is byte for byte the frame the request classes
+would send.
+"""
+
+import struct
+
+import utilities
+from df1commands import PDU, protectedWriteRequest, SUBELEMENT_STRUCT, ELEMENT_STRUCT
+from MTrimCommands import ParameterSendRequest
+from mtrimcodec import encodeParameterSend
+
+#---------------------------------------------------------------------------#
+# Logging
+#---------------------------------------------------------------------------#
+import logging
+_logger = logging.getLogger(__name__)
+
+
+#---------------------------------------------------------------------------#
+# Constants
+#---------------------------------------------------------------------------#
+# The MTrim parameters loaded from the last values of a recipe
+MTRIM_PARAMETERS = (1, 20, 21)
+FLOAT_FORMATS = ('f',)
+TID = struct.Struct('>H')
+CRC = struct.Struct('>H')
+
+
+def escapeDLE(data):
+    ''' Doubles every DLE of a frame's data '''
+    return data.replace('\x10', '\x10\x10')
+
+
+#---------------------------------------------------------------------------#
+# DF1 frames
+#---------------------------------------------------------------------------#
+class WriteFrame(object):
+    ''' A protectedWriteRequest encoded up to its transaction id
+    '''
+    __slots__ = ('parameter', 'value', 'Address', 'prefix', 'body', 'head', 'tail')
+
+    def __init__(self, dest, parameter, value, address):
+        ''' Encodes the write
+
+        :param dest: The PLC node
+        :param parameter: The data table address, e.g. 'N7:10'
+        :param value: The value to write
+        :param address: The parsed AddressObject of the parameter
+        '''
+        if address.subElement > 0:
+            formats = SUBELEMENT_STRUCT[address.fileType]
+        else:
+            formats = ELEMENT_STRUCT[address.fileType]
+        if formats not in FLOAT_FORMATS:
+            value = int(value)
+        request = protectedWriteRequest(dest, parameter, [value], address=address)
+        packet = request.encode()
+        # DLE STX | data | DLE ETX | CRC, data is dest src cmd sts tid ...
+        data = packet[2:-4].replace('\x10\x10', '\x10')
+        self.parameter = parameter
+        self.value = value
+        self.Address = address
+        self.prefix = data[:4]
+        self.body = data[6:]
+        self.head = '\x10\x02' + escapeDLE(self.prefix)
+        self.tail = escapeDLE(self.body) + '\x10\x03'
+
+    def encode(self, tid):
+        ''' Returns the frame with a transaction id '''
+        tid = TID.pack(tid)
+        crc = utilities.computeCRC(self.prefix + tid + self.body)
+        return self.head + escapeDLE(tid) + self.tail + CRC.pack(crc)
+
+    def request(self):
+        return CompiledWriteRequest(self)
+
+
+class CompiledWriteRequest(PDU):
+    ''' Sends a WriteFrame through the normal request path, the response
+    is decoded like a protectedWriteRequest's
+    '''
+    cmd = protectedWriteRequest.cmd
+    function = protectedWriteRequest.function
+
+    def __init__(self, frame, **kwargs):
+        PDU.__init__(self, **kwargs)
+        self.frame = frame
+        self.Address = frame.Address
+        self.packet = ''
+
+    def encode(self):
+        self.packet = self.frame.encode(self.transaction_id)
+        return self.packet
+
+    def __str__(self):
+        return "CompiledWriteRequest (%s=%s)" % (self.frame.parameter, self.frame.value)
+
+
+#---------------------------------------------------------------------------#
+# MTrim frames
+#---------------------------------------------------------------------------#
+class MTrimFrame(object):
+    ''' A fully encoded ParameterSendRequest '''
+    __slots__ = ('address', 'parameter', 'value', 'packet')
+
+    def __init__(self, address, parameter, value):
+        self.address = address
+        self.parameter = parameter
+        self.value = value
+        self.packet = encodeParameterSend(address, parameter, value)
+
+    def request(self):
+        request = ParameterSendRequest(self.address, self.parameter, self.value,
+                                       skip_encode=True)
+        request.packet = self.packet
+        return request
+
+
+#---------------------------------------------------------------------------#
+# Plans
+#---------------------------------------------------------------------------#
+class RecipePlan(object):
+    ''' The compiled frames of one recipe '''
+    __slots__ = ('name', 'plcWrites', 'mtrimWrites')
+
+    def __init__(self, name, plcWrites, mtrimWrites):
+        self.name = name
+        self.plcWrites = tuple(plcWrites)
+        self.mtrimWrites = tuple(mtrimWrites)
+
+    def plcRequests(self):
+        ''' Returns a fresh request per PLC write, ready to send '''
+        return [frame.request() for frame in self.plcWrites]
+
+    def mtrimRequests(self):
+        ''' Returns a fresh request per MTrim write, ready to send '''
+        return [frame.request() for frame in self.mtrimWrites]
+
+    def __len__(self):
+        return len(self.plcWrites) + len(self.mtrimWrites)
+
+
+class PlanCompiler(object):
+    ''' Compiles recipes for one PLC recipe layout
+
+    The first values of a recipe go to the PLC addresses in order, the
+    last values to the MTrim parameters.
+    '''
+
+    def __init__(self, plcAddresses, dest=1, mtrimAddress=1,
+                 mtrimParameters=MTRIM_PARAMETERS):
+        ''' Parses the addresses once
+
+        :param plcAddresses: The PLC data table addresses of the recipe
+        :param dest: The PLC node
+        :param mtrimAddress: The MTrim device address
+        :param mtrimParameters: The MTrim parameters of the last values
+        :raises ValueError: No PLC addresses were given
+        '''
+        self.addresses = [(a.strip(), utilities.calcAddress(a.strip()))
+                          for a in plcAddresses if a.strip()]
+        if not self.addresses:
+            # A plan without PLC writes would report recipes as loaded
+            # that never reached the SLC
+            raise ValueError("No PLC recipe addresses, check [SLC] Recipe")
+        self.dest = dest
+        self.mtrimAddress = mtrimAddress
+        self.mtrimParameters = tuple(mtrimParameters)
+
+    def __call__(self, recipe):
+        ''' Returns the RecipePlan of a store Recipe
+
+        :raises ValueError: The recipe has too few values
+        '''
+        values = recipe.values
+        needed = len(self.addresses) + len(self.mtrimParameters)
+        if len(values) < needed:
+            raise ValueError("Recipe %s has %d values, %d needed"
+                             % (recipe.name, len(values), needed))
+        mtrimValues = values[len(values) - len(self.mtrimParameters):]
+        plcWrites = [WriteFrame(self.dest, parameter, value, address)
+                     for (parameter, address), value in zip(self.addresses, values)]
+        mtrimWrites = [MTrimFrame(self.mtrimAddress, parameter, value)
+                       for parameter, value in zip(self.mtrimParameters, mtrimValues)]
+        return RecipePlan(recipe.name, plcWrites, mtrimWrites)
+
+
+#---------------------------------------------------------------------------#
+# Exported symbols
+#---------------------------------------------------------------------------#
+__all__ = [
+    "PlanCompiler", "RecipePlan", "WriteFrame", "MTrimFrame", "CompiledWriteRequest",
+]
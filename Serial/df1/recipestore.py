@@ -0,0 +1,146 @@
+"""
+Recipe Store
+-------------------------------------------
+
+Parses ``families.csv`` and every family file it lists once and keeps
+the recipes in a dict keyed by their exact name, so loading a recipe into
+the PLC needs no file access.  A family file holds one recipe per line::
+
+    NAME,value,value,...
+
+and the values are converted to floats when the store is loaded.  The
+store is rebuilt after a recipe download and swapped in whole, a lookup
+never sees a half loaded directory.  With a compiler (see recipeplan) each
+recipe's write plan is compiled as it is loaded::
+
+    store = RecipeStore('./recipes/')
+    recipe = store.get('RG6-1234')
+    recipe.values
+"""
+
+import os
+
+from recipesync import FAMILIES_NAME, recipeFileName
+
+#---------------------------------------------------------------------------#
+# Logging
+#---------------------------------------------------------------------------#
+import logging
+_logger = logging.getLogger(__name__)
+
+
+def recipeKey(name):
+    ''' Returns the lookup key of a recipe name, the PLC pads its strings '''
+    return name.strip().rstrip('\x00').strip()
+
+
+class Recipe(object):
+    ''' One parsed recipe line '''
+    __slots__ = ('name', 'family', 'values', 'plan')
+
+    def __init__(self, name, family, values):
+        self.name = name
+        self.family = family
+        self.values = values
+        self.plan = None
+
+
+class RecipeStore(object):
+    ''' All recipes of the local recipe directory, indexed by name
+    '''
+
+    def __init__(self, directory, compiler=None):
+        ''' Loads the recipe directory
+
+        :param directory: The local recipe directory
+        :param compiler: Called with each Recipe to compile its plan
+        '''
+        self.directory = directory
+        self.compiler = compiler
+        self.recipes = {}
+        self.stats = {'loads': 0, 'recipes': 0, 'skipped': 0, 'hits': 0, 'misses': 0}
+        self.load()
+
+    def load(self):
+        ''' Parses every family file and replaces the index
+
+        :returns: The number of recipes loaded
+        '''
+        recipes = {}
+        skipped = 0
+        families = os.path.join(self.directory, FAMILIES_NAME)
+        if not os.path.exists(families):
+            _logger.warning("No %s in %s" % (FAMILIES_NAME, self.directory))
+        else:
+            fObj = open(families, 'r')
+            try:
+                names = [line.strip() for line in fObj if line.strip()]
+            finally:
+                fObj.close()
+            for family in names:
+                skipped += self.loadFamily(family, recipes)
+        self.recipes = recipes
+        self.stats['loads'] += 1
+        self.stats['recipes'] = len(recipes)
+        self.stats['skipped'] = skipped
+        _logger.info("Loaded %d recipes from %s" % (len(recipes), self.directory))
+        return len(recipes)
+
+    def loadFamily(self, family, recipes):
+        ''' Adds the recipes of one family file to a dict
+
+        :returns: The number of lines that could not be parsed
+        '''
+        filename = os.path.join(self.directory, recipeFileName(family))
+        if not os.path.exists(filename):
+            _logger.warning("Recipe family %s has no file" % family)
+            return 0
+        skipped = 0
+        fObj = open(filename, 'r')
+        try:
+            for line in fObj:
+                fields = line.strip().split(',')
+                if not fields[0]:
+                    continue
+                try:
+                    values = tuple(float(f) for f in fields[1:])
+                except ValueError:
+                    # Headers and malformed lines
+                    skipped += 1
+                    continue
+                name = recipeKey(fields[0])
+                recipe = recipes[name] = Recipe(name, family, values)
+                if self.compiler is not None:
+                    try:
+                        recipe.plan = self.compiler(recipe)
+                    except (ValueError, KeyError), ex:
+                        _logger.warning("Unable to compile recipe %s: %s" % (name, ex))
+        finally:
+            fObj.close()
+        return skipped
+
+    def get(self, name):
+        ''' Returns the Recipe of a name or None
+
+        :param name: The recipe name as read from the PLC
+        '''
+        recipe = self.recipes.get(recipeKey(name))
+        self.stats['hits' if recipe is not None else 'misses'] += 1
+        return recipe
+
+    def __contains__(self, name):
+        return recipeKey(name) in self.recipes
+
+    def __len__(self):
+        return len(self.recipes)
+
+    def getStats(self):
+        return dict(self.stats)
+
+
+#---------------------------------------------------------------------------#
+# Exported symbols
+#---------------------------------------------------------------------------#
+__all__ = [
+    "RecipeStore", "Recipe",
+]
@@ -0,0 +1,372 @@
+"""
+Recipe Sync
+-------------------------------------------
+
+Brings the local recipe directory up to date with the FTP server while
+only moving the files that changed.  ``families.csv`` lists the recipes;
+for it and every recipe the server's SIZE and MDTM are compared with a
+local manifest, unchanged files are skipped and changed ones are fetched
+concurrently over a bounded number of pooled sessions.
+
+Each download is written to a temporary file and renamed over the old
+recipe once complete, so a dropped connection never leaves a truncated
+recipe behind for the PLC to load::
+
+    sync = RecipeSync(pool, './recipes/', concurrency=2)
+    d = sync.sync()
+    d.addCallback(lambda stats: stats['fetched'])
+
+Servers without SIZE/MDTM simply get every file fetched.
+
+In bundle mode the server publishes every family and recipe as a single
+archive (any format tarfile reads, e.g. recipes.tar.gz) together with a
+sha256sum style checksum file (recipes.tar.gz.sha256).  A sync is then one
+small checksum fetch, and only when the checksum changed one archive
+transfer, verified before it is unpacked into the recipe directory.  The
+checksum and the unpacking run in a thread, the reactor keeps serving the
+serial links meanwhile::
+
+    sync = RecipeSync(pool, './recipes/', bundle='recipes.tar.gz')
+"""
+
+import hashlib
+import os
+import tarfile
+
+from twisted.internet import defer, interfaces, threads
+from zope.interface import implements
+
+#---------------------------------------------------------------------------#
+# Logging
+#---------------------------------------------------------------------------#
+import logging
+_logger = logging.getLogger(__name__)
+
+
+#---------------------------------------------------------------------------#
+# Constants
+#---------------------------------------------------------------------------#
+FAMILIES_NAME = 'families.csv'
+MANIFEST_NAME = '.manifest'
+CHECKSUM_SUFFIX = '.sha256'
+
+
+def recipeFileName(line):
+    ''' Returns the recipe file named by a families.csv line '''
+    return line.strip()[0:8] + '.csv'
+
+
+class AtomicFileReceiver(object):
+    ''' Writes received data to a temporary file that is renamed into
+    place with commit()
+    '''
+    implements(interfaces.IProtocol)
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.temp = filename + '.tmp'
+        self.fObj = None
+        self.received = 0
+
+    def makeConnection(self, transport):
+        self.fObj = open(self.temp, 'wb')
+
+    def dataReceived(self, data):
+        self.fObj.write(data)
+        self.received += len(data)
+
+    def connectionLost(self, reason):
+        if self.fObj is not None:
+            self.fObj.close()
+
+    def commit(self):
+        ''' Replaces the target with the completed download '''
+        os.rename(self.temp, self.filename)
+
+    def discard(self):
+        if os.path.exists(self.temp):
+            os.remove(self.temp)
+
+
+class MemoryReceiver(object):
+    ''' Collects a small download in memory '''
+    implements(interfaces.IProtocol)
+
+    def __init__(self):
+        self.chunks = []
+
+    def makeConnection(self, transport):
+        pass
+
+    def dataReceived(self, data):
+        self.chunks.append(data)
+
+    def connectionLost(self, reason):
+        pass
+
+    def getValue(self):
+        return ''.join(self.chunks)
+
+
+def fileDigest(filename):
+    ''' Returns the sha256 hex digest of a file '''
+    digest = hashlib.sha256()
+    fObj = open(filename, 'rb')
+    try:
+        for chunk in iter(lambda: fObj.read(64*1024), ''):
+            digest.update(chunk)
+    finally:
+        fObj.close()
+    return digest.hexdigest()
+
+
+class ChecksumError(Exception):
+    ''' A downloaded bundle doesn't match its published checksum '''
+    pass
+
+
+class RecipeSync(object):
+    ''' Conditional, concurrent recipe download
+    '''
+
+    def __init__(self, pool, localDir, concurrency=2, bundle=None):
+        ''' Initializes the sync engine
+
+        :param pool: The FTPSessionPool to transfer on
+        :param localDir: The local recipe directory
+        :param concurrency: The most downloads in flight, also bounded by
+                            the pool size
+        :param bundle: The remote archive holding every recipe, None
+                       fetches the files one by one
+        '''
+        self.pool = pool
+        self.bundle = bundle
+        self.localDir = localDir
+        self.bundlePath = os.path.join(localDir, bundle) if bundle else None
+        self.semaphore = defer.DeferredSemaphore(concurrency)
+        self.manifestPath = os.path.join(localDir, MANIFEST_NAME)
+        self.manifest = self.readManifest()
+        self.stats = {}
+
+    #-----------------------------------------------------------------------#
+    # Manifest
+    #-----------------------------------------------------------------------#
+    def readManifest(self):
+        ''' Loads the (size, mdtm) of every file fetched before '''
+        manifest = {}
+        if os.path.exists(self.manifestPath):
+            for line in open(self.manifestPath, 'r'):
+                fields = line.strip().split(',')
+                if len(fields) == 3:
+                    manifest[fields[0]] = (fields[1], fields[2])
+        return manifest
+
+    def writeManifest(self):
+        fObj = open(self.manifestPath + '.tmp', 'w')
+        for name in sorted(self.manifest):
+            fObj.write('%s,%s,%s\n' % ((name,) + self.manifest[name]))
+        fObj.close()
+        os.rename(self.manifestPath + '.tmp', self.manifestPath)
+
+    #-----------------------------------------------------------------------#
+    # Transfers
+    #-----------------------------------------------------------------------#
+    def sync(self):
+        ''' Syncs families.csv and then every recipe it lists
+
+        :returns: A Deferred fired with the fetched/skipped/failed counts
+        '''
+        self.stats = {'fetched': 0, 'skipped': 0, 'failed': 0, 'bytes': 0}
+        if self.bundle:
+            # The session is given back before the archive is unpacked
+            d = self.pool.run(self.fetchBundle)
+            d.addCallback(self.installBundle)
+            d.addErrback(self.ebBundle)
+            d.addBoth(self.discardBundle)
+            d.addCallback(lambda _: self.writeManifest())
+            d.addCallback(lambda _: self.stats)
+            return d
+        d = self.pool.run(self.fetchIfChanged, FAMILIES_NAME)
+
+        def cbFamilies(_):
+            names = []
+            for line in open(os.path.join(self.localDir, FAMILIES_NAME), 'r'):
+                if line.strip():
+                    names.append(recipeFileName(line))
+            downloads = [self.semaphore.run(self.pool.run, self.fetchIfChanged, name)
+                         for name in names]
+            return defer.DeferredList(downloads, consumeErrors=True)
+
+        def cbDone(_):
+            self.writeManifest()
+            _logger.info("Recipe sync: %(fetched)d fetched, %(skipped)d skipped, "
+                         "%(failed)d failed" % self.stats)
+            return self.stats
+
+        d.addCallback(cbFamilies)
+        d.addCallback(cbDone)
+        return d
+
+    def remoteStamp(self, session, name):
+        ''' Returns a Deferred fired with the remote (size, mdtm), either
+        is None when the server doesn't support the command
+        '''
+        def cbReply(result):
+            # '213 <value>'
+            return result[-1].split()[-1]
+        size = session.queueStringCommand('SIZE ' + session.escapePath(name))
+        size.addCallbacks(cbReply, lambda _: None)
+        mdtm = session.queueStringCommand('MDTM ' + session.escapePath(name))
+        mdtm.addCallbacks(cbReply, lambda _: None)
+        d = defer.gatherResults([size, mdtm])
+        d.addCallback(tuple)
+        return d
+
+    def fetchIfChanged(self, session, name):
+        ''' Fetches one file unless the server copy matches the manifest
+
+        :param session: The FTPClientA to use
+        :param name: The remote (and local) file name
+        '''
+        localFile = os.path.join(self.localDir, name)
+
+        def cbStamp(stamp):
+            known = (None not in stamp and os.path.exists(localFile) and
+                     self.manifest.get(name) == stamp)
+            if known:
+                self.stats['skipped'] += 1
+                return
+            receiver = AtomicFileReceiver(localFile)
+            d = session.retrieveFile(name, receiver)
+            d.addCallback(cbFetched, receiver, stamp)
+            d.addErrback(ebFetched, receiver)
+            return d
+
+        def cbFetched(_, receiver, stamp):
+            receiver.commit()
+            self.stats['fetched'] += 1
+            self.stats['bytes'] += receiver.received
+            if None not in stamp:
+                self.manifest[name] = stamp
+            else:
+                self.manifest.pop(name, None)
+
+        def ebFetched(failure, receiver):
+            receiver.discard()
+            self.stats['failed'] += 1
+            _logger.error("Unable to fetch recipe %s: %s" % (name, failure.value))
+            return failure
+
+        d = self.remoteStamp(session, name)
+        d.addCallback(cbStamp)
+        return d
+
+    #-----------------------------------------------------------------------#
+    # Bundle mode
+    #-----------------------------------------------------------------------#
+    def fetchBundle(self, session):
+        ''' Fetches the recipe archive if its checksum changed
+
+        :param session: The FTPClientA to use
+        :returns: A Deferred fired with the published digest of the fetched
+                  archive, None when it didn't change
+        '''
+        checksum = MemoryReceiver()
+        archive = AtomicFileReceiver(self.bundlePath)
+
+        def cbChecksum(_):
+            # 'hexdigest  filename'
+            digest = checksum.getValue().split()[0].lower()
+            if (self.manifest.get(self.bundle) == ('sha256', digest) and
+                    os.path.exists(os.path.join(self.localDir, FAMILIES_NAME))):
+                self.stats['skipped'] += 1
+                return None
+            d = session.retrieveFile(self.bundle, archive)
+            d.addCallback(cbArchive, digest)
+            return d
+
+        def cbArchive(_, digest):
+            self.stats['bytes'] += archive.received
+            return digest
+
+        # The archive has to arrive untranslated
+        d = session.binaryMode()
+        d.addCallback(lambda _: session.retrieveFile(self.bundle + CHECKSUM_SUFFIX, checksum))
+        d.addCallback(cbChecksum)
+        return d
+
+    def installBundle(self, digest):
+        ''' Verifies and unpacks a fetched archive in a thread
+
+        :param digest: The published digest, None if nothing was fetched
+        '''
+        if digest is None:
+            return
+
+        def cbInstalled(count):
+            self.stats['fetched'] += count
+            self.manifest[self.bundle] = ('sha256', digest)
+
+        d = threads.deferToThread(self.verifyBundle, self.bundlePath + '.tmp', digest)
+        d.addCallback(cbInstalled)
+        return d
+
+    def ebBundle(self, failure):
+        self.stats['failed'] += 1
+        _logger.error("Unable to sync recipe bundle: %s" % failure.value)
+        return failure
+
+    def discardBundle(self, result):
+        ''' Removes the downloaded archive, it is only kept unpacked '''
+        if os.path.exists(self.bundlePath + '.tmp'):
+            os.remove(self.bundlePath + '.tmp')
+        return result
+
+    def verifyBundle(self, filename, digest):
+        ''' Checks an archive against its digest and unpacks it, runs in a
+        thread
+
+        :returns: The number of files unpacked
+        :raises ChecksumError: The archive doesn't match the digest
+        '''
+        if fileDigest(filename) != digest:
+            raise ChecksumError("%s does not match its checksum" % self.bundle)
+        return self.unpack(filename)
+
+    def unpack(self, filename):
+        ''' Writes every file of an archive into the recipe directory, each
+        through a temporary file and a rename
+
+        :returns: The number of files written
+        '''
+        count = 0
+        archive = tarfile.open(filename, 'r:*')
+        try:
+            for member in archive:
+                if not member.isfile():
+                    continue
+                # Archive paths are flattened so nothing lands outside
+                name = os.path.basename(member.name)
+                if not name or name.startswith('.'):
+                    continue
+                target = os.path.join(self.localDir, name)
+                source = archive.extractfile(member)
+                fObj = open(target + '.tmp', 'wb')
+                try:
+                    for chunk in iter(lambda: source.read(64*1024), ''):
+                        fObj.write(chunk)
+                finally:
+                    fObj.close()
+                os.rename(target + '.tmp', target)
+                count += 1
+        finally:
+            archive.close()
+        return count
+
+
+#---------------------------------------------------------------------------#
+# Exported symbols
+#---------------------------------------------------------------------------#
+__all__ = [
+    "RecipeSync", "AtomicFileReceiver", "ChecksumError",
+]
@@ -0,0 +1,214 @@
+"""
+SQLite Time Series Sink
+-------------------------------------------
+
+An optional sink that keeps the OEE rows in a local SQLite database so
+history can be searched with SQL instead of parsing the daily CSV files.
+Every tag schema gets one wide table (a time column plus one column per
+tag) named after a checksum of its columns, so a changed [SLC] header
+starts a new table instead of breaking the old one.
+
+Rows are queued by ``write`` on the reactor thread and inserted by a
+dedicated writer thread with one prepared ``executemany`` per commit
+interval.  The database runs in WAL mode so readers (``query``) never
+block the writer, and rows older than the retention period are purged
+once an hour.
+
+Example::
+
+    sink = SQLiteLogger('./logs/oee.db', tags, tags.pollClass('oee'))
+    logger.addSink(sink)
+    rows = sink.query(start, end, ['Line Speed'])
+
+The sink is enabled with the optional [SQLite] section::
+
+    [SQLite]
+    Path           = ./logs/oee.db
+    CommitInterval = 10
+    RetentionDays  = 90
+"""
+
+import sqlite3
+import threading
+import time
+import zlib
+
+from serialexceptions import ParameterException
+
+#---------------------------------------------------------------------------#
+# Logging
+#---------------------------------------------------------------------------#
+import logging
+_logger = logging.getLogger(__name__)
+
+
+#---------------------------------------------------------------------------#
+# Constants
+#---------------------------------------------------------------------------#
+PURGE_INTERVAL = 3600
+
+COLUMN_TYPES = {
+                'float32': 'REAL',
+                'string' : 'TEXT'}
+
+
+def quote(name):
+    ''' Returns a quoted SQL identifier '''
+    return '"%s"' % name.replace('"', '""')
+
+
+#---------------------------------------------------------------------------#
+# Sink
+#---------------------------------------------------------------------------#
+class SQLiteLogger(object):
+    ''' A log sink that batches rows into a SQLite table
+    '''
+
+    def __init__(self, path, tags, handles, commitInterval=10, retentionDays=90):
+        ''' Creates the table and starts the writer thread
+
+        :param path: The database file
+        :param tags: The compiled TagDictionary
+        :param handles: The tag handles logged, in column order
+        :param commitInterval: The seconds between batched commits
+        :param retentionDays: Rows older than this are purged, 0 keeps all
+        '''
+        self.path = path
+        self.names = [tags[h].name for h in handles]
+        self.types = [COLUMN_TYPES.get(tags[h].dataType,
+                      'REAL' if tags[h].scaled else 'INTEGER') for h in handles]
+        self.table = 'oee_%08x' % (zlib.crc32(','.join(self.names)) & 0xffffffff)
+        self.commitInterval = commitInterval
+        self.retention = retentionDays * 86400.0
+        self.insert = 'INSERT INTO %s VALUES (%s)' % (self.table,
+                      ','.join('?' * (len(handles) + 1)))
+        self.pending = []
+        self.inserted = 0
+        self.commits = 0
+        self.purged = 0
+        self.lastPurge = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._running = True
+
+        # Create the schema before the first row can be queued
+        connection = self.connect()
+        columns = ''.join(', %s %s' % (quote(n), t) for n, t in zip(self.names, self.types))
+        connection.execute('CREATE TABLE IF NOT EXISTS %s (time REAL NOT NULL%s)'
+                           % (self.table, columns))
+        connection.execute('CREATE INDEX IF NOT EXISTS %s_time ON %s (time)'
+                           % (self.table, self.table))
+        connection.commit()
+        connection.close()
+
+        self._thread = threading.Thread(target=self.run, name='sqlite-sink')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def connect(self):
+        ''' Opens a connection in WAL mode '''
+        connection = sqlite3.connect(self.path)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        return connection
+
+    #-----------------------------------------------------------------------#
+    # Sink interface (reactor thread)
+    #-----------------------------------------------------------------------#
+    def write(self, response, timestamp=None):
+        ''' Queues one row for the next commit
+
+        :param response: The list of records for each logged tag
+        :param timestamp: The unix time of the record (defaults to now)
+        '''
+        if timestamp is None:
+            timestamp = time.time()
+        row = [timestamp]
+        for value in response:
+            if hasattr(value, '__iter__'):
+                value = value[0] if value else None
+            row.append(value)
+        with self._lock:
+            self.pending.append(row)
+
+    def flush(self):
+        ''' Asks the writer thread to commit now '''
+        self._wake.set()
+
+    def close(self):
+        ''' Stops the writer thread after the last rows are committed '''
+        if self._running:
+            self._running = False
+            self._wake.set()
+            self._thread.join()
+
+    #-----------------------------------------------------------------------#
+    # Writer thread
+    #-----------------------------------------------------------------------#
+    def run(self):
+        ''' Commits the queued rows every commit interval '''
+        connection = self.connect()
+        try:
+            while self._running:
+                self._wake.wait(self.commitInterval)
+                self._wake.clear()
+                self.commit(connection)
+            self.commit(connection)
+        finally:
+            connection.close()
+
+    def commit(self, connection):
+        ''' Inserts the queued rows in one transaction and purges old rows '''
+        with self._lock:
+            rows, self.pending = self.pending, []
+        try:
+            if rows:
+                connection.executemany(self.insert, rows)
+                self.inserted += len(rows)
+            now = time.time()
+            if self.retention and now - self.lastPurge >= PURGE_INTERVAL:
+                cursor = connection.execute('DELETE FROM %s WHERE time < ?' % self.table,
+                                            (now - self.retention,))
+                self.purged += max(cursor.rowcount, 0)
+                self.lastPurge = now
+            connection.commit()
+            self.commits += 1
+        except sqlite3.Error, ex:
+            _logger.error("Unable to store %d rows: %s" % (len(rows), ex))
+            connection.rollback()
+
+    #-----------------------------------------------------------------------#
+    # Queries (any thread)
+    #-----------------------------------------------------------------------#
+    def query(self, start, end, columns=None):
+        ''' Returns the committed rows in a time window
+
+        :param start: The unix time the window starts at
+        :param end: The unix time the window ends at (inclusive)
+        :param columns: The tag names wanted (defaults to every tag)
+        :returns: A list of (time, value, ...) tuples in time order
+        '''
+        columns = columns or self.names
+        for name in columns:
+            if name not in self.names:
+                raise ParameterException("%s is not logged to %s" % (name, self.table))
+        sql = 'SELECT time, %s FROM %s WHERE time BETWEEN ? AND ? ORDER BY time' % (
+              ', '.join(quote(n) for n in columns), self.table)
+        connection = self.connect()
+        try:
+            return connection.execute(sql, (start, end)).fetchall()
+        finally:
+            connection.close()
+
+    def getStats(self):
+        ''' Returns the writer counters '''
+        return {'inserted': self.inserted, 'commits': self.commits,
+                'purged': self.purged, 'pending': len(self.pending)}
+
+
+#---------------------------------------------------------------------------#
+# Exported symbols
+#---------------------------------------------------------------------------#
+__all__ = [
+    "SQLiteLogger",
+]
@@ -0,0 +1,240 @@
+"""
+Shared Memory Tag Image
+-------------------------------------------
+
+Publishes the latest value of every tag into a memory mapped file so
+other local processes (the PiFace LCD application, scripts) can read
+live PLC data without their own serial access and without any IPC round
+trip.  The image is protected by a seqlock: the writer makes the sequence
+number odd while it updates and even when it is done, and a reader only
+accepts a copy taken between two identical, even sequence numbers.
+
+A restarted writer publishes a new file under the same path, a reader
+notices the path now names another inode and maps the new image.  Tags
+that were never written read as NaN (numbers) or None (strings).
+
+This module only uses the standard library and runs under Python 2 and
+Python 3 so the LCD application can import it directly::
+
+    reader = TagImageReader('/dev/shm/scify_tags')
+    stamp, values = reader.snapshot()
+    print(values['Line Speed'])
+
+Image layout (little endian)::
+
+    [ Header ][ Name table ][ Slots ]
+
+    Header     magic '4s', version H, header size H, sequence I,
+               tag count I, slot size I, update time d,
+               name table offset I, slot offset I
+    Name table one 32 byte name and one type byte per tag
+    Slots      one value d plus one 84 byte string per tag
+"""
+
+import mmap
+import os
+import struct
+import time
+
+#---------------------------------------------------------------------------#
+# Logging
+#---------------------------------------------------------------------------#
+import logging
+_logger = logging.getLogger(__name__)
+
+
+#---------------------------------------------------------------------------#
+# Constants
+#---------------------------------------------------------------------------#
+MAGIC = b'SFTI'
+VERSION = 1
+HEADER = struct.Struct('<4sHHIIIdII')
+NAME = struct.Struct('<32sB')
+SLOT = struct.Struct('<d84s')
+SEQUENCE = struct.Struct('<I')
+STAMP = struct.Struct('<d')
+SEQUENCE_OFFSET = 8
+STAMP_OFFSET = 20
+MAX_RETRIES = 100
+# The value of a slot that was never written
+UNSET = float('nan')
+
+TYPE_NUMBER = 0
+TYPE_STRING = 1
+
+
+class TagImageError(Exception):
+    ''' Error resulting from a missing or incompatible image '''
+    pass
+
+
+#---------------------------------------------------------------------------#
+# Writer
+#---------------------------------------------------------------------------#
+class TagImageWriter(object):
+    ''' Owns the image file and publishes tag values into it
+    '''
+
+    def __init__(self, path, tags):
+        ''' Creates (or replaces) the image for a tag dictionary
+
+        :param path: The file to map, ideally on a tmpfs such as /dev/shm
+        :param tags: The compiled TagDictionary
+        '''
+        self.path = path
+        self.count = len(tags)
+        self.types = []
+        names = b''
+        for tag in tags:
+            kind = TYPE_STRING if tag.dataType == 'string' else TYPE_NUMBER
+            self.types.append(kind)
+            names += NAME.pack(tag.name.encode('ascii', 'replace')[:32], kind)
+        self.nameOffset = HEADER.size
+        self.slotOffset = self.nameOffset + len(names)
+        size = self.slotOffset + SLOT.size * self.count
+        self.sequence = 0
+
+        # Write to a new file and rename it so readers never map a
+        # half-built image
+        temp = path + '.tmp'
+        fObj = open(temp, 'wb')
+        fObj.write(HEADER.pack(MAGIC, VERSION, HEADER.size, 0, self.count,
+                               SLOT.size, 0.0, self.nameOffset, self.slotOffset))
+        fObj.write(names)
+        fObj.write(SLOT.pack(UNSET, b'') * self.count)
+        fObj.close()
+        os.rename(temp, path)
+
+        self.fObj = open(path, 'r+b')
+        self.image = mmap.mmap(self.fObj.fileno(), size)
+
+    def publish(self, results, handles, timestamp=None):
+        ''' Writes one poll worth of values into the image
+
+        :param results: The list of records returned for each handle
+        :param handles: The tag handles that were read
+        :param timestamp: The unix time of the poll (defaults to now)
+        :returns: The results, so this can be used as a callback
+        '''
+        if timestamp is None:
+            timestamp = time.time()
+        image = self.image
+        self.sequence = (self.sequence + 1) & 0xffffffff
+        SEQUENCE.pack_into(image, SEQUENCE_OFFSET, self.sequence)
+        try:
+            for i in range(len(handles)):
+                value = results[i]
+                if hasattr(value, '__iter__') and not isinstance(value, str):
+                    if not value: continue
+                    value = value[0]
+                offset = self.slotOffset + SLOT.size * handles[i]
+                if self.types[handles[i]] == TYPE_STRING:
+                    if not isinstance(value, bytes):
+                        value = str(value).encode('latin-1')
+                    SLOT.pack_into(image, offset, 0.0, value[:84])
+                else:
+                    try:
+                        SLOT.pack_into(image, offset, float(value), b'')
+                    except (TypeError, ValueError):
+                        _logger.debug("Skipping image value %r" % (value,))
+            STAMP.pack_into(image, STAMP_OFFSET, timestamp)
+        finally:
+            self.sequence = (self.sequence + 1) & 0xffffffff
+            SEQUENCE.pack_into(image, SEQUENCE_OFFSET, self.sequence)
+        return results
+
+    def close(self):
+        ''' Unmaps and closes the image (the file is left for readers) '''
+        self.image.close()
+        self.fObj.close()
+
+
+#---------------------------------------------------------------------------#
+# Reader
+#---------------------------------------------------------------------------#
+class TagImageReader(object):
+    ''' Reads consistent snapshots of a published image without locking
+    '''
+
+    def __init__(self, path):
+        ''' Maps an image read only and loads its name table
+
+        :param path: The image file published by TagImageWriter
+        '''
+        self.path = path
+        self.open()
+
+    def open(self):
+        ''' Maps the image the path currently names '''
+        self.fObj = open(self.path, 'rb')
+        self.inode = os.fstat(self.fObj.fileno()).st_ino
+        self.image = mmap.mmap(self.fObj.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, size, sequence, self.count, slotSize, stamp,
+         nameOffset, self.slotOffset) = HEADER.unpack_from(self.image, 0)
+        if magic != MAGIC or version != VERSION or slotSize != SLOT.size:
+            self.close()
+            raise TagImageError("%s is not a version %d tag image" % (self.path, VERSION))
+        self.names = []
+        self.types = []
+        for i in range(self.count):
+            name, kind = NAME.unpack_from(self.image, nameOffset + NAME.size*i)
+            self.names.append(name.rstrip(b'\x00').decode('ascii'))
+            self.types.append(kind)
+
+    def reopen(self):
+        ''' Maps the image again when the writer replaced it, a mapping of
+        the old file would keep returning its last values
+        '''
+        try:
+            inode = os.stat(self.path).st_ino
+        except OSError:
+            raise TagImageError("%s was removed" % self.path)
+        if inode != self.inode:
+            self.close()
+            self.open()
+
+    def snapshot(self):
+        ''' Returns a consistent copy of every tag
+
+        :returns: A tuple of (update time, {name: value})
+        :raises TagImageError: If no stable copy could be taken
+        '''
+        self.reopen()
+        image = self.image
+        start = self.slotOffset
+        end = start + SLOT.size * self.count
+        for _ in range(MAX_RETRIES):
+            before, = SEQUENCE.unpack_from(image, SEQUENCE_OFFSET)
+            if before & 1:
+                continue
+            data = image[start:end]
+            stamp, = STAMP.unpack_from(image, STAMP_OFFSET)
+            after, = SEQUENCE.unpack_from(image, SEQUENCE_OFFSET)
+            if before == after:
+                break
+        else:
+            raise TagImageError("Writer did not settle after %d retries" % MAX_RETRIES)
+
+        values = {}
+        for i in range(self.count):
+            number, text = SLOT.unpack_from(data, SLOT.size*i)
+            if self.types[i] == TYPE_STRING:
+                # A written string clears the number
+                values[self.names[i]] = (text.rstrip(b'\x00').decode('latin-1')
+                                         if number == number else None)
+            else:
+                values[self.names[i]] = number
+        return (stamp, values)
+
+    def close(self):
+        ''' Unmaps and closes the image '''
+        self.image.close()
+        self.fObj.close()
+
+
+#---------------------------------------------------------------------------#
+# Exported symbols
+#---------------------------------------------------------------------------#
+__all__ = [
+    "TagImageWriter", "TagImageReader", "TagImageError",
+]
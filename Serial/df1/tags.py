@@ -0,0 +1,503 @@
+"""
+Symbolic Tag Dictionary
+-------------------------------------------
+
+The [SLC] section of config.ini keeps the logger header, the PLC
+addresses and the alarm/recipe addresses as parallel comma separated
+lists.  The tag dictionary compiles those lists once at startup into
+Tag objects that carry a precomputed address, data type, scaling and
+poll class.  Everything that runs on a timer (pollers, the logger and
+the alarm rules) then works with integer tag handles instead of
+re-parsing address strings on every request.
+
+Example::
+
+    config = utilities.optionReader()
+    tags = TagDictionary.fromConfig(config)
+    for handle in tags.pollClass('oee'):
+        request = tags.readRequest(handle)
+
+Optional [SLC] keys understood by the compiler (each is a comma list
+parallel to Parameters)::
+
+    Scaling   = 1, 1, 0.1, ...        # raw * scale + offset
+    Offsets   = 0, 0, 0, ...
+    PollClass = oee, oee, fast, ...   # default is 'oee', the logged class
+    AlarmNames = AlarmWord, RecipeLoad, RecipeDownload
+    PrefetchRecipeName = ST15:20      # read with the alarms, see prefetch.py
+"""
+
+from df1commands import ELEMENT_SIZE, SUBELEMENT_SIZE
+from df1commands import protectedReadRequest, protectedWriteRequest
+from df1commands import protectedBitWriteRequest
+from serialexceptions import ParameterException
+import utilities
+import time
+
+#---------------------------------------------------------------------------#
+# Logging
+#---------------------------------------------------------------------------#
+import logging
+_logger = logging.getLogger(__name__)
+
+
+#---------------------------------------------------------------------------#
+# Constants
+#---------------------------------------------------------------------------#
+# The logger header begins with columns that are not PLC tags
+TIMESTAMP_COLUMNS = 2
+DEFAULT_POLL_CLASS = 'oee'
+ALARM_POLL_CLASS = 'alarm'
+RECIPE_POLL_CLASS = 'recipe'
+PREFETCH_POLL_CLASS = 'prefetch'
+PREFETCH_TAG = 'RecipeNamePrefetch'
+DEFAULT_ALARM_NAMES = ['AlarmWord', 'RecipeLoad', 'RecipeDownload']
+
+DATA_TYPES = {
+              0x84: 'int16',         #Status
+              0x85: 'int16',         #Bit
+              0x86: 'timer',         #Timer
+              0x87: 'counter',       #Counter
+              0x88: 'int16',         #Control
+              0x89: 'int16',         #Integer
+              0x8A: 'float32',       #Float
+              0x8B: 'int16',         #Output
+              0x8C: 'int16',         #Input
+              0x8D: 'string',        #String
+              0x8E: 'int16',         #ASCII
+              0x8F: 'int16',         #BCD
+              0x92: 'message',       #Message
+              0x93: 'int16',         #PID
+              0x94: 'int16'}         #Programmable Limit Switch
+
+
+#---------------------------------------------------------------------------#
+# Tag
+#---------------------------------------------------------------------------#
+class Tag(object):
+    ''' A single compiled PLC tag
+
+    .. attribute:: handle
+
+       The integer index of this tag in its TagDictionary
+
+    .. attribute:: Address
+
+       The precomputed utilities.AddressObject.  This is shared by every
+       request built for the tag and must be treated as read only.
+    '''
+
+    def __init__(self, handle, name, address, scale=1.0, offset=0.0,
+                 pollClass=DEFAULT_POLL_CLASS):
+        ''' Compiles a tag from its configuration strings
+
+        :param handle: The integer handle of the tag
+        :param name: The symbolic name of the tag
+        :param address: The SLC address string (ie 'N7:0')
+        :param scale: The multiplier applied to raw values
+        :param offset: The offset added after scaling
+        :param pollClass: The poll group the tag belongs to
+        '''
+        self.handle = handle
+        self.name = name.strip()
+        self.address = address.strip()
+        self.scale = float(scale)
+        self.offset = float(offset)
+        self.pollClass = pollClass.strip() or DEFAULT_POLL_CLASS
+        self.Address = utilities.calcAddress(self.address)
+        if self.Address.fileType == 0:
+            raise ParameterException("Tag %s has an invalid address %s" %
+                                     (self.name, self.address))
+        self.dataType = DATA_TYPES.get(self.Address.fileType, 'int16')
+        if self.Address.bitNumber is not None:
+            self.dataType = 'bit'
+        self.scaled = (self.scale != 1.0 or self.offset != 0.0)
+
+    def byteRange(self):
+        ''' Returns the (start, end) byte offsets of the tag in its file
+
+        :returns: A tuple of the first and one past the last byte
+        '''
+        if self.Address.subElement > 0:
+            start = self.Address.eleNumber * ELEMENT_SIZE[self.Address.fileType]
+            start += self.Address.subElement * SUBELEMENT_SIZE[self.Address.fileType]
+            return (start, start + SUBELEMENT_SIZE[self.Address.fileType])
+        size = ELEMENT_SIZE[self.Address.fileType]
+        start = self.Address.eleNumber * size
+        return (start, start + size)
+
+    def fileKey(self):
+        ''' Returns the key identifying the data file of the tag '''
+        return (self.Address.fileType, self.Address.fileNumber)
+
+    def elementKey(self):
+        ''' Returns the key identifying the PLC element of the tag '''
+        return (self.Address.fileType, self.Address.fileNumber,
+                self.Address.eleNumber, self.Address.subElement)
+
+    def convert(self, value):
+        ''' Applies the tag scaling to a raw value
+
+        :param value: The raw value read from the PLC
+        :returns: The scaled value
+        '''
+        if self.scaled and not isinstance(value, str):
+            return value * self.scale + self.offset
+        return value
+
+    def __str__(self):
+        ''' Returns a string representation of the instance '''
+        return "Tag %d (%s, %s, %s)" % (self.handle, self.name,
+                                        self.address, self.dataType)
+
+
+#---------------------------------------------------------------------------#
+# Tag Dictionary
+#---------------------------------------------------------------------------#
+class TagDictionary(object):
+    ''' A compiled, validated collection of Tags addressed by handle
+    '''
+
+    def __init__(self):
+        ''' Initializes an empty dictionary '''
+        self.tags = []
+        self.__names = {}
+        self.__classes = {}
+        self.__elements = {}
+        self.header = []
+
+    def __len__(self):
+        return len(self.tags)
+
+    def __iter__(self):
+        return iter(self.tags)
+
+    def __getitem__(self, handle):
+        ''' Returns the Tag for a handle
+
+        :param handle: The integer tag handle
+        '''
+        return self.tags[handle]
+
+    @classmethod
+    def fromConfig(cls, config):
+        ''' Compiles the [SLC] section of the configuration
+
+        :param config: The utilities.optionReader to compile from
+        :returns: A validated TagDictionary
+        '''
+        tags = cls()
+        header = config.getLoggerHeader()
+        names = header[TIMESTAMP_COLUMNS:]
+        addresses = config.getPLCVariables()
+        if len(names) != len(addresses):
+            raise ParameterException("Header has %d tag names for %d Parameters" %
+                                     (len(names), len(addresses)))
+        scales = config.getTagOption('Scaling', len(addresses), '1')
+        offsets = config.getTagOption('Offsets', len(addresses), '0')
+        classes = config.getTagOption('PollClass', len(addresses), DEFAULT_POLL_CLASS)
+        for i in range(len(addresses)):
+            tags.add(names[i], addresses[i], scales[i], offsets[i], classes[i])
+
+        alarms = config.getPLCAlarms()
+        alarmNames = config.getTagOption('AlarmNames', len(alarms), '')
+        for i in range(len(alarms)):
+            name = alarmNames[i].strip()
+            if not name:
+                name = (DEFAULT_ALARM_NAMES[i] if i < len(DEFAULT_ALARM_NAMES)
+                        else 'Alarm%d' % i)
+            tags.add(name, alarms[i], pollClass=ALARM_POLL_CLASS)
+
+        if config.hasOption('SLC', 'Recipe'):
+            recipe = config.getPLCRecipe()
+            for i in range(len(recipe)):
+                tags.add('Recipe%d' % i, recipe[i], pollClass=RECIPE_POLL_CLASS)
+
+        if config.getPrefetchRecipeName():
+            tags.add(PREFETCH_TAG, config.getPrefetchRecipeName(),
+                     pollClass=PREFETCH_POLL_CLASS)
+
+        # Only the default poll class is logged, keep the header aligned
+        tags.header = [str(h).strip() for h in header[:TIMESTAMP_COLUMNS]]
+        tags.header += [tags[h].name for h in tags.pollClass(DEFAULT_POLL_CLASS)]
+        tags.validate()
+        return tags
+
+    def add(self, name, address, scale=1.0, offset=0.0, pollClass=DEFAULT_POLL_CLASS):
+        ''' Compiles and adds a new tag
+
+        :param name: The symbolic name of the tag
+        :param address: The SLC address string
+        :param scale: The multiplier applied to raw values
+        :param offset: The offset added after scaling
+        :param pollClass: The poll group the tag belongs to
+        :returns: The handle of the new tag
+        '''
+        name = name.strip()
+        if name in self.__names:
+            raise ParameterException("Duplicate tag name %s" % name)
+        tag = Tag(len(self.tags), name, address, scale, offset, pollClass)
+        self.tags.append(tag)
+        self.__names[name] = tag.handle
+        self.__classes.setdefault(tag.pollClass, []).append(tag.handle)
+        self.__elements.setdefault(tag.elementKey(), []).append(tag.handle)
+        return tag.handle
+
+    def validate(self):
+        ''' Checks that no two tags of the same poll class address
+        overlapping data.  Bit tags may share a word with other bit tags
+        as long as the bit numbers differ.
+
+        :raises ParameterException: If a duplicate or overlap is found
+        '''
+        seen = {}
+        for tag in self.tags:
+            seen.setdefault((tag.pollClass,) + tag.fileKey(), []).append(tag)
+
+        for group in seen.values():
+            for i in range(len(group)):
+                a = group[i]
+                startA, endA = a.byteRange()
+                for b in group[i+1:]:
+                    startB, endB = b.byteRange()
+                    if startA >= endB or startB >= endA:
+                        continue
+                    if (a.dataType == 'bit' and b.dataType == 'bit' and
+                            a.Address.bitNumber != b.Address.bitNumber):
+                        continue
+                    if a.address.upper() == b.address.upper():
+                        raise ParameterException("Duplicate address %s for tags %s and %s" %
+                                                 (a.address, a.name, b.name))
+                    raise ParameterException("Address %s of tag %s overlaps %s of tag %s" %
+                                             (a.address, a.name, b.address, b.name))
+
+    def lookup(self, name):
+        ''' Returns the handle for a tag name
+
+        :param name: The symbolic tag name
+        :returns: The integer handle, or None if unknown
+        '''
+        return self.__names.get(name.strip())
+
+    def locate(self, key):
+        ''' Returns the handles of every tag on a PLC element
+
+        :param key: A (fileType, fileNumber, eleNumber, subElement) tuple
+        :returns: A list of tag handles, empty if none match
+        '''
+        return self.__elements.get(key, [])
+
+    def pollClass(self, pollClass):
+        ''' Returns the handles of a poll class in configuration order
+
+        :param pollClass: The poll class name
+        :returns: A list of tag handles
+        '''
+        return self.__classes.get(pollClass, [])
+
+    def pollClasses(self):
+        ''' Returns the configured poll class names '''
+        return self.__classes.keys()
+
+    def getHeader(self):
+        ''' Returns the logger header columns '''
+        return self.header
+
+    def convert(self, handles, results):
+        ''' Applies tag scaling to the results of a poll
+
+        :param handles: The tag handles that were read
+        :param results: The list of records returned for each handle
+        :returns: The results with scaling applied
+        '''
+        tags = self.tags
+        converted = []
+        for i in range(len(results)):
+            tag = tags[handles[i]]
+            if tag.scaled and hasattr(results[i], '__iter__'):
+                converted.append([tag.convert(v) for v in results[i]])
+            elif tag.scaled:
+                converted.append(tag.convert(results[i]))
+            else:
+                converted.append(results[i])
+        return converted
+
+    #-----------------------------------------------------------------------#
+    # Request builders
+    #-----------------------------------------------------------------------#
+    def readRequest(self, handle, dest=1):
+        ''' Builds a read request for a tag using its compiled address
+
+        :param handle: The tag handle to read
+        :param dest: The PLC node address
+        '''
+        tag = self.tags[handle]
+        return protectedReadRequest(dest, tag.address, address=tag.Address)
+
+    def writeRequest(self, handle, values, dest=1):
+        ''' Builds a word write request for a tag
+
+        :param handle: The tag handle to write
+        :param values: The list of values to write
+        :param dest: The PLC node address
+        '''
+        tag = self.tags[handle]
+        return protectedWriteRequest(dest, tag.address, values, address=tag.Address)
+
+    def bitWriteRequest(self, handle, values, dest=1):
+        ''' Builds a bit write request for a tag
+
+        :param handle: The tag handle to write
+        :param values: The list of values to write
+        :param dest: The PLC node address
+        '''
+        tag = self.tags[handle]
+        return protectedBitWriteRequest(dest, tag.address, values, address=tag.Address)
+
+
+#---------------------------------------------------------------------------#
+# Tag Cache
+#---------------------------------------------------------------------------#
+class TagCache(object):
+    ''' Holds the latest value of every tag and routes updates to
+    subscribers.  Values arrive from the pollers and from PLC initiated
+    writes alike.
+    '''
+
+    def __init__(self, tags):
+        ''' Initializes an empty cache
+
+        :param tags: The compiled TagDictionary
+        '''
+        self.tags = tags
+        self.values = [None] * len(tags)
+        self.stamps = [0.0] * len(tags)
+        self.subscribers = []
+
+    def subscribe(self, callback):
+        ''' Registers a callback for updates
+
+        :param callback: Called as callback(results, handles, timestamp)
+        '''
+        self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        ''' Removes a previously registered callback '''
+        if callback in self.subscribers:
+            self.subscribers.remove(callback)
+
+    def update(self, results, handles, timestamp=None):
+        ''' Stores new values and notifies the subscribers
+
+        :param results: The list of records for each handle
+        :param handles: The tag handles the results belong to
+        :param timestamp: The unix time of the update (defaults to now)
+        :returns: The results, so this can be used as a callback
+        '''
+        if timestamp is None:
+            timestamp = time.time()
+        for i in range(len(handles)):
+            value = results[i]
+            if hasattr(value, '__iter__'):
+                value = value[0] if len(value) == 1 else value
+            self.values[handles[i]] = value
+            self.stamps[handles[i]] = timestamp
+        for callback in self.subscribers:
+            try:
+                callback(results, handles, timestamp)
+            except Exception, ex:
+                _logger.error("Tag cache subscriber failed: %s" % ex)
+        return results
+
+    def get(self, handle):
+        ''' Returns the latest value of a tag
+
+        :param handle: The tag handle
+        '''
+        return self.values[handle]
+
+    def snapshot(self, handles):
+        ''' Returns the latest values of several tags
+
+        :param handles: The tag handles in the order wanted
+        '''
+        values = self.values
+        return [values[h] for h in handles]
+
+
+#---------------------------------------------------------------------------#
+# Row Formatter
+#---------------------------------------------------------------------------#
+class RowFormatter(object):
+    ''' Formats logger rows with a format string compiled for the columns
+
+    Every column is written with %s, which gives exactly what str() gave
+    (floats keep their '.0', scaled tags whatever type scaling left), and
+    is cheaper than a per-type conversion.  The date is cached per day and
+    the time per second, so a row normally costs one tuple build and one
+    string format.
+    '''
+
+    def __init__(self, tags, handles):
+        ''' Compiles the row format
+
+        :param tags: The compiled TagDictionary
+        :param handles: The tag handles logged, in column order
+        '''
+        self.rowFormat = ','.join(['%s'] * len(handles)) + '\n'
+        self.columns = len(handles)
+        self.second = None
+        self.day = None
+        self.date = ''
+        self.prefix = ''
+        self.fallbacks = 0
+
+    def timePrefix(self, timestamp):
+        ''' Returns the 'mm/dd/YYYY,HH:MM:SS,' columns of a time '''
+        second = int(timestamp)
+        if second != self.second:
+            current = time.localtime(second)
+            day = current[:3]
+            if day != self.day:
+                self.day = day
+                self.date = time.strftime('%m/%d/%Y,', current)
+            self.second = second
+            self.prefix = '%s%02d:%02d:%02d,' % (self.date, current[3],
+                                                 current[4], current[5])
+        return self.prefix
+
+    def format(self, response, timestamp):
+        ''' Returns a complete CSV row
+
+        :param response: One value (or one record list) per column
+        :param timestamp: The unix time of the row
+        '''
+        values = []
+        for item in response:
+            if hasattr(item, '__iter__'):
+                # Records are flattened into the row like utilities.flatten
+                # does, only single values are unwrapped here
+                if type(item) is not list or len(item) != 1 or \
+                        hasattr(item[0], '__iter__'):
+                    return self.formatSlow(response, timestamp)
+                item = item[0]
+            values.append(item)
+        if len(values) == self.columns:
+            return self.timePrefix(timestamp) + self.rowFormat % tuple(values)
+        return self.formatSlow(response, timestamp)
+
+    def formatSlow(self, response, timestamp):
+        ''' Formats a row of unexpected shape or type the generic way '''
+        self.fallbacks += 1
+        return (self.timePrefix(timestamp) +
+                ','.join(map(str, utilities.flatten(response))) + '\n')
+
+
+#---------------------------------------------------------------------------#
+# Exported symbols
+#---------------------------------------------------------------------------#
+__all__ = [
+    "Tag", "TagDictionary", "TagCache", "RowFormatter",
+    "DEFAULT_POLL_CLASS", "ALARM_POLL_CLASS", "RECIPE_POLL_CLASS",
+    "PREFETCH_POLL_CLASS",
+]
@@ -0,0 +1,5 @@
+'''
+Unit tests, run from the df1 directory with::
+
+    trial tests
+'''
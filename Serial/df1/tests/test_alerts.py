@@ -0,0 +1,143 @@
+'''
+Alert deduplication, re-notification and batching, and the mail session
+timeout
+'''
+from twisted.trial import unittest
+from twisted.internet import defer, task
+from twisted.mail import smtp
+from twisted.test.proto_helpers import StringTransport
+
+from alerts import AlertDispatcher
+from emailclient import Mailer, MXCache
+
+BITS = [1, 2, 4, 8]
+
+
+class RecordingMailer(object):
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, mailFrom, mailTo, msg, subject=""):
+        self.sent.append(msg)
+        return defer.succeed(None)
+
+
+class AlertDispatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.mailer = RecordingMailer()
+        self.alerts = AlertDispatcher(self.mailer, 'rpi@plant.com', 'you@plant.com',
+                                      window=5, renotify=3600, intervals={8: 600},
+                                      clock=self.clock)
+
+    def poll(self, raised):
+        self.alerts.update(raised, BITS)
+
+    def testBatched(self):
+        self.poll({1: 'Hot'})
+        self.clock.advance(2)
+        self.poll({1: 'Hot', 2: 'Amps'})
+        self.assertEqual(self.mailer.sent, [])
+        self.clock.advance(3)
+        self.assertEqual(self.mailer.sent, ['Hot\nAmps\n'])
+
+    def testActiveAlarmSuppressedUntilRenotify(self):
+        self.poll({1: 'Hot'})
+        for i in range(10):
+            self.clock.advance(60)
+            self.poll({1: 'Hot'})
+        self.assertEqual(len(self.mailer.sent), 1)
+        self.assertEqual(self.alerts.getStats()['suppressed'], 10)
+        self.clock.advance(3000)
+        self.poll({1: 'Hot'})
+        self.clock.advance(5)
+        self.assertEqual(self.mailer.sent, ['Hot\n', 'Hot\n'])
+
+    def testOwnInterval(self):
+        self.poll({8: 'Speed'})
+        self.clock.advance(600)
+        self.poll({8: 'Speed'})
+        self.clock.advance(5)
+        self.assertEqual(self.mailer.sent, ['Speed\n', 'Speed\n'])
+
+    def testClearedAlarmReportedAgain(self):
+        self.poll({1: 'Hot'})
+        self.clock.advance(5)
+        self.poll({})
+        self.poll({1: 'Hot'})
+        self.clock.advance(5)
+        self.assertEqual(self.mailer.sent, ['Hot\n', 'Hot\n'])
+
+
+class Record(object):
+    def __init__(self, name):
+        self.name = name
+
+
+class CountingCalculator(object):
+
+    def __init__(self):
+        self.lookups = []
+
+    def getMX(self, domain):
+        d = defer.Deferred()
+        self.lookups.append(d)
+        return d
+
+
+class MXCacheTest(unittest.TestCase):
+
+    def testSharedLookupThenCached(self):
+        calculator = CountingCalculator()
+        cache = MXCache(ttl=3600, calculator=calculator)
+        hosts = []
+        cache.getMX('plant.com').addCallback(hosts.append)
+        cache.getMX('plant.com').addCallback(hosts.append)
+        self.assertEqual(len(calculator.lookups), 1)
+        calculator.lookups[0].callback(Record('mx.plant.com'))
+        cache.getMX('plant.com').addCallback(hosts.append)
+        self.assertEqual(hosts, ['mx.plant.com'] * 3)
+        self.assertEqual(cache.stats, {'hits': 1, 'lookups': 1})
+
+
+class PendingMX(object):
+    ''' Never answers, the test connects the session itself '''
+
+    def getMX(self, domain):
+        return defer.Deferred()
+
+
+class MailSessionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.mailer = Mailer(PendingMX(), timeout=30)
+        self.failures = []
+        for i in range(2):
+            d = self.mailer.send('rpi@plant.com', 'you@plant.com', 'Hot %d' % i)
+            d.addErrback(self.failures.append)
+        # Both messages wait for one session
+        self.assertEqual(len(self.mailer.sessions), 1)
+        self.session = self.mailer.sessions['plant.com']
+        self.assertEqual(len(self.session.queue), 2)
+
+    def testStalledServerTimesOut(self):
+        clock = task.Clock()
+        protocol = self.session.buildProtocol(None)
+        protocol.callLater = clock.callLater
+        transport = StringTransport()
+        protocol.makeConnection(transport)
+        clock.advance(30)
+        self.assertEqual([f.check(smtp.SMTPTimeoutError) for f in self.failures],
+                         [smtp.SMTPTimeoutError] * 2)
+        self.assertEqual(self.mailer.sessions, {})
+        self.assertTrue(transport.disconnecting)
+
+    def testLostBetweenMessages(self):
+        # The session closes while nothing is queued or in flight
+        self.session.queue = []
+        protocol = self.session.buildProtocol(None)
+        protocol.makeConnection(StringTransport())
+        protocol.connectionLost(None)
+        self.assertEqual(self.mailer.sessions, {})
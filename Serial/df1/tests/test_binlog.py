@@ -0,0 +1,38 @@
+'''
+The CSV export of a binary log
+'''
+import os
+import struct
+import time
+
+from twisted.trial import unittest
+
+from tags import TagDictionary
+from binlog import BinaryLogger, exportCSV
+
+
+class ExportCSVTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = self.mktemp()
+        os.makedirs(self.directory)
+        self.tags = TagDictionary()
+        self.handles = [self.tags.add('RecipeName', 'ST15:20'),
+                        self.tags.add('Line Speed', 'F8:11'),
+                        self.tags.add('Footage', 'N7:0'),
+                        self.tags.add('Tension', 'N7:1', scale=0.1)]
+
+    def testValuesAsLogged(self):
+        stamp = time.mktime((2026, 10, 18, 12, 0, 0, 0, 0, -1))
+        # 12.3 as the PLC's float32 decodes
+        speed = struct.unpack('<f', struct.pack('<f', 12.3))[0]
+        logger = BinaryLogger(self.directory, self.tags, self.handles)
+        logger.write([['R1'], [speed], [81234], [45.6]], stamp)
+        logger.write([['R1'], [speed], None, [45.6]], stamp + 1)
+        logger.close()
+        csvPath = os.path.join(self.directory, 'export.csv')
+        self.assertEqual(exportCSV(logger.path, csvPath), 2)
+        self.assertEqual(open(csvPath).read().splitlines(), [
+            'Date,Time,RecipeName,Line Speed,Footage,Tension',
+            '10/18/2026,12:00:00,R1,12.3,81234,45.6',
+            '10/18/2026,12:00:01,R1,12.3,nan,45.6'])
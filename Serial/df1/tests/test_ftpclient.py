@@ -0,0 +1,52 @@
+'''
+Binary mode of the FTP sessions
+'''
+from twisted.trial import unittest
+from twisted.test.proto_helpers import StringTransport
+
+from ftpclient import FTPClientA, FTPClientAFactory
+
+
+class BinaryModeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = FTPClientA(FTPClientAFactory())
+        self.transport = StringTransport()
+        self.client.makeConnection(self.transport)
+
+    def reply(self, line):
+        ''' Answers the command sent last and returns the next one sent '''
+        self.transport.clear()
+        self.client.dataReceived(line + '\r\n')
+        return self.transport.value()
+
+    def login(self, typeReply):
+        self.assertEqual(self.reply('220 ready'), 'USER anonymous\r\n')
+        self.assertEqual(self.reply('331 password'), 'PASS anonymous@\r\n')
+        self.assertEqual(self.reply('230 logged in'), 'TYPE I\r\n')
+        return self.reply(typeReply)
+
+    def testAcceptedAtLogin(self):
+        # A transfer started before login waits for the login's TYPE I
+        waited = []
+        self.client.binaryMode().addCallback(waited.append)
+        self.login('200 Type set to I')
+        self.assertEqual(waited, [None])
+        self.assertTrue(self.client.binary)
+        self.transport.clear()
+        self.client.binaryMode()
+        self.assertEqual(self.transport.value(), '')
+
+    def testRefusedAtLogin(self):
+        waited = []
+        self.client.binaryMode().addErrback(waited.append)
+        self.login('504 not now')
+        self.assertEqual(len(waited), 1)
+        self.assertFalse(self.client.binary)
+        # The next transfer asks again
+        done = []
+        self.client.binaryMode().addCallback(done.append)
+        self.assertEqual(self.transport.value(), 'TYPE I\r\n')
+        self.reply('200 Type set to I')
+        self.assertEqual(len(done), 1)
+        self.assertTrue(self.client.binary)
@@ -0,0 +1,164 @@
+'''
+FTP session reuse, queueing and retries against fake sessions
+'''
+from twisted.trial import unittest
+from twisted.internet import defer, error
+
+from ftppool import FTPSessionPool
+
+
+class FakeTransport(object):
+
+    def __init__(self, session):
+        self.session = session
+
+    def loseConnection(self):
+        self.session.connected = 0
+
+
+class FakeSession(object):
+    ''' The parts of FTPClientA the pool uses '''
+
+    def __init__(self, number):
+        self.number = number
+        self.connected = 1
+        self.commands = []
+        self.replies = {}
+        self.transport = FakeTransport(self)
+
+    def queueStringCommand(self, command):
+        self.commands.append(command)
+        return self.replies.get(command, defer.succeed(['200 OK']))
+
+    def quit(self):
+        self.commands.append('QUIT')
+        return defer.succeed(['221 Bye'])
+
+
+class FakeEndpoint(object):
+    ''' Connects a new FakeSession for every connect '''
+
+    def __init__(self):
+        self.sessions = []
+        self.failures = []
+
+    def connect(self, factory):
+        if self.failures:
+            return defer.fail(self.failures.pop(0))
+        self.sessions.append(FakeSession(len(self.sessions)))
+        return defer.succeed(self.sessions[-1])
+
+
+class FTPSessionPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.endpoint = FakeEndpoint()
+        self.pool = FTPSessionPool(self.endpoint, size=1, keepalive=0)
+        self.used = []
+
+    def transfer(self, session, result=None):
+        self.used.append(session.number)
+        return result
+
+    def testIdleSessionReused(self):
+        self.pool.run(self.transfer)
+        self.pool.run(self.transfer)
+        self.assertEqual(self.used, [0, 0])
+        self.assertEqual(len(self.endpoint.sessions), 1)
+        stats = self.pool.getStats()
+        self.assertEqual((stats['connects'], stats['reuses'], stats['transfers']), (1, 1, 2))
+        self.assertEqual((stats['idle'], stats['busy'], stats['waiting']), (1, 0, 0))
+
+    def testWaitingQueue(self):
+        # Queued transfers run in order once the busy one releases its session
+        pending = defer.Deferred()
+        first = self.pool.run(lambda session: self.transfer(session) or pending)
+        second = self.pool.run(self.transfer, 'second')
+        third = self.pool.run(self.transfer, 'third')
+        # One session, the other transfers wait for it in order
+        self.assertEqual(self.used, [0])
+        self.assertEqual(self.pool.getStats()['waiting'], 2)
+        pending.callback('first')
+        self.assertEqual([self.successResultOf(d) for d in (first, second, third)],
+                         ['first', 'second', 'third'])
+        self.assertEqual(self.used, [0, 0, 0])
+        self.assertEqual(len(self.endpoint.sessions), 1)
+        self.assertEqual(self.pool.getStats()['idle'], 1)
+
+    def testWaiterGetsNewSessionAfterDrop(self):
+        pending = defer.Deferred()
+
+        def dropping(session):
+            self.transfer(session)
+            return pending
+        self.pool.run(dropping)
+        second = self.pool.run(self.transfer, 'second')
+        # The busy session dies, the waiting transfer gets a new one
+        self.endpoint.sessions[0].connected = 0
+        pending.callback(None)
+        self.assertEqual(self.successResultOf(second), 'second')
+        self.assertEqual(self.used, [0, 1])
+        self.assertEqual(self.pool.getStats()['dropped'], 1)
+
+    def testDeadIdleSessionReplaced(self):
+        self.pool.run(self.transfer)
+        self.endpoint.sessions[0].connected = 0
+        self.pool.run(self.transfer)
+        self.assertEqual(self.used, [0, 1])
+        stats = self.pool.getStats()
+        self.assertEqual((stats['connects'], stats['dropped']), (2, 1))
+
+    def testKeepAlive(self):
+        self.pool.run(self.transfer)
+        self.pool.keepAlive()
+        self.assertEqual(self.endpoint.sessions[0].commands, ['NOOP'])
+        # A NOOP that fails drops the session
+        self.endpoint.sessions[0].replies['NOOP'] = defer.fail(IOError('reset'))
+        self.pool.keepAlive()
+        self.assertEqual(self.endpoint.sessions[0].connected, 0)
+        stats = self.pool.getStats()
+        self.assertEqual((stats['noops'], stats['dropped'], stats['idle']), (2, 1, 0))
+
+    def testSessionErrorRetriedOnce(self):
+        def failing(session):
+            self.transfer(session)
+            session.connected = 0
+            raise error.ConnectionLost()
+        d = self.pool.run(failing)
+        self.failureResultOf(d, error.ConnectionLost)
+        # The first attempt and one retry, each on a fresh session
+        self.assertEqual(self.used, [0, 1])
+        stats = self.pool.getStats()
+        self.assertEqual((stats['retries'], stats['failures'], stats['busy']), (1, 1, 0))
+
+    def testSessionErrorRetrySucceeds(self):
+        def flaky(session):
+            self.transfer(session)
+            if session.number == 0:
+                session.connected = 0
+                raise error.ConnectionDone()
+            return 'sent'
+        self.assertEqual(self.successResultOf(self.pool.run(flaky)), 'sent')
+        self.assertEqual(self.pool.getStats()['retries'], 1)
+
+    def testTransferErrorNotRetried(self):
+        def failing(session):
+            self.transfer(session)
+            raise IOError('550 No such file')
+        self.failureResultOf(self.pool.run(failing), IOError)
+        self.assertEqual(self.used, [0])
+        stats = self.pool.getStats()
+        self.assertEqual((stats['retries'], stats['failures'], stats['idle']), (0, 1, 1))
+
+    def testConnectFailureFreesSession(self):
+        self.endpoint.failures = [error.ConnectionRefusedError()]
+        first = self.pool.run(self.transfer)
+        self.failureResultOf(first, error.ConnectionRefusedError)
+        self.assertEqual(self.pool.getStats()['busy'], 0)
+        self.assertEqual(self.successResultOf(self.pool.run(self.transfer, 'ok')), 'ok')
+
+    def testCloseLogsOut(self):
+        self.pool.run(self.transfer)
+        self.pool.close()
+        self.assertEqual(self.endpoint.sessions[0].commands, ['QUIT'])
+        self.assertEqual(self.pool.getStats()['idle'], 0)
@@ -0,0 +1,116 @@
+'''
+Tag history ring buffers and rollups
+'''
+from twisted.trial import unittest
+
+import history
+from tags import TagDictionary
+
+if history.numpy is None:
+    skip = "TagHistory requires numpy"
+
+
+class RingBufferTest(unittest.TestCase):
+
+    def testWindowBeforeFull(self):
+        ring = history.RingBuffer(5)
+        for t in range(3):
+            ring.append(100 + t, t * 10)
+        times, values = ring.window(101)
+        self.assertEqual(list(times), [101, 102])
+        self.assertEqual(list(values[:, 0]), [10, 20])
+
+    def testWraparound(self):
+        ring = history.RingBuffer(4, 2)
+        for t in range(7):
+            ring.append(100 + t, t, -t)
+        self.assertEqual(ring.count, 4)
+        times, values = ring.window(0)
+        self.assertEqual(list(times), [103, 104, 105, 106])
+        self.assertEqual(values.tolist(), [[3, -3], [4, -4], [5, -5], [6, -6]])
+
+    def testWindowAcrossWrap(self):
+        ring = history.RingBuffer(4)
+        for t in range(6):
+            ring.append(100 + t, t)
+        # The window starts in the older run and ends in the newer one
+        self.assertEqual(list(ring.window(103)[0]), [103, 104, 105])
+        # Only the newer run
+        self.assertEqual(list(ring.window(104.5)[0]), [105])
+        self.assertEqual(ring.window(106)[0].shape, (0,))
+        self.assertEqual(ring.window(106)[1].shape, (0, 1))
+
+    def testWindowIsCopy(self):
+        ring = history.RingBuffer(3)
+        ring.append(1, 1)
+        times, values = ring.window(0)
+        ring.append(2, 2)
+        ring.append(3, 3)
+        ring.append(4, 4)
+        self.assertEqual(list(times), [1])
+        self.assertEqual(list(values[:, 0]), [1])
+
+
+class RollupTest(unittest.TestCase):
+
+    def testMinMaxMean(self):
+        rollup = history.Rollup(60, 10)
+        for t, value in ((0, 4.0), (10, 1.0), (59, 7.0), (60, 2.0), (119, 6.0)):
+            rollup.add(1200 + t, value)
+        rollup.add(1200 + 120, 5.0)
+        times, values = rollup.ring.window(0)
+        self.assertEqual(list(times), [1200, 1260])
+        self.assertEqual(values.tolist(), [[1, 7, 4], [2, 6, 4]])
+
+    def testOpenBucketInWindow(self):
+        rollup = history.Rollup(60, 10)
+        rollup.add(1200, 3.0)
+        rollup.add(1260, 1.0)
+        rollup.add(1290, 2.0)
+        times, values = rollup.window(0)
+        self.assertEqual(list(times), [1200, 1260])
+        self.assertEqual(values.tolist(), [[3, 3, 3], [1, 2, 1.5]])
+        # The open bucket started before the window but reaches into it
+        times, values = rollup.window(1300)
+        self.assertEqual(list(times), [1260])
+        # A finished bucket that ended before the window is left out
+        self.assertEqual(list(rollup.window(1320)[0]), [])
+
+
+class TagHistoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tags = TagDictionary()
+        self.speed = self.tags.add('Speed', 'F8:0')
+        self.recipe = self.tags.add('Recipe', 'ST15:0')
+        self.history = history.TagHistory(self.tags, [self.speed, self.recipe],
+                                          rawSize=10, seconds=10, minutes=10, hours=10)
+
+    def testStringsNotKept(self):
+        self.assertEqual(self.history.series.keys(), [self.speed])
+        self.assertRaises(history.ParameterException, self.history.query,
+                          self.recipe, 1)
+
+    def testRawQuery(self):
+        for t in range(5):
+            self.history.record([[t * 1.5], ['RG6']], [self.speed, self.recipe], 1000 + t)
+        times, values = self.history.query(self.speed, 1, now=1062)
+        self.assertEqual(list(times), [1002, 1003, 1004])
+        self.assertEqual(list(values), [3.0, 4.5, 6.0])
+
+    def testRollupQueryIncludesOpenBucket(self):
+        for t, value in ((0, 10), (30, 20), (60, 5), (90, 15)):
+            self.history.record([[value], ['RG6']], [self.speed, self.recipe], 3600 + t)
+        times, mins, maxs, means = self.history.query(self.speed, 2, period=60, now=3700)
+        self.assertEqual(list(times), [3600, 3660])
+        self.assertEqual(list(mins), [10, 5])
+        self.assertEqual(list(maxs), [20, 15])
+        self.assertEqual(list(means), [15, 10])
+        # The hour has not finished, its bucket is still open
+        times, mins, maxs, means = self.history.query(self.speed, 15, period=3600, now=3700)
+        self.assertEqual(list(times), [3600])
+        self.assertEqual((mins[0], maxs[0], means[0]), (5, 20, 12.5))
+
+    def testUnknownPeriod(self):
+        self.assertRaises(history.ParameterException, self.history.query,
+                          self.speed, 1, period=300)
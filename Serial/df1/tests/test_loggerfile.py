@@ -0,0 +1,47 @@
+'''
+Time range reads across daily logs
+'''
+import os
+import time
+
+from twisted.trial import unittest
+
+from loggerfile import DailyLogger
+
+HEADER = ['Date', 'Time', 'Value']
+
+
+def stamp(*args):
+    return time.mktime(args + (0, 0, -1))
+
+
+class GetRangeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = self.mktemp()
+        os.makedirs(self.directory)
+        # Hourly rows over three days
+        for day in (16, 17, 18):
+            fObj = open(os.path.join(self.directory, '2010%02d00.csv' % day), 'w')
+            fObj.write(','.join(HEADER) + '\n')
+            for hour in range(24):
+                fObj.write('10/%02d/2020,%02d:00:00,%d\n' % (day, hour, day * 100 + hour))
+            fObj.close()
+        self.logger = DailyLogger('current.csv', self.directory, header=HEADER,
+                                  indexEvery=0)
+        self.addCleanup(self.logger.close)
+
+    def values(self, start, end):
+        return [int(row.split(',')[2]) for row in self.logger.getRange(start, end)]
+
+    def testWithinDay(self):
+        self.assertEqual(self.values(stamp(2020, 10, 17, 10, 0, 0), stamp(2020, 10, 17, 12, 0, 0)),
+                         [1710, 1711, 1712])
+
+    def testAcrossMidnight(self):
+        self.assertEqual(self.values(stamp(2020, 10, 17, 22, 0, 0), stamp(2020, 10, 18, 1, 30, 0)),
+                         [1722, 1723, 1800, 1801])
+
+    def testLongerThanADay(self):
+        values = self.values(stamp(2020, 10, 16, 23, 0, 0), stamp(2020, 10, 18, 0, 0, 0))
+        self.assertEqual(values, [1623] + range(1700, 1724) + [1800])
@@ -0,0 +1,55 @@
+'''
+Per day OEE summaries of a night shift crossing midnight
+'''
+import os
+
+from twisted.trial import unittest
+
+from oeesummary import summarizeDirectory
+
+HEADER = 'Date,Time,RecipeName,Footage,Up Minutes\n'
+
+
+def writeDay(path, date, clocks, start):
+    ''' Writes one row a minute, the counters rising by one each row '''
+    fObj = open(path, 'w')
+    fObj.write(HEADER)
+    for i, clock in enumerate(clocks):
+        fObj.write('%s,%s,R1,%d,%d\n' % (date, clock, start + i, start + i))
+    fObj.close()
+
+
+def readSummary(path):
+    ''' Returns the {(kind, key): record} of a summary file '''
+    lines = open(path, 'r').read().splitlines()[1:]
+    return dict(((f[0], f[1]), f) for f in (line.split(',') for line in lines))
+
+
+class SummarizeDirectoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = self.mktemp()
+        os.makedirs(self.directory)
+        # 23:50 to 00:10, within the 22:00 shift of the first day
+        writeDay(os.path.join(self.directory, '26101800.csv'), '10/18/2026',
+                 ['23:%02d:00' % m for m in range(50, 60)], 0)
+        writeDay(os.path.join(self.directory, '26101900.csv'), '10/19/2026',
+                 ['00:%02d:00' % m for m in range(0, 11)], 10)
+
+    def testNightShiftReportedWithItsStartDay(self):
+        written = summarizeDirectory(self.directory, shifts=['06:00', '14:00', '22:00'])
+        self.assertEqual(map(os.path.basename, written),
+                         ['26101800.oee.csv', '26101900.oee.csv'])
+        first, second = map(readSummary, written)
+        shift = first[('shift', '2026-10-18 S3')]
+        # 20 minutes logged, midnight included, in one record
+        self.assertEqual(shift[4:7], ['21', '20.0', '20.0'])
+        self.assertEqual([key for key in second if key[0] == 'shift'], [])
+        # The minute up to 00:00 is counted in the new day
+        self.assertEqual(second[('hour', '2026-10-19 00:00')][5], '11.0')
+
+    def testRecentDays(self):
+        written = summarizeDirectory(self.directory, days=1,
+                                     shifts=['06:00', '14:00', '22:00'])
+        self.assertEqual(map(os.path.basename, written), ['26101900.oee.csv'])
+        self.assertFalse(os.path.exists(os.path.join(self.directory, '26101800.oee.csv')))
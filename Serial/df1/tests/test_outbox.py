@@ -0,0 +1,120 @@
+'''
+The upload outbox across log compression and retention
+'''
+import os
+
+from twisted.trial import unittest
+from twisted.internet import defer
+
+from loggerfile import LogCatalog, compressLog
+from outbox import UploadOutbox
+from ftpclient import sendArchive
+
+DAY = '26101800.csv'
+
+
+class RecordingPool(object):
+    ''' Runs nothing, records each transfer and reports it as sent '''
+
+    def __init__(self):
+        self.calls = []
+        # Answer like sendLogData after the server's size didn't match
+        self.restart = False
+
+    def run(self, f, localFile, remoteFile, *args):
+        if f is sendArchive:
+            self.calls.append((os.path.basename(localFile), remoteFile))
+            return defer.succeed(os.path.getsize(localFile))
+        start, end = args[:2]
+        self.calls.append((os.path.basename(localFile), remoteFile, start, end))
+        if self.restart:
+            return defer.succeed((0, end))
+        return defer.succeed((start, end - start))
+
+
+class UploadOutboxTest(unittest.TestCase):
+
+    def setUp(self):
+        self.localDir = self.mktemp()
+        os.makedirs(self.localDir)
+        self.path = os.path.join(self.localDir, DAY)
+        open(self.path, 'w').write('Date,Time,Value\n' + '10/18/2026,12:00:00,1.5\n' * 200)
+        self.size = os.path.getsize(self.path)
+        self.catalog = LogCatalog(self.localDir)
+        self.pool = RecordingPool()
+        self.uploaded = []
+        self.outbox = self.create()
+
+    def create(self):
+        return UploadOutbox(self.pool, self.localDir, 'logs',
+                            os.path.join(self.localDir, 'outbox.idx'),
+                            markUploaded=lambda *args: self.uploaded.append(args),
+                            maxChunk=0, catalog=self.catalog)
+
+    def testPlainDay(self):
+        self.outbox.add(DAY, 0, self.size)
+        self.outbox.kick()
+        self.assertEqual(self.pool.calls, [(DAY, 'logs/' + DAY, 0, self.size)])
+        self.assertEqual(self.uploaded, [(DAY, self.size)])
+        self.assertEqual(self.outbox.jobs, [])
+
+    def compress(self):
+        archive = compressLog(self.path, 'gzip')
+        self.catalog.rename(DAY, os.path.basename(archive))
+
+    def testDayCompressedWhileQueued(self):
+        # Nothing was sent yet, the smaller archive goes up as stored
+        self.outbox.add(DAY, 0, self.size)
+        self.compress()
+        self.outbox.kick()
+        self.assertEqual(self.pool.calls, [(DAY + '.gz', 'logs/' + DAY + '.gz')])
+        self.assertEqual(self.uploaded, [(DAY + '.gz', self.size)])
+        self.assertEqual(self.outbox.jobs, [])
+        self.assertEqual(self.outbox.getStats()['archives'], 1)
+
+    def testTailOfCompressedDay(self):
+        # The server has most of the day, its plain tail is appended
+        self.outbox.add(DAY, self.size - 50, self.size)
+        self.compress()
+        self.outbox.kick()
+        self.assertEqual(self.pool.calls, [(DAY + '.gz', 'logs/' + DAY,
+                                            self.size - 50, self.size)])
+        self.assertEqual(self.outbox.jobs, [])
+
+    def testDayRemovedByRetention(self):
+        self.outbox.add(DAY, 0, self.size)
+        self.catalog.remove(DAY)
+        os.remove(self.path)
+        self.outbox.kick()
+        self.assertEqual(self.pool.calls, [])
+        self.assertEqual(self.outbox.jobs, [])
+
+    def testClosePersistsQueue(self):
+        self.outbox.add(DAY, 0, self.size)
+        self.outbox.jobs[0].start = 100
+        self.outbox.close()
+        jobs = self.create().jobs
+        self.assertEqual([(job.name, job.start, job.end) for job in jobs],
+                         [(DAY, 100, self.size)])
+
+    def testSummaryQueuedWhole(self):
+        # A summary is stored under its own name and never merged with,
+        # or checkpointed as, the day it summarizes
+        summary = DAY[:8] + '.oee.csv'
+        open(os.path.join(self.localDir, summary), 'w').write('Kind,Key\n')
+        self.outbox.add(DAY, 0, self.size)
+        self.outbox.addFile(summary)
+        self.assertEqual([job.name for job in self.outbox.jobs], [DAY, summary])
+        self.outbox.jobs.reverse()
+        self.outbox.kick()
+        self.outbox.close()
+        self.assertEqual(self.pool.calls, [(summary, 'logs/' + summary)])
+        self.assertEqual(self.uploaded, [])
+        self.assertEqual([job.name for job in self.outbox.jobs], [DAY])
+
+    def testRestartCounted(self):
+        self.pool.restart = True
+        self.outbox.add(DAY, 100, self.size)
+        self.outbox.kick()
+        self.assertEqual(self.uploaded, [(DAY, self.size)])
+        self.assertEqual(self.outbox.getStats()['restarts'], 1)
@@ -0,0 +1,83 @@
+'''
+Recipe name prefetching against a recipe store on disk
+'''
+import os
+import time
+
+from twisted.trial import unittest
+
+from recipesync import FAMILIES_NAME
+from recipestore import RecipeStore
+from prefetch import RecipePrefetcher
+
+NAME_TAG = 7
+
+
+class RecipePrefetcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = self.mktemp()
+        os.makedirs(self.directory)
+        self.writeRecipes('RG6-1234,1,2\nRG6-5678,3,4\n')
+        self.store = RecipeStore(self.directory, compiler=lambda recipe: recipe.values)
+        self.prefetch = RecipePrefetcher(self.store, [NAME_TAG])
+
+    def writeRecipes(self, lines):
+        open(os.path.join(self.directory, FAMILIES_NAME), 'w').write('RG6\n')
+        open(os.path.join(self.directory, 'RG6.csv'), 'w').write(lines)
+
+    def read(self, name, timestamp=None):
+        ''' Delivers a poll of the name tag like the TagCache does '''
+        self.prefetch.update([[0], [name]], [3, NAME_TAG], timestamp or time.time())
+
+    def testNameChange(self):
+        self.read('RG6-1234\x00\x00')
+        self.assertEqual(self.prefetch.current().name, 'RG6-1234')
+        # The same name again is not resolved again
+        self.read('RG6-1234')
+        self.read('RG6-5678')
+        self.assertEqual(self.prefetch.current().values, (3.0, 4.0))
+        stats = self.prefetch.getStats()
+        self.assertEqual((stats['changes'], stats['resolved'], stats['used']), (2, 2, 2))
+        self.assertEqual(stats['name'], 'RG6-5678')
+
+    def testOtherTagsIgnored(self):
+        self.prefetch.update([['RG6-1234']], [3], time.time())
+        self.assertIdentical(self.prefetch.current(), None)
+        self.assertEqual(self.prefetch.getStats()['changes'], 0)
+
+    def testUnknownName(self):
+        self.read('RG7-0001')
+        self.assertIdentical(self.prefetch.current(), None)
+        self.assertEqual(self.prefetch.getStats()['misses'], 1)
+
+    def testStaleName(self):
+        self.read('RG6-1234', time.time() - 60)
+        self.assertIdentical(self.prefetch.current(maxAge=30), None)
+        self.assertEqual(self.prefetch.current(maxAge=90).name, 'RG6-1234')
+        # A new read of the same name makes it fresh again
+        self.read('RG6-1234')
+        self.assertEqual(self.prefetch.current(maxAge=30).name, 'RG6-1234')
+
+    def testUncompiledRecipe(self):
+        self.store.compiler = None
+        self.store.load()
+        self.read('RG6-1234')
+        self.assertIdentical(self.prefetch.current(), None)
+
+    def testRefreshAfterReload(self):
+        self.read('RG6-9999')
+        self.assertIdentical(self.prefetch.current(), None)
+        # The download brings the recipe, the store is reloaded
+        self.writeRecipes('RG6-1234,1,2\nRG6-9999,5,6\n')
+        self.store.load()
+        self.assertIdentical(self.prefetch.current(), None)
+        self.prefetch.refresh()
+        self.assertEqual(self.prefetch.current().values, (5.0, 6.0))
+
+    def testRefreshDropsRemovedRecipe(self):
+        self.read('RG6-5678')
+        self.writeRecipes('RG6-1234,1,2\n')
+        self.store.load()
+        self.prefetch.refresh()
+        self.assertIdentical(self.prefetch.current(), None)
@@ -0,0 +1,135 @@
+'''
+Recipe loads against replies decoded by the real framers and decoders
+'''
+from twisted.trial import unittest
+from twisted.internet import defer, task
+from twisted.test.proto_helpers import StringTransport
+
+from async import SerialClientProtocol
+from transaction import AsciiFramer
+from mtrimfactory import MTrimClientDecoder
+from mtrimcodec import decodeResponse
+from df1commands import Command_0F_Response
+from recipeplan import PlanCompiler
+from recipestore import Recipe
+from recipeload import RecipeLoad, RecipeLoadError
+
+
+def connect(protocol):
+    ''' Connects a protocol to a string transport, its timeouts to a Clock '''
+    protocol.callLater = task.Clock().callLater
+    protocol.makeConnection(StringTransport())
+    return protocol
+
+
+class RecipeLoadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.plan = PlanCompiler(['N7:10', 'F8:20'])(
+            Recipe('RG6', 'RG', (12.0, 2.5, 100.0, 1.5, -0.25)))
+        self.plc = connect(SerialClientProtocol())
+        self.mtrim = connect(SerialClientProtocol(AsciiFramer(MTrimClientDecoder())))
+        self.plcStatus = []
+        self.plcReplies = []
+        self.clock = task.Clock()
+
+    def plcSend(self, request):
+        ''' Sends a write and answers it like the SLC: a 0x4F reply without data '''
+        d = self.plc.sendCommand(request)
+        sts = self.plcStatus.pop(0) if self.plcStatus else 0
+        reply = Command_0F_Response(request, dest=0, src=1, sts=sts)
+        reply.transaction_id = request.transaction_id
+        self.plc.dataReceived(reply.encode())
+        return d.addCallback(self.plcReplies.append).addCallback(lambda _: self.plcReplies[-1])
+
+    def mtrimSend(self, request):
+        d = self.mtrim.sendCommand(request)
+        self.mtrim.dataReceived('\x02%02d@%02d00000\x03' % (request.address, request.parameter))
+        return d
+
+    def mtrimReply(self, request, code):
+        ''' Decodes an MTrim reply to a write carrying the given error code '''
+        return decodeResponse('\x02%02d%s%02d00000\x03' % (request.address, code,
+                                                           request.parameter))
+
+    def testWriteAcknowledged(self):
+        load = RecipeLoad(self.plan, self.plcSend, self.mtrimSend)
+        d = load.start()
+
+        def check(result):
+            self.assertIdentical(result, load)
+            self.assertEqual(load.failed(), [])
+            self.assertEqual([item.attempts for item in load.items()], [1] * 5)
+            # The decoded acknowledgements carry no records
+            self.assertEqual([reply.records for reply in self.plcReplies], [None, None])
+        return d.addCallback(check)
+
+    def testErrorStatusRetried(self):
+        # The first write is answered with STS 0x10, its retry succeeds
+        self.plcStatus = [0x10]
+        sent = []
+
+        def send(request):
+            sent.append(request.frame.parameter)
+            sts = self.plcStatus.pop(0) if self.plcStatus else 0
+            return defer.succeed(Command_0F_Response(request, sts=sts))
+        load = RecipeLoad(self.plan, send, self.mtrimSend)
+
+        def check(result):
+            self.assertEqual(sent, ['N7:10', 'F8:20', 'N7:10'])
+            self.assertEqual(load.failed(), [])
+        return load.start().addCallback(check)
+
+    def testFailedWrite(self):
+        load = RecipeLoad(self.plan, lambda request: defer.fail(IOError('link down')),
+                          self.mtrimSend, retries=1)
+        d = self.assertFailure(load.start(), RecipeLoadError)
+
+        def check(error):
+            self.assertEqual([item.name for item in load.failed()], ['N7:10', 'F8:20'])
+            self.assertEqual([item.attempts for item in load.failed()], [2, 2])
+        return d.addCallback(check)
+
+    def testMTrimErrorCodeRetried(self):
+        # The first MTrim write is answered with error code 'A', its retry
+        # succeeds; a reply with an error code is not an acknowledgement
+        codes = ['A']
+        replies = []
+
+        def send(request):
+            replies.append(self.mtrimReply(request, codes.pop(0) if codes else '@'))
+            return defer.succeed(replies[-1])
+        load = RecipeLoad(self.plan, self.plcSend, send)
+
+        def check(result):
+            self.assertEqual(replies[0].errorCode, 'A')
+            self.assertEqual([item.attempts for item in load.links['MTrim'][1]], [2, 1, 1])
+            self.assertEqual(load.failed(), [])
+        return load.start().addCallback(check)
+
+    def testMTrimErrorCodeFails(self):
+        load = RecipeLoad(self.plan, self.plcSend,
+                          lambda request: defer.succeed(self.mtrimReply(request, 'A')),
+                          retries=1)
+        d = self.assertFailure(load.start(), RecipeLoadError)
+
+        def check(error):
+            self.assertEqual([item.name for item in load.failed()], ['P1', 'P20', 'P21'])
+            self.assertEqual([item.attempts for item in load.failed()], [2, 2, 2])
+        return d.addCallback(check)
+    def testUnansweredWriteTimesOut(self):
+        # The SLC never answers, each attempt times out on the load's clock
+        load = RecipeLoad(self.plan, lambda request: defer.Deferred(),
+                          self.mtrimSend, retries=1, timeout=5, clock=self.clock)
+        d = self.assertFailure(load.start(), RecipeLoadError)
+        self.clock.advance(5)
+        self.clock.advance(5)
+        self.clock.advance(5)
+        self.clock.advance(5)
+
+        def check(error):
+            self.assertEqual([item.attempts for item in load.failed()], [2, 2])
+            self.assertEqual([item.elapsed for item in load.failed()], [10, 10])
+            self.assertEqual(load.elapsed, 20)
+            self.assertFalse(self.clock.getDelayedCalls())
+        return d.addCallback(check)
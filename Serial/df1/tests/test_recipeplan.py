@@ -0,0 +1,54 @@
+'''
+Compiled recipe frames against the request encoders
+'''
+import warnings
+
+from twisted.trial import unittest
+
+from recipeplan import PlanCompiler
+from recipestore import Recipe
+from df1commands import protectedWriteRequest
+from MTrimCommands import ParameterSendRequest
+
+ADDRESSES = ['N7:10', 'F8:2', 'N7:16', 'F8:16', 'N10:43', 'F16:10', 'N7:300', 'B3:6/0']
+RECIPES = [
+    (1, 2.5, 16, 16.0, 4112, -3.25, 5, 1, 12.5, 1.25, -0.5),
+    (0, 0.1, 0x1010, 1e6, -1, 16.0625, 0x10, 0, 999, 12, 3),
+]
+# Transaction ids whose bytes are DLEs and have to be escaped
+TIDS = [0, 1, 0x10, 0x1010, 0x0110, 0x1000, 4096, 65535]
+
+
+class RecipePlanTest(unittest.TestCase):
+
+    def setUp(self):
+        self.compiler = PlanCompiler(ADDRESSES)
+
+    def testPLCFramesMatchEncoder(self):
+        for values in RECIPES:
+            plan = self.compiler(Recipe('RG6', 'RG', tuple(float(v) for v in values)))
+            for tid in TIDS:
+                for frame in plan.plcWrites:
+                    request = frame.request()
+                    request.transaction_id = tid
+                    reference = protectedWriteRequest(1, frame.parameter, [frame.value])
+                    reference.transaction_id = tid
+                    with warnings.catch_warnings():
+                        warnings.simplefilter('ignore')
+                        expected = reference.encode()
+                    self.assertEqual(request.encode(), expected,
+                                     "%s=%s tid %d" % (frame.parameter, frame.value, tid))
+
+    def testMTrimFramesMatchEncoder(self):
+        for values in RECIPES:
+            plan = self.compiler(Recipe('RG6', 'RG', tuple(float(v) for v in values)))
+            for frame, parameter, value in zip(plan.mtrimWrites, (1, 20, 21), values[-3:]):
+                self.assertEqual(frame.request().encode(),
+                                 ParameterSendRequest(1, parameter, float(value)).encode())
+
+    def testTooFewValues(self):
+        self.assertRaises(ValueError, self.compiler, Recipe('RG6', 'RG', (1.0, 2.0)))
+
+    def testNoPLCAddresses(self):
+        self.assertRaises(ValueError, PlanCompiler, [])
+        self.assertRaises(ValueError, PlanCompiler, [' ', ''])
@@ -0,0 +1,78 @@
+'''
+Recipe directory parsing and lookups
+'''
+import os
+
+from twisted.trial import unittest
+
+from recipesync import FAMILIES_NAME
+from recipestore import RecipeStore, recipeKey
+
+
+class RecipeStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = self.mktemp()
+        os.makedirs(self.directory)
+        self.write(FAMILIES_NAME, 'RG6\n\nRG11\nQR540\n')
+        self.write('RG6.csv', 'Name,Speed,Length\n'
+                              'RG6-1234,1,2.5\n'
+                              ' RG6-5678 ,3,-4\n'
+                              '\n'
+                              ',9,9\n'
+                              'RG6-BAD,1,x\n')
+        self.write('RG11.csv', 'RG11-0001,7\r\n')
+
+    def write(self, name, data):
+        open(os.path.join(self.directory, name), 'w').write(data)
+
+    def testParse(self):
+        store = RecipeStore(self.directory)
+        self.assertEqual(len(store), 3)
+        recipe = store.get('RG6-1234')
+        self.assertEqual((recipe.name, recipe.family, recipe.values),
+                         ('RG6-1234', 'RG6', (1.0, 2.5)))
+        self.assertEqual(store.get('RG6-5678').values, (3.0, -4.0))
+        self.assertEqual(store.get('RG11-0001').values, (7.0,))
+        self.assertIdentical(recipe.plan, None)
+
+    def testSkippedLines(self):
+        # The header and the malformed line are skipped, blank lines and
+        # lines without a name are not counted
+        store = RecipeStore(self.directory)
+        self.assertFalse('Name' in store)
+        self.assertFalse('RG6-BAD' in store)
+        stats = store.getStats()
+        self.assertEqual((stats['loads'], stats['recipes'], stats['skipped']), (1, 3, 2))
+
+    def testPaddedNames(self):
+        store = RecipeStore(self.directory)
+        self.assertEqual(recipeKey('RG6-1234\x00\x00\x00'), 'RG6-1234')
+        self.assertEqual(recipeKey(' RG6-1234 \x00'), 'RG6-1234')
+        self.assertEqual(store.get('RG6-1234\x00\x00').name, 'RG6-1234')
+        self.assertTrue('RG6-5678\x00' in store)
+        self.assertIdentical(store.get('RG6-0000\x00'), None)
+        stats = store.getStats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def testCompiler(self):
+        def compiler(recipe):
+            if len(recipe.values) < 2:
+                raise ValueError("Recipe %s is too short" % recipe.name)
+            return ('plan', recipe.name)
+        store = RecipeStore(self.directory, compiler)
+        self.assertEqual(store.get('RG6-1234').plan, ('plan', 'RG6-1234'))
+        # A recipe that doesn't compile is kept without a plan
+        self.assertIdentical(store.get('RG11-0001').plan, None)
+
+    def testReload(self):
+        store = RecipeStore(self.directory)
+        self.write('RG11.csv', 'RG11-0002,8\n')
+        self.assertEqual(store.load(), 3)
+        self.assertFalse('RG11-0001' in store)
+        self.assertEqual(store.get('RG11-0002').values, (8.0,))
+
+    def testMissingFiles(self):
+        self.assertEqual(len(RecipeStore(os.path.join(self.directory, 'none'))), 0)
+        os.remove(os.path.join(self.directory, 'RG6.csv'))
+        self.assertEqual(len(RecipeStore(self.directory)), 1)
@@ -0,0 +1,48 @@
+'''
+Recipe bundle verification and unpacking
+'''
+import os
+import tarfile
+
+from twisted.trial import unittest
+
+from recipesync import RecipeSync, ChecksumError, fileDigest, FAMILIES_NAME
+
+BUNDLE = 'recipes.tar.gz'
+
+
+class RecipeBundleTest(unittest.TestCase):
+
+    def setUp(self):
+        self.localDir = self.mktemp()
+        os.makedirs(os.path.join(self.localDir, 'src', 'RG'))
+        files = {FAMILIES_NAME: 'RG6\n', 'RG/RG6.csv': 'RG6-1234,1,2.5,3\n'}
+        archive = tarfile.open(os.path.join(self.localDir, BUNDLE + '.tmp'), 'w:gz')
+        for name, data in files.items():
+            path = os.path.join(self.localDir, 'src', name)
+            open(path, 'w').write(data)
+            archive.add(path, name)
+        archive.close()
+        self.digest = fileDigest(os.path.join(self.localDir, BUNDLE + '.tmp'))
+        self.sync = RecipeSync(None, self.localDir, bundle=BUNDLE)
+        self.sync.stats = {'fetched': 0, 'skipped': 0, 'failed': 0, 'bytes': 0}
+
+    def testInstall(self):
+        def check(_):
+            self.assertEqual(self.sync.stats['fetched'], 2)
+            self.assertEqual(self.sync.manifest[BUNDLE], ('sha256', self.digest))
+            # Archive paths are flattened into the recipe directory
+            self.assertEqual(open(os.path.join(self.localDir, 'RG6.csv')).read(),
+                             'RG6-1234,1,2.5,3\n')
+            self.assertTrue(os.path.exists(os.path.join(self.localDir, FAMILIES_NAME)))
+        return self.sync.installBundle(self.digest).addCallback(check)
+
+    def testChecksumMismatch(self):
+        d = self.assertFailure(self.sync.installBundle('0' * 64), ChecksumError)
+
+        def check(_):
+            self.assertNotIn(BUNDLE, self.sync.manifest)
+            self.assertFalse(os.path.exists(os.path.join(self.localDir, FAMILIES_NAME)))
+            self.sync.discardBundle(None)
+            self.assertFalse(os.path.exists(os.path.join(self.localDir, BUNDLE + '.tmp')))
+        return d.addCallback(check)
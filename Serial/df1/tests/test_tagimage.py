@@ -0,0 +1,42 @@
+'''
+The shared tag image across writer restarts
+'''
+import os
+
+from twisted.trial import unittest
+
+from tags import TagDictionary
+from tagimage import TagImageWriter, TagImageReader
+
+
+class TagImageTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = self.mktemp()
+        os.makedirs(directory)
+        self.path = os.path.join(directory, 'tags')
+        self.tags = TagDictionary()
+        self.speed = self.tags.add('Line Speed', 'F8:11')
+        self.recipe = self.tags.add('RecipeName', 'ST15:20')
+        self.writer = TagImageWriter(self.path, self.tags)
+        self.reader = TagImageReader(self.path)
+        self.addCleanup(self.reader.close)
+
+    def testUnset(self):
+        stamp, values = self.reader.snapshot()
+        self.assertNotEqual(values['Line Speed'], values['Line Speed'])
+        self.assertIdentical(values['RecipeName'], None)
+        self.writer.publish([[0.0], ['RG6']], [self.speed, self.recipe], 10.0)
+        self.assertEqual(self.reader.snapshot(), (10.0, {'Line Speed': 0.0,
+                                                         'RecipeName': 'RG6'}))
+        self.writer.close()
+
+    def testWriterRestarted(self):
+        self.writer.publish([[12.5]], [self.speed], 10.0)
+        self.assertEqual(self.reader.snapshot()[1]['Line Speed'], 12.5)
+        self.writer.close()
+        writer = TagImageWriter(self.path, self.tags)
+        writer.publish([[20.0]], [self.speed], 20.0)
+        stamp, values = self.reader.snapshot()
+        self.assertEqual((stamp, values['Line Speed']), (20.0, 20.0))
+        writer.close()
@@ -0,0 +1,166 @@
+'''
+Tag dictionary compilation and logger row formatting
+'''
+import os
+import time
+from ConfigParser import SafeConfigParser
+
+from twisted.trial import unittest
+
+import utilities
+import tags
+from serialexceptions import ParameterException
+from tags import TagDictionary, RowFormatter
+from tags import DEFAULT_POLL_CLASS, ALARM_POLL_CLASS, RECIPE_POLL_CLASS, PREFETCH_TAG
+
+# Trial runs the tests in _trial_temp, resolve the path while importing
+CONFIG = os.path.abspath(os.path.join(os.path.dirname(tags.__file__), 'config.ini'))
+
+SLC = '''[SLC]
+Header = Date, Time, RecipeName, Speed, Length
+Parameters = ST15:20, F8:11, N7:100
+Alarms = B3:0, N14:2/2
+'''
+
+
+def strRow(response, timestamp):
+    ''' The row LoggingLineWriter wrote before RowFormatter, str() of each value '''
+    response = utilities.flatten(list(response))
+    currentTime = time.localtime(timestamp)
+    stringData = time.strftime('%m/%d/%Y,', currentTime)
+    stringData += time.strftime('%T,', currentTime)
+    stringData += ','.join(map(str, response))
+    stringData += '\n'
+    return stringData
+
+
+class TagDictionaryConfigTest(unittest.TestCase):
+
+    def reader(self, path):
+        ''' Returns the real option reader on a config file '''
+        config = utilities.optionReader()
+        config.config = SafeConfigParser()
+        config.config.read([path])
+        return config
+
+    def compile(self, text):
+        ''' Compiles an [SLC] section '''
+        path = self.mktemp()
+        open(path, 'w').write(text)
+        return TagDictionary.fromConfig(self.reader(path))
+
+    def testShippedConfig(self):
+        config = self.reader(CONFIG)
+        compiled = TagDictionary.fromConfig(config)
+        self.assertEqual(len(compiled.getHeader()), len(config.getLoggerHeader()))
+
+    def testCompile(self):
+        compiled = self.compile(SLC + 'Scaling = 1, 0.1, 2\nOffsets = , 5\n'
+                                      'PollClass = oee, oee, fast\n'
+                                      'AlarmNames = , Fault\n'
+                                      'Recipe = N7:10, F8:20\n'
+                                      'PrefetchRecipeName = ST15:20\n')
+        self.assertEqual([tag.name for tag in compiled],
+                         ['RecipeName', 'Speed', 'Length', 'AlarmWord', 'Fault',
+                          'Recipe0', 'Recipe1', PREFETCH_TAG])
+        speed = compiled[compiled.lookup('Speed')]
+        self.assertEqual((speed.dataType, speed.scale, speed.offset), ('float32', 0.1, 5.0))
+        self.assertEqual(compiled[compiled.lookup('Fault')].dataType, 'bit')
+        self.assertEqual(compiled.pollClass(DEFAULT_POLL_CLASS), [0, 1])
+        self.assertEqual(compiled.pollClass('fast'), [2])
+        self.assertEqual(compiled.pollClass(ALARM_POLL_CLASS), [3, 4])
+        self.assertEqual(compiled.pollClass(RECIPE_POLL_CLASS), [5, 6])
+        # Only the logged poll class is in the header
+        self.assertEqual(compiled.getHeader(), ['Date', 'Time', 'RecipeName', 'Speed'])
+        self.assertEqual(compiled.locate((0x8D, 15, 20, 0)), [0, 7])
+
+    def testHeaderMismatch(self):
+        self.assertRaises(ParameterException, self.compile,
+                          SLC.replace(', Length', ''))
+
+    def testInvalidAddress(self):
+        self.assertRaises(ParameterException, self.compile,
+                          SLC.replace('N7:100', 'X9:1'))
+
+    def testDuplicateName(self):
+        self.assertRaises(ParameterException, self.compile,
+                          SLC.replace('Length', 'Speed'))
+
+    def testDuplicateAddress(self):
+        error = self.assertRaises(ParameterException, self.compile,
+                                  SLC.replace('N7:100', 'f8:11'))
+        self.assertIn('Duplicate address', str(error))
+
+    def testOverlap(self):
+        # A bit of a word that is also read whole
+        error = self.assertRaises(ParameterException, self.compile,
+                                  SLC.replace('N14:2/2', 'N14:2/2, N14:2'))
+        self.assertIn('overlaps', str(error))
+        # A timer's accumulator inside the timer
+        error = self.assertRaises(ParameterException, self.compile,
+                                  SLC.replace('Length', 'Length, Timer, Acc')
+                                     .replace('N7:100', 'N7:100, T4:0, T4:0.ACC'))
+        self.assertIn('overlaps', str(error))
+        # A bit in another poll class doesn't overlap
+        self.assertEqual(len(self.compile(SLC + 'Recipe = N7:100/3\n')), 6)
+
+    def testSharedWords(self):
+        # Bits of one word and the same address in another poll class
+        compiled = self.compile(SLC.replace('B3:0, N14:2/2', 'B3:0/1, B3:0/2, N14:2/2') +
+                                'PrefetchRecipeName = ST15:20\n')
+        self.assertEqual(len(compiled), 7)
+        self.assertRaises(ParameterException, self.compile,
+                          SLC.replace('B3:0, N14:2/2', 'B3:0/1, B3:0/1'))
+
+
+class RowFormatterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tags = TagDictionary()
+        self.handles = [self.tags.add('Count', 'N7:0'),
+                        self.tags.add('Speed', 'F8:0'),
+                        self.tags.add('Length', 'N7:1', scale='0.1'),
+                        self.tags.add('Double', 'N7:2', scale='2'),
+                        self.tags.add('Recipe', 'ST15:0')]
+        self.formatter = RowFormatter(self.tags, self.handles)
+        self.stamp = 1262390400.25
+
+    def assertSameRow(self, response):
+        expected = strRow(response, self.stamp)
+        self.assertEqual(self.formatter.format(response, self.stamp), expected)
+        return expected
+
+    def testIntegralFloats(self):
+        # str(1.0) is '1.0', the row must not drop the '.0'
+        row = self.assertSameRow([[7], [1.0], [100.0], [0.0], ['RG6']])
+        self.assertTrue(row.endswith(',7,1.0,100.0,0.0,RG6\n'))
+        self.assertEqual(self.formatter.fallbacks, 0)
+
+    def testFloats(self):
+        self.assertSameRow([[7], [0.1], [1234.5678901234], [1e16], ['RG6']])
+        self.assertSameRow([[-3], [-0.25], [2.5e-07], [3.0000000000001], ['']])
+
+    def testScaledTags(self):
+        raw = [[7], [12.5], [123], [5], ['RG6']]
+        response = self.tags.convert(self.handles, raw)
+        self.assertEqual(response[3], [10.0])
+        row = self.assertSameRow(response)
+        self.assertTrue(',10.0,RG6' in row)
+
+    def testStrings(self):
+        self.assertSameRow([[7], [1.5], [2], [3], ['RG 6, 75%']])
+
+    def testUnexpectedShapes(self):
+        # Records, bare values and a short row go the generic way
+        self.assertSameRow([[7, 8], [1.0], [2], [3], ['RG6']])
+        self.assertSameRow([7, 1.0, 2.0, 3, 'RG6'])
+        self.assertSameRow([[7], [(1.0, 2.0)], [2], [3], ['RG6']])
+        self.assertSameRow([[7], [1.0]])
+        self.assertEqual(self.formatter.fallbacks, 3)
+
+    def testTimePrefixCached(self):
+        first = self.formatter.format([[1], [1.0], [1], [1], ['a']], self.stamp)
+        second = self.formatter.format([[1], [1.0], [1], [1], ['a']], self.stamp + 0.5)
+        later = self.formatter.format([[1], [1.0], [1], [1], ['a']], self.stamp + 86400)
+        self.assertEqual(first, second)
+        self.assertEqual(later, strRow([[1], [1.0], [1], [1], ['a']], self.stamp + 86400))
@@ -0,0 +1,57 @@
+'''
+Token bucket pacing and the throttled file sender
+'''
+from cStringIO import StringIO
+
+from twisted.trial import unittest
+from twisted.test.proto_helpers import StringTransport
+
+from throttle import TokenBucket, ThrottledFileSender
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 100.0
+        self.bucket = TokenBucket(rate=1000, chunkSize=500, clock=lambda: self.now)
+
+    def testBurst(self):
+        # Starts full with two chunks, the third has to wait
+        for i in range(2):
+            self.assertEqual(self.bucket.delay(500), 0)
+            self.bucket.consume(500)
+        self.assertAlmostEqual(self.bucket.delay(500), 0.5)
+        self.assertEqual(self.bucket.waits, 1)
+
+    def testRefill(self):
+        self.bucket.consume(1000)
+        self.now += 0.25
+        self.assertAlmostEqual(self.bucket.delay(500), 0.25)
+        self.now += 0.25
+        self.assertEqual(self.bucket.delay(500), 0)
+
+    def testRefillCappedAtBurst(self):
+        self.now += 60
+        self.bucket.refill()
+        self.assertEqual(self.bucket.tokens, 1000)
+
+    def testUnlimited(self):
+        bucket = TokenBucket(rate=0, chunkSize=500, clock=lambda: self.now)
+        bucket.consume(10**9)
+        self.assertEqual(bucket.delay(10**9), 0)
+
+
+class ThrottledFileSenderTest(unittest.TestCase):
+
+    def testTransfer(self):
+        data = ''.join(chr(i % 251) for i in range(10000))
+        consumer = StringTransport()
+        sender = ThrottledFileSender(TokenBucket(chunkSize=4096))
+        d = sender.beginFileTransfer(StringIO(data), consumer)
+
+        def check(last):
+            self.assertEqual(consumer.value(), data)
+            self.assertEqual(last, data[-1])
+            self.assertEqual(sender.sent, len(data))
+            self.assertIdentical(consumer.producer, None)
+        return d.addCallback(check)
@@ -0,0 +1,65 @@
+'''
+PLC initiated writes decoded by the real framer and answered in turn
+'''
+from twisted.trial import unittest
+from twisted.internet import task
+from twisted.test.proto_helpers import StringTransport
+
+from async import SerialClientProtocol
+from df1 import DF1ClientProtocol
+from df1commands import protectedReadRequest, protectedWriteRequest, Command_0F_Response
+from tags import TagDictionary, TagCache
+from unsolicited import UnsolicitedServer
+
+
+class UnsolicitedProtocol(SerialClientProtocol):
+    ''' The DF1 client's unsolicited handling without its configuration '''
+    handleUnsolicited = DF1ClientProtocol.handleUnsolicited.im_func
+
+
+class UnsolicitedTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tags = TagDictionary()
+        self.footage = self.tags.add('Footage', 'N7:0')
+        self.cache = TagCache(self.tags)
+        self.protocol = UnsolicitedProtocol()
+        self.protocol.server = UnsolicitedServer(self.tags, self.cache)
+        self.protocol.callLater = task.Clock().callLater
+        self.transport = StringTransport()
+        self.protocol.makeConnection(self.transport)
+
+    def command(self, value, tid):
+        ''' Returns the frame of a MSG write the PLC sends '''
+        request = protectedWriteRequest(0, 'N7:0', [value])
+        request.transaction_id = tid
+        return request.encode()
+
+    def reply(self, tid):
+        ''' Returns the frame our reply to a PLC command must be '''
+        request = protectedWriteRequest(0, 'N7:0', [0])
+        reply = Command_0F_Response(request, dest=0, src=0, transaction=tid)
+        return reply.encode()
+
+    def testReplyWhenIdle(self):
+        self.protocol.dataReceived(self.command(1234, 0x1010))
+        self.assertEqual(self.cache.values[self.footage], 1234)
+        self.assertEqual(self.transport.value(), '\x10\x06' + self.reply(0x1010))
+
+    def testReplyWaitsForRequestInFlight(self):
+        request = protectedReadRequest(1, 'N7:0')
+        d = self.protocol.sendCommand(request)
+        sent = self.transport.value()
+        self.transport.clear()
+
+        # Only the link acknowledgement goes out while our request waits
+        self.protocol.dataReceived(self.command(5, 7))
+        self.assertEqual(self.cache.values[self.footage], 5)
+        self.assertEqual(self.transport.value(), '\x10\x06')
+
+        answer = Command_0F_Response(request, dest=0, src=1, records=[5])
+        answer.transaction_id = request.transaction_id
+        self.protocol.dataReceived(answer.encode())
+        self.assertEqual(self.transport.value(), '\x10\x06' + self.reply(7))
+        self.assertTrue(sent)
+        return d
@@ -0,0 +1,283 @@
+"""
+Upload Shaping
+-------------------------------------------
+
+A token bucket limited replacement for twisted's FileSender.  FileSender
+writes a new chunk every time the data connection drains, which keeps the
+reactor busy for the whole upload and delays the serial port callbacks
+(DF1 ACKs) on a Pi.  ThrottledFileSender instead writes one chunk per
+reactor turn and only when the shared bucket holds enough tokens, so the
+serial port gets serviced between every chunk and the uplink is never
+saturated.
+
+One bucket is shared by every upload, so concurrent transfers split the
+configured rate::
+
+    bucket = TokenBucket(rate=32768, chunkSize=4096)
+    sender = ThrottledFileSender(bucket)
+    d = sender.beginFileTransfer(open(path, 'rb'), consumer)
+
+Running the module measures the DF1 poll round trip against an emulated
+PLC on the loopback, idle and while an upload runs with FileSender and
+with ThrottledFileSender.  The figures depend on the machine, measure on
+the Pi::
+
+    python throttle.py [bytes/second]
+"""
+
+import time
+
+from twisted.internet import defer, interfaces, reactor
+from zope.interface import implements
+
+#---------------------------------------------------------------------------#
+# Logging
+#---------------------------------------------------------------------------#
+import logging
+_logger = logging.getLogger(__name__)
+
+
+class TokenBucket(object):
+    ''' Bytes per second budget shared by the uploads
+    '''
+
+    def __init__(self, rate=0, chunkSize=4096, burst=None, clock=time.time):
+        ''' Initializes a full bucket
+
+        :param rate: The refill rate in bytes/second, 0 is unlimited
+        :param chunkSize: The bytes written per reactor turn
+        :param burst: The bucket size (defaults to two chunks)
+        :param clock: The time source
+        '''
+        self.rate = rate
+        self.chunkSize = chunkSize
+        self.burst = burst or 2 * chunkSize
+        self.clock = clock
+        self.tokens = float(self.burst)
+        self.stamp = clock()
+        self.waits = 0
+
+    def refill(self):
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def delay(self, size):
+        ''' Returns 0 when size bytes may be sent now, or the seconds to
+        wait for enough tokens
+        '''
+        if not self.rate:
+            return 0
+        self.refill()
+        if self.tokens >= size:
+            return 0
+        self.waits += 1
+        return (size - self.tokens) / self.rate
+
+    def consume(self, size):
+        if self.rate:
+            self.tokens -= size
+
+
+class ThrottledFileSender(object):
+    ''' A push producer that sends a file at the bucket's rate
+    '''
+    implements(interfaces.IPushProducer)
+
+    def __init__(self, bucket):
+        ''' :param bucket: The TokenBucket the transfer draws from '''
+        self.bucket = bucket
+        self.file = None
+        self.consumer = None
+        self.deferred = None
+        self.lastSent = ''
+        self.paused = False
+        self.timer = None
+        self.sent = 0
+
+    def beginFileTransfer(self, file, consumer, transform=None):
+        ''' Begins transferring a file, like FileSender.beginFileTransfer
+
+        :param file: The file like object to read from
+        :param consumer: The consumer to write to
+        :param transform: An optional function applied to every chunk
+        :returns: A Deferred fired with the last byte sent
+        '''
+        self.file = file
+        self.consumer = consumer
+        self.transform = transform
+        self.deferred = defer.Deferred()
+        consumer.registerProducer(self, True)
+        self.schedule(0)
+        return self.deferred
+
+    def schedule(self, delay):
+        if self.timer is None and not self.paused:
+            self.timer = reactor.callLater(delay, self.sendChunk)
+
+    def sendChunk(self):
+        ''' Writes one chunk, then yields to the reactor '''
+        self.timer = None
+        if self.paused or self.file is None:
+            return
+        size = self.bucket.chunkSize
+        wait = self.bucket.delay(size)
+        if wait:
+            self.schedule(wait)
+            return
+        chunk = self.file.read(size)
+        if not chunk:
+            self.finish()
+            return
+        self.bucket.consume(len(chunk))
+        self.sent += len(chunk)
+        if self.transform:
+            chunk = self.transform(chunk)
+        self.lastSent = chunk[-1:]
+        self.consumer.write(chunk)
+        self.schedule(0)
+
+    def finish(self):
+        self.file = None
+        self.consumer.unregisterProducer()
+        if self.deferred:
+            self.deferred.callback(self.lastSent)
+            self.deferred = None
+
+    def pauseProducing(self):
+        self.paused = True
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+    def resumeProducing(self):
+        self.paused = False
+        self.schedule(0)
+
+    def stopProducing(self):
+        self.pauseProducing()
+        self.file = None
+        if self.deferred:
+            self.deferred.errback(Exception("Consumer asked us to stop producing"))
+            self.deferred = None
+
+
+#---------------------------------------------------------------------------#
+# Exported symbols
+#---------------------------------------------------------------------------#
+__all__ = [
+    "TokenBucket", "ThrottledFileSender",
+]
+
+
+if __name__ == "__main__":
+    import struct
+    import sys
+    from cStringIO import StringIO
+    from twisted.internet import protocol, task
+    from twisted.protocols.basic import FileSender
+    from async import SerialClientProtocol
+    from df1commands import protectedReadRequest, Command_0F_Response
+
+    rate = int(sys.argv[1]) if len(sys.argv) > 1 else 32768
+    polls, interval = 200, 0.05
+    payload = '10/18/2026,12:00:00,RG6,1,2.5,81234,3,100.0,1,55,98.5\n' * 20000
+    received = [0]
+
+    class EmulatedPLC(protocol.Protocol):
+        ''' Answers every read with one N7 word '''
+        buffer = ''
+
+        def dataReceived(self, data):
+            self.buffer += data
+            while len(self.buffer) > 1:
+                if self.buffer[1] != '\x02':
+                    # ENQ, ACK or NAK
+                    self.buffer = self.buffer[2:]
+                    continue
+                i = 2
+                while i + 1 < len(self.buffer) and self.buffer[i:i+2] != '\x10\x03':
+                    i += 2 if self.buffer[i:i+2] == '\x10\x10' else 1
+                if i + 4 > len(self.buffer):
+                    return
+                header = self.buffer[2:i].replace('\x10\x10', '\x10')
+                self.buffer = self.buffer[i+4:]
+                reply = Command_0F_Response(protectedReadRequest(1, 'N7:0'),
+                                            dest=0, src=1, records=[0])
+                reply.transaction_id, = struct.unpack('>H', header[4:6])
+                self.transport.write(reply.encode())
+
+    class Discard(protocol.Protocol):
+        def dataReceived(self, data):
+            received[0] += len(data)
+
+    class Upload(protocol.Protocol):
+        ''' Sends the payload over and over until stopped '''
+
+        def connectionMade(self):
+            self.factory.connected.callback(self)
+
+        def send(self, makeSender):
+            d = makeSender().beginFileTransfer(StringIO(payload), self.transport)
+            d.addCallbacks(lambda _: self.send(makeSender), lambda _: None)
+
+    def measure(client, name, makeSender=None):
+        ''' Polls the PLC, optionally while uploading, and prints the
+        round trip times
+        '''
+        times = []
+
+        def poll():
+            if len(times) >= polls:
+                loop.stop()
+                return
+            start = time.time()
+            d = client.sendCommand(protectedReadRequest(1, 'N7:0'))
+            d.addCallback(lambda _: times.append(time.time() - start))
+            return d
+
+        def upload(uploader):
+            received[0] = 0
+            uploader.send(makeSender)
+            return uploader
+
+        def report(uploader):
+            elapsed = time.time() - began
+            if uploader is not None:
+                uploader.transport.abortConnection()
+            times.sort()
+            line = "%-20s median %6.2f ms, 95%% %6.2f ms, max %6.2f ms" % (
+                name + ':', 1e3 * times[len(times) // 2],
+                1e3 * times[int(len(times) * 0.95)], 1e3 * times[-1])
+            if uploader is not None:
+                line += ", %.1f KB/s uploaded" % (received[0] / elapsed / 1024)
+            print line
+
+        d = defer.succeed(None)
+        if makeSender is not None:
+            factory = protocol.ClientFactory()
+            factory.protocol = Upload
+            factory.connected = defer.Deferred()
+            reactor.connectTCP('127.0.0.1', sink.getHost().port, factory)
+            d = factory.connected.addCallback(upload)
+        loop = task.LoopingCall(poll)
+        began = time.time()
+        d.addCallback(lambda uploader: loop.start(interval).addCallback(lambda _: uploader))
+        d.addCallback(report)
+        return d
+
+    def run(client):
+        print "poll round trip, %d polls every %d ms, machine dependent" % (
+            polls, 1e3 * interval)
+        d = measure(client, 'idle')
+        d.addCallback(lambda _: measure(client, 'FileSender', FileSender))
+        d.addCallback(lambda _: measure(client, 'ThrottledFileSender',
+                                        lambda: ThrottledFileSender(TokenBucket(rate))))
+        d.addErrback(lambda failure: failure.printTraceback())
+        d.addBoth(lambda _: reactor.stop())
+
+    plc = reactor.listenTCP(0, protocol.Factory.forProtocol(EmulatedPLC), interface='127.0.0.1')
+    sink = reactor.listenTCP(0, protocol.Factory.forProtocol(Discard), interface='127.0.0.1')
+    creator = protocol.ClientCreator(reactor, SerialClientProtocol)
+    creator.connectTCP('127.0.0.1', plc.getHost().port).addCallback(run)
+    reactor.run()
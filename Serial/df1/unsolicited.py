@@ -0,0 +1,169 @@
+"""
+Unsolicited DF1 Command Server
+-------------------------------------------
+
+Handles commands initiated by the PLC (MSG instructions) instead of
+replies to our own requests.  The ClientDecoder marks these messages
+with ``unsolicited = True`` when bit 6 of the command byte is clear.
+
+Protected typed logical writes (0x0F/0xAA) and masked bit writes
+(0x0F/0xAB) are stored into the TagCache for every tag configured on the
+written elements, which routes them to the cache subscribers (history,
+shared tag image, logger).  Every command is answered with a DF1 reply
+carrying the same transaction number so the MSG instruction completes.
+
+This lets the PLC push OEE data on change instead of being polled::
+
+    server = UnsolicitedServer(tags, cache)
+    reply = server.handle(request)
+    protocol.sendReply(reply)     # after any request in flight
+"""
+
+from df1commands import Command_0F_Response
+from serialexceptions import Exceptions
+
+#---------------------------------------------------------------------------#
+# Logging
+#---------------------------------------------------------------------------#
+import logging
+_logger = logging.getLogger(__name__)
+
+
+#---------------------------------------------------------------------------#
+# Constants
+#---------------------------------------------------------------------------#
+WRITE_FUNCTION = 0xAA
+BIT_WRITE_FUNCTION = 0xAB
+
+
+#---------------------------------------------------------------------------#
+# Server
+#---------------------------------------------------------------------------#
+class UnsolicitedServer(object):
+    ''' Applies PLC initiated writes to the tag cache and builds replies
+    '''
+
+    def __init__(self, tags, cache):
+        ''' Initializes the server
+
+        :param tags: The compiled TagDictionary
+        :param cache: The TagCache to store written values in
+        '''
+        self.tags = tags
+        self.cache = cache
+        self.words = {}
+        self.received = 0
+        self.routed = 0
+        self.unmapped = 0
+        self.rejected = 0
+        self.__handlers = {
+            WRITE_FUNCTION: self.handleWrite,
+            BIT_WRITE_FUNCTION: self.handleBitWrite,
+        }
+
+    def handle(self, request):
+        ''' Processes a PLC initiated command
+
+        :param request: The decoded request PDU
+        :returns: The reply PDU to send back to the PLC
+        '''
+        self.received += 1
+        handler = self.__handlers.get(request.function)
+        if handler is None:
+            _logger.debug("Rejecting PLC command function %d" % request.function)
+            self.rejected += 1
+            return self.buildReply(request, Exceptions.IllegalCommand)
+        try:
+            handler(request)
+        except Exception, ex:
+            _logger.error("Unable to apply PLC write: %s" % ex)
+            self.rejected += 1
+            return self.buildReply(request, Exceptions.AddrProblem)
+        return self.buildReply(request)
+
+    def buildReply(self, request, sts=Exceptions.Success_no_error):
+        ''' Builds the DF1 reply for a command
+
+        :param request: The command being answered
+        :param sts: The status code of the reply
+        :returns: An encodable Command_0F_Response
+        '''
+        return Command_0F_Response(request, dest=request.src, src=request.dest,
+                                   sts=sts, transaction=request.transaction_id)
+
+    def handleWrite(self, request):
+        ''' Applies a typed write of one or more consecutive elements
+
+        :param request: The decoded protectedWriteRequest
+        '''
+        Address = request.Address
+        results, handles = [], []
+        for i in range(len(request.values)):
+            key = (Address.fileType, Address.fileNumber,
+                   Address.eleNumber + i, Address.subElement)
+            value = request.values[i]
+            if isinstance(value, int):
+                self.words[key] = value
+            self.__collect(key, value, results, handles)
+        self.__route(results, handles)
+
+    def handleBitWrite(self, request):
+        ''' Applies a masked write to a single word
+
+        :param request: The decoded protectedBitWriteRequest
+        '''
+        Address = request.Address
+        key = (Address.fileType, Address.fileNumber,
+               Address.eleNumber, Address.subElement)
+        whole = (request.mask == 0xFFFF) or key in self.words
+        word = (self.words.get(key, 0) & ~request.mask) | (request.values[0] & request.mask)
+        self.words[key] = word
+        results, handles = [], []
+        self.__collect(key, word, results, handles, request.mask, whole)
+        self.__route(results, handles)
+
+    def __collect(self, key, value, results, handles, mask=0xFFFF, whole=True):
+        ''' Adds the values of every tag on an element
+
+        :param key: The element key
+        :param value: The value written to the element
+        :param results: The list to add converted values to
+        :param handles: The list to add tag handles to
+        :param mask: The bits of the element that were written
+        :param whole: False when the rest of the word is not known yet
+        '''
+        located = self.tags.locate(key)
+        if not located:
+            self.unmapped += 1
+            return
+        for handle in located:
+            tag = self.tags[handle]
+            bitNumber = tag.Address.bitNumber
+            if bitNumber is not None:
+                if not mask & (1 << bitNumber):
+                    continue
+                results.append([(int(value) >> bitNumber) & 1])
+            elif not whole:
+                continue
+            else:
+                results.append([tag.convert(value)])
+            handles.append(handle)
+
+    def __route(self, results, handles):
+        ''' Stores collected values in the cache '''
+        if handles:
+            self.routed += len(handles)
+            self.cache.update(results, handles)
+
+    def getStats(self):
+        ''' Returns the command counters '''
+        return {'received': self.received, 'routed': self.routed,
+                'unmapped': self.unmapped, 'rejected': self.rejected}
+
+
+#---------------------------------------------------------------------------#
+# Exported symbols
+#---------------------------------------------------------------------------#
+__all__ = [
+    "UnsolicitedServer",
+]
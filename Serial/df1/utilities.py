@@ -1,3 +1,4 @@
+import os
 import re
 from twisted.python import usage
 from ConfigParser import SafeConfigParser
@@ -19,11 +20,77 @@ class optionReader(object):
         recepient = self.config.get('Email', 'To')
         return (sender, recepient)
 
+    def getAlertOptions(self):
+        ''' Returns the alert batching and re-notify options, or the defaults
+
+        RenotifyBits overrides the interval of single alarm bits as a
+        comma separated list of mask:seconds pairs
+        '''
+        options = {}
+        if self.config.has_option('Email', 'Window'):
+            options['window'] = self.config.getfloat('Email', 'Window')
+        if self.config.has_option('Email', 'Renotify'):
+            options['renotify'] = self.config.getfloat('Email', 'Renotify')
+        if self.config.has_option('Email', 'RenotifyBits'):
+            intervals = {}
+            for pair in self.config.get('Email', 'RenotifyBits').split(','):
+                if pair.strip():
+                    mask, seconds = pair.split(':')
+                    intervals[int(mask)] = float(seconds)
+            options['intervals'] = intervals
+        return options
+
+    def getMXCacheTTL(self):
+        if self.config.has_option('Email', 'MXCacheTTL'):
+            return self.config.getfloat('Email', 'MXCacheTTL')
+        return 3600
+
     def getFTPDirectories(self):
         localLog = self.config.get('FTP', 'localLogDir')
         remoteLog = self.config.get('FTP', 'remoteLogDir')
         return (localLog, remoteLog)
 
+    def getFTPPoolOptions(self):
+        ''' Returns the FTP session pool options, or the defaults '''
+        options = {}
+        if self.config.has_option('FTP', 'Sessions'):
+            options['size'] = self.config.getint('FTP', 'Sessions')
+        if self.config.has_option('FTP', 'KeepAlive'):
+            options['keepalive'] = self.config.getfloat('FTP', 'KeepAlive')
+        return options
+
+    def getUploadShaping(self):
+        ''' Returns the upload token bucket options, or the defaults '''
+        options = {}
+        if self.config.has_option('FTP', 'UploadRate'):
+            options['rate'] = self.config.getint('FTP', 'UploadRate')
+        if self.config.has_option('FTP', 'UploadChunk'):
+            options['chunkSize'] = self.config.getint('FTP', 'UploadChunk')
+        return options
+
+    def getOutboxOptions(self):
+        ''' Returns the [Outbox] upload queue options, or the defaults '''
+        options = {'path': os.path.join(self.getFTPDirectories()[0], 'outbox.idx')}
+        for option, key, getter in (('Path', 'path', self.config.get),
+                                    ('MaxChunk', 'maxChunk', self.config.getint),
+                                    ('Backoff', 'backoff', self.config.getfloat),
+                                    ('MaxBackoff', 'maxBackoff', self.config.getfloat)):
+            if self.config.has_option('Outbox', option):
+                options[key] = getter('Outbox', option)
+        return options
+
+    def getRecipeConcurrency(self):
+        ''' Returns the number of recipe downloads run at once '''
+        if self.config.has_option('FTP', 'RecipeDownloads'):
+            return self.config.getint('FTP', 'RecipeDownloads')
+        return 2
+
+    def getRecipeBundle(self):
+        ''' Returns the remote recipe archive, or None for file by file sync '''
+        if self.config.has_option('FTP', 'RecipeBundle'):
+            return self.config.get('FTP', 'RecipeBundle').strip() or None
+        return None
+
     def getRecipeDirectories(self):
         localDir = self.config.get('FTP', 'localRecipeDir')
         remoteDir = self.config.get('FTP', 'remoteRecipeDir')
@@ -44,9 +111,111 @@ class optionReader(object):
     def getPLCAlarms(self):
         return self.config.get('SLC', 'Alarms').split(',')
 
+    def getPrefetchRecipeName(self):
+        ''' Returns the recipe name address watched for prefetch, or None '''
+        if self.config.has_option('SLC', 'PrefetchRecipeName'):
+            return self.config.get('SLC', 'PrefetchRecipeName').strip() or None
+        return None
+
+    def getRecipeLoadOptions(self):
+        ''' Returns the recipe load retry options, or the defaults '''
+        options = {}
+        if self.config.has_option('SLC', 'RecipeRetries'):
+            options['retries'] = self.config.getint('SLC', 'RecipeRetries')
+        if self.config.has_option('SLC', 'RecipeTimeout'):
+            options['timeout'] = self.config.getfloat('SLC', 'RecipeTimeout')
+        return options
+
     def getPLCRecipe(self):
+        # Without a layout no recipe plans are compiled, see recipeplan
+        if not self.config.has_option('SLC', 'Recipe'):
+            return []
         return self.config.get('SLC', 'Recipe').split(',')
 
+    def getTagOption(self, option, count, default):
+        ''' Returns an optional [SLC] list parallel to the tag addresses
+
+        :param option: The [SLC] option name
+        :param count: The number of entries expected
+        :param default: The value used when the option or an entry is missing
+        '''
+        values = []
+        if self.config.has_option('SLC', option):
+            values = self.config.get('SLC', option).split(',')
+        values = [v.strip() or default for v in values[:count]]
+        return values + [default]*(count-len(values))
+
+    def hasOption(self, section, option):
+        return self.config.has_option(section, option)
+
+    def getHistorySizes(self):
+        ''' Returns the [History] ring buffer sizes, or the defaults '''
+        sizes = {'rawSize': 3600, 'seconds': 3600, 'minutes': 1440, 'hours': 168}
+        options = {'rawSize': 'RawSamples', 'seconds': 'Seconds',
+                   'minutes': 'Minutes', 'hours': 'Hours'}
+        for key, option in options.items():
+            if self.config.has_option('History', option):
+                sizes[key] = self.config.getint('History', option)
+        return sizes
+
+    def getTagImagePath(self):
+        ''' Returns the shared tag image file, or None if not published '''
+        if self.config.has_option('TagImage', 'Path'):
+            return self.config.get('TagImage', 'Path')
+        return None
+
+    def getLoggingOptions(self):
+        ''' Returns the [Logging] buffered writer options, or the defaults '''
+        options = {'flushBytes': 0, 'flushInterval': 0, 'fsyncOnRotate': False,
+                   'compress': None}
+        if self.config.has_option('Logging', 'FlushBytes'):
+            options['flushBytes'] = self.config.getint('Logging', 'FlushBytes')
+        if self.config.has_option('Logging', 'FlushInterval'):
+            options['flushInterval'] = self.config.getfloat('Logging', 'FlushInterval')
+        if self.config.has_option('Logging', 'FsyncOnRotate'):
+            options['fsyncOnRotate'] = self.config.getboolean('Logging', 'FsyncOnRotate')
+        if self.config.has_option('Logging', 'Compress'):
+            codec = self.config.get('Logging', 'Compress').strip().lower()
+            options['compress'] = None if codec == 'none' else codec
+        if self.config.has_option('Logging', 'IndexEvery'):
+            options['indexEvery'] = self.config.getint('Logging', 'IndexEvery')
+        return options
+
+    def getBinaryLogging(self):
+        ''' Returns True if the binary log sink is enabled '''
+        if self.config.has_option('Logging', 'Binary'):
+            return self.config.getboolean('Logging', 'Binary')
+        return False
+
+    def getWriterOptions(self):
+        ''' Returns the log writer thread options, or None when disabled '''
+        if not (self.config.has_option('Logging', 'WriterThread') and
+                self.config.getboolean('Logging', 'WriterThread')):
+            return None
+        options = {}
+        if self.config.has_option('Logging', 'QueueSize'):
+            options['maxsize'] = self.config.getint('Logging', 'QueueSize')
+        if self.config.has_option('Logging', 'QueuePolicy'):
+            options['policy'] = self.config.get('Logging', 'QueuePolicy').strip().lower()
+        return options
+
+    def getSQLiteOptions(self):
+        ''' Returns the [SQLite] sink options, or None when disabled '''
+        if not self.config.has_option('SQLite', 'Path'):
+            return None
+        options = {'path': self.config.get('SQLite', 'Path')}
+        if self.config.has_option('SQLite', 'CommitInterval'):
+            options['commitInterval'] = self.config.getfloat('SQLite', 'CommitInterval')
+        if self.config.has_option('SQLite', 'RetentionDays'):
+            options['retentionDays'] = self.config.getint('SQLite', 'RetentionDays')
+        return options
+
+    def getSummaryOptions(self):
+        ''' Returns the [Summary] OEE summary options, or None when disabled '''
+        if not self.config.has_option('Summary', 'Shifts'):
+            return None
+        return {'shifts': self.config.get('Summary', 'Shifts').split(',')}
+
     def getAlarmTime(self):
         return self.config.getfloat('RS-232', 'AlarmTime')
 